@@ -1,26 +1,44 @@
 import asyncio
 import re
+import socket
 import time
 from hashlib import md5
 from shared import Shared
+from fanout import Fanout
+from gop import GopCache
+from metrics import Metrics
+from recorder import Recorder
+from frametap import FrameTap
+from rtsp import RtspParser
 from config import Config
 from log import Log
 
+_REALM = re.compile(r'realm="(.+?)"')
+_NONCE = re.compile(r'nonce="(.+?)"')
+_SEQ = re.compile(r';seq=(\d+)')
+_RTPTIME = re.compile(r';rtptime=(\d+)')
+_TRACK_ID = re.compile(r'a=control:.*?(track.*?\d)')
+_TIMEOUT = re.compile(r';\s*timeout=(\d+)')
+
+
 class Camera:
     def __init__(self, hash):
         self.hash = hash
         self.url = self._parse_url(Config.cameras[hash]['url'])
+        self.udp_ports = self._get_self_udp_ports()
+        self.udp_transports = {}
+        self.reader, self.writer = None, None
 
     async def connect(self):
-        self.udp_ports = self._get_self_udp_ports()
         self.cseq = 1
         self.realm, self.nonce = None, None
+        self.session_timeout = 60
 
-        try:
-            self.reader, self.writer = await asyncio.open_connection(self.url['host'], self.url['tcp_port'])
-        except Exception as e:
-            print(f"Can't connect to camera [{self.hash}]: {e}")
-            return
+        self.reader, self.writer = await asyncio.wait_for(
+            asyncio.open_connection(self.url['host'], self.url['tcp_port']),
+            Config.connect_timeout)
+        self.parser = RtspParser()
+        self.replies = []
 
         await self._request('OPTIONS', self.url['url'])
 
@@ -49,6 +67,7 @@ class Camera:
                 f'client_port={self.udp_ports["track1"][0]}-{self.udp_ports["track1"][1]}'))
 
         self.session_id = self._get_session_id(reply)
+        self.session_timeout = self._get_session_timeout(reply)
 
         if len(track_ids) > 1:
             reply, code = await self._request(
@@ -64,23 +83,131 @@ class Camera:
             f'Session: {self.session_id}',
             'Range: npt=0.000-')
 
-        Shared.data[self.hash] = {
-            'description': self.description,
-            'rtp_info': self._get_rtp_info(reply),
-            # 'transports': {},
-            'clients': {}}
+        rtp_info = self._get_rtp_info(reply)
+
+        if self.hash in Shared.data:
+            # переподключение: подписанные клиенты остаются на месте
+            Shared.data[self.hash]['description'] = self.description
+            Shared.data[self.hash]['rtp_info'] = rtp_info
+        else:
+            Shared.data[self.hash] = {
+                'description': self.description,
+                'rtp_info': rtp_info,
+                # 'transports': {},
+                'clients': {}}
 
+        Metrics.inc('camera_connects')
         Log.add(f'Camera [{self.hash}] connected')
 
         await self._listen()
 
+    async def keepalive(self):
+        """
+        Держим RTSP сессию камеры, пока та отвечает и шлет RTP.
+        Возвращается исключением, когда камера закрыла соединение,
+        перестала отвечать или дольше rtp_timeout не присылает видео
+        """
+        loop = asyncio.get_running_loop()
+        option = 'GET_PARAMETER'
+        interval = max(self.session_timeout / 2, 1)
+        # соединение и поток проверяем чаще, чем отправляем keepalive
+        check = min(interval, max(Config.rtp_timeout / 2, 0.1))
+
+        stats = Metrics.track(self.hash, 'track1')
+        packets, last_packet = stats.packets_in, loop.time()
+        next_keepalive = loop.time() + interval
+
+        while True:
+            await self._watch_connection(check)
+
+            now = loop.time()
+            if stats.packets_in != packets:
+                packets, last_packet = stats.packets_in, now
+            elif now - last_packet >= Config.rtp_timeout:
+                raise RuntimeError(f'No RTP for {now - last_packet:.0f}s')
+
+            if now < next_keepalive:
+                continue
+            next_keepalive = now + interval
+            reply, code = await self._request(option, self.url['url'], f'Session: {self.session_id}')
+            if code in (405, 501) and option == 'GET_PARAMETER':
+                option = 'OPTIONS'
+                reply, code = await self._request(option, self.url['url'], f'Session: {self.session_id}')
+            if code != 200:
+                raise RuntimeError(f'Keepalive failed with code {code}')
+
+    async def _watch_connection(self, timeout):
+        """Ждем timeout секунд, читая RTSP соединение: закрытие камерой видно сразу"""
+        try:
+            data = await asyncio.wait_for(self.reader.read(4096), timeout)
+        except asyncio.TimeoutError:
+            return
+        if not data:
+            raise ConnectionError('Camera closed connection')
+        self.replies.extend(self.parser.feed(data))
+
+    def close(self):
+        if self.writer:
+            self.writer.close()
+        self.reader, self.writer = None, None
+
+    def stop(self):
+        """
+        Полная остановка камеры: TEARDOWN (без ожидания ответа),
+        закрытие TCP соединения и UDP портов
+        """
+        if self.writer and getattr(self, 'session_id', None):
+            try:
+                self.writer.write(self._command(
+                    'TEARDOWN', self.url['url'], f'Session: {self.session_id}').encode())
+            except Exception:
+                pass
+        self.close()
+
+        for track_id, transport in self.udp_transports.items():
+            transport.close()
+            GopCache.caches.pop((self.hash, track_id), None)
+            Fanout.transports.pop((self.hash, track_id), None)
+        self.udp_transports = {}
+
     async def _listen(self):
-        await self._start_server('track1')
+        if 'track1' not in self.udp_transports:
+            await self._start_server('track1')
 
-        if self.description['audio']:
+        if self.description['audio'] and 'track2' not in self.udp_transports:
             await self._start_server('track2')
 
+        # после (пере)подключения старый GOP и нумерация пакетов недействительны
+        for track_id, media in (('track1', 'video'), ('track2', 'audio')):
+            cache = GopCache.caches.get((self.hash, track_id))
+            if cache:
+                cache.set_codec(self.description[media].get('rtpmap', ''))
+            stats = Metrics.tracks.get((self.hash, track_id))
+            if stats:
+                stats.reset()
+
+        tap = FrameTap.taps.get(self.hash)
+        if tap:
+            tap.set_format(self.description['video'])
+
     async def _request(self, option, url, *lines):
+        command = self._command(option, url, *lines)
+
+        if Log.enabled('debug'):
+            Log.debug(f'Ask:\n{command}')
+        started = time.perf_counter()
+        self.writer.write(command.encode())
+        reply = await asyncio.wait_for(self._read_reply(), Config.request_timeout)
+        Metrics.observe('camera', option, time.perf_counter() - started)
+        if Log.enabled('debug'):
+            Log.debug(f'Reply:\n{reply.raw}')
+        self.cseq += 1
+
+        if not reply.code:
+            Log.error(f'Camera [{self.hash}] invalid reply to {option}')
+        return reply, reply.code
+
+    def _command(self, option, url, *lines):
         command = f'{option} {url} RTSP/1.0\r\n' \
             f'CSeq: {self.cseq}\r\n'
 
@@ -92,25 +219,23 @@ class Camera:
             if row:
                 command += f'{row}\r\n'
         command += '\r\n'
+        return command
 
-        print(f'*** Ask:\n{command}')
-        self.writer.write(command.encode())
-        reply = (await self.reader.read(4096)).decode()
-        print(f"*** Reply:\n{reply}")
-        self.cseq += 1
-
-        res = re.match(r'RTSP/1.0 (\d{3}) ([^\r\n]+)', reply)
-        if not res:
-            print('Error: invalid reply\n')
-            return reply, 0
-        return reply, int(res.group(1))
+    async def _read_reply(self):
+        while not self.replies:
+            data = await self.reader.read(4096)
+            if not data:
+                raise ConnectionError('Camera closed connection')
+            self.replies.extend(self.parser.feed(data))
+        return self.replies.pop(0)
 
     def _get_auth_params(self, reply):
-        realm_nonce = re.match(r'.+?\nWWW-Authenticate:.+?realm="(.+?)", ?nonce="(.+?)"', reply, re.DOTALL)
-        if not realm_nonce:
-            raise RuntimeError('Invalid digest auth reply')
+        for line in reply.header('WWW-Authenticate', '').split('\n'):
+            realm, nonce = _REALM.search(line), _NONCE.search(line)
+            if realm and nonce:
+                return realm.group(1), nonce.group(1)
 
-        return realm_nonce.group(1), realm_nonce.group(2)
+        raise RuntimeError('Invalid digest auth reply')
 
     def _get_auth_line(self, option):
         if not self.realm or not self.nonce:
@@ -123,64 +248,66 @@ class Camera:
         return line
 
     def _get_description(self, reply):
-        blocks = reply.split('\r\n\r\n', 2)
-        if len(blocks) < 2:
+        sdp = reply.body.strip()
+        if not sdp:
             raise RuntimeError('Invalid DESCRIBE reply')
 
-        sdp = blocks[1].strip()
-
         details = {'video': {}, 'audio': {}}
 
-        res = re.match(r'.+?\nm=video (.+?)\r\n', sdp, re.DOTALL)
-        if res:
-            details['video'] = {'media': res.group(1), 'bandwidth': '', 'rtpmap': '', 'format': ''}
-
-            res = re.match(r'.+?\nm=video .+?\nb=([^\r\n]+)', sdp, re.DOTALL)
-            if res:
-                details['video']['bandwidth'] = res.group(1)
-
-            res = re.match(r'.+?\nm=video .+?\na=rtpmap:([^\r\n]+)', sdp, re.DOTALL)
-            if res:
-                details['video']['rtpmap'] = res.group(1)
-
-            res = re.match(r'.+?\nm=video .+?\na=fmtp:([^\r\n]+)', sdp, re.DOTALL)
-            if res:
-                details['video']['format'] = res.group(1)
-
-        res = re.match(r'.+?\nm=audio (.+?)\r\n', sdp, re.DOTALL)
-        if res:
-            details['audio'] = {'media': res.group(1), 'rtpmap': ''}
-
-            res = re.match(r'.+?\nm=audio .+?\na=rtpmap:([^\r\n]+)', sdp, re.DOTALL)
-            if res:
-                details['audio']['rtpmap'] = res.group(1)
+        # один проход по строкам SDP, атрибуты относим к текущей медиа-секции
+        media = None
+        for line in sdp.splitlines():
+            key, _, value = line.partition('=')
+            if key == 'm':
+                kind, _, rest = value.partition(' ')
+                media = kind if kind in details and not details[kind] else None
+                if media == 'video':
+                    details['video'] = {'media': rest, 'bandwidth': '', 'rtpmap': '', 'format': ''}
+                elif media == 'audio':
+                    details['audio'] = {'media': rest, 'rtpmap': ''}
+                continue
+            if not media:
+                continue
+
+            section = details[media]
+            if key == 'b' and media == 'video' and not section['bandwidth']:
+                section['bandwidth'] = value
+            elif key == 'a' and value.startswith('rtpmap:') and not section['rtpmap']:
+                section['rtpmap'] = value[7:]
+            elif key == 'a' and value.startswith('fmtp:') and media == 'video' and not section['format']:
+                section['format'] = value[5:]
 
         return details
 
     def _get_rtp_info(self, reply):
-        res = re.match(r'.+?\r\n(RTP-Info: .+?)\r\n', reply, re.DOTALL)
-        if not res:
+        rtp_info = reply.header('RTP-Info')
+        if not rtp_info:
             raise RuntimeError('Invalid RTP-Info')
-        rtp_info = res.group(1)
 
-        seq = re.findall(r';seq=(\d+)', rtp_info)
-        rtptime = re.findall(r';rtptime=(\d+)', rtp_info)
+        seq = _SEQ.findall(rtp_info)
+        rtptime = _RTPTIME.findall(rtp_info)
         if not seq or not rtptime:
             raise RuntimeError('Invalid RTP-Info')
 
         return {'seq': seq, 'rtptime': rtptime, 'starttime': time.time()}
 
     def _get_track_ids(self, reply):
-        track_ids = re.findall(r'\na=control:.*?(track.*?\d)', reply, re.DOTALL)
+        track_ids = _TRACK_ID.findall(reply.body)
         if not track_ids:
             raise RuntimeError('Invalid track ID in reply')
         return track_ids
 
     def _get_session_id(self, reply):
-        res = re.match(r'.+?\nSession: *([^;]+)', reply, re.DOTALL)
-        if not res:
+        session = reply.header('Session')
+        if not session:
             raise RuntimeError('Invalid session ID')
-        return res.group(1)
+        return session.split(';', 1)[0].strip()
+
+    def _get_session_timeout(self, reply):
+        res = _TIMEOUT.search(reply.header('Session', ''))
+        if not res:
+            return 60
+        return int(res.group(1))
 
     def _get_self_udp_ports(self):
         start_port = Config.start_udp_port
@@ -203,22 +330,78 @@ class Camera:
     async def _start_server(self, track_id):
         loop = asyncio.get_running_loop()
 
-        await loop.create_datagram_endpoint(
-            lambda: CameraUdpProtocol(self.hash, track_id),
-            local_addr=('0.0.0.0', self.udp_ports[track_id][0]))
+        # сокет создаем сами, чтобы протокол мог вычитывать его пачками
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.setblocking(False)
+        sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, Config.multicast_ttl)
+        sock.bind(('0.0.0.0', self.udp_ports[track_id][0]))
+
+        transport, _protocol = await loop.create_datagram_endpoint(
+            lambda: CameraUdpProtocol(self.hash, track_id, sock),
+            sock=sock)
+        self.udp_transports[track_id] = transport
 
 
 class CameraUdpProtocol(asyncio.DatagramProtocol):
-    def __init__(self, hash, track_id):
+    def __init__(self, hash, track_id, sock):
         self.hash = hash
         self.track_id = track_id
+        self.key = (hash, track_id)
+        self.sock = sock
+        # при gop_cache_size = 0 кеш пустой, но ключевые кадры по-прежнему находит
+        self.gop = GopCache(hash, track_id, Config.gop_cache_size)
+        self.stats = Metrics.track(hash, track_id)
+        self.recorder = Recorder.get(hash)
+        self.tap = FrameTap.get(hash) if track_id == 'track1' else None
 
     def connection_made(self, transport):
         self.transport = transport
+        Fanout.transports[self.key] = transport
+
+    def error_received(self, exc):
+        self.stats.send_errors += 1
 
     def datagram_received(self, data, addr):
-        if not Shared.data[self.hash]['clients']:
+        targets = Fanout.targets.get(self.key)
+        gop = self.gop
+
+        # забираем из сокета все, что уже пришло, и рассылаем одной пачкой
+        packets = [data]
+        size = len(data)
+        recv = self.sock.recv
+        for _ in range(Config.udp_batch - 1):
+            try:
+                data = recv(65536)
+            except OSError:
+                break
+            packets.append(data)
+            size += len(data)
+
+        # время прихода известно только для первого пакета, остальные ждали в буфере сокета
+        stats = self.stats
+        now = time.time()
+        stats.received(packets[0], now)
+        for i in range(1, len(packets)):
+            stats.received(packets[i])
+
+        # индекс первого пакета, с которого можно начать декодирование
+        key = -1
+        for i, data in enumerate(packets):
+            if gop.add(data) and key < 0:
+                key = i
+
+        if self.recorder:
+            self.recorder.write(self.track_id, packets, now, key)
+        if self.tap:
+            self.tap.feed(packets, key)
+
+        if not targets:
             return
-
-        for _sid, client in Shared.data[self.hash]['clients'].items():
-            self.transport.sendto(data, (client['host'], client['ports'][self.track_id][0]))
\ No newline at end of file
+        # TCP адресаты могут выбросить пачку: считаем только отправленное
+        packets_out = bytes_out = 0
+        for target in targets:
+            sent, sent_bytes = target.send(self.transport, packets, size, key)
+            packets_out += sent
+            bytes_out += sent_bytes
+        stats.packets_out += packets_out
+        stats.bytes_out += bytes_out
@@ -1,16 +1,32 @@
 import asyncio
+import ipaddress
 import re
 import string
 import time
 from random import choices, randrange
 from config import Config
 from shared import Shared
+from fanout import Fanout, TcpTarget
+from gop import GopCache
 from log import Log
+from rtsp import RtspParser
+from supervisor import Supervisor
+from metrics import Metrics
+
+_URL = re.compile(r'rtsps?://[^/]+?:\d+/?(.*)')
+_CLIENT_PORT = re.compile(r'client_port=(\d+)-(\d+)')
+_INTERLEAVED = re.compile(r'interleaved=(\d+)-(\d+)')
 
 class Client():
     def __init__(self):
         self.camera_hash = None
         self.udp_ports = {}
+        self.interleaved = {}
+        self.track_starts = {}
+        # interleaved треки, GOP которых не влезает в буфер соединения
+        self.skip_to_key = set()
+        # track_id -> multicast группа; остальные треки клиента идут ему напрямую
+        self.multicast = {}
 
     @staticmethod
     async def listen():
@@ -19,20 +35,23 @@ class Client():
         """
 
         host = "0.0.0.0"
-        print(f'*** Start listening {host}:{Config.rtsp_port} ***\n')
+        Log.add(f'Start listening {host}:{Config.rtsp_port}')
 
         loop = asyncio.get_running_loop()
         server = await loop.create_server(
-            lambda: Client(), host, Config.rtsp_port
+            lambda: ClientTcpProtocol(), host, Config.rtsp_port
         )
         
         async with server:
             await server.serve_forever()
 
-    def handle_request(self, transport, host, data):
-        ask, option = self._request(data)
+    def handle_request(self, transport, host, ask):
+        option = self._request(ask)
         session_id = self._get_session_id(ask)
 
+        if option == 'SETUP':
+            Supervisor.touch(self.camera_hash)
+
         if option == 'OPTIONS':
             self._response(
                 transport,
@@ -47,9 +66,33 @@ class Client():
                 '',
                 sdp)
 
+        elif option == 'SETUP' and 'interleaved=' in ask.header('Transport', ''):
+            channels = self._get_channels(ask)
+            track_id = self._get_next_track_id()
+            self.interleaved[track_id] = channels
+            self._response(
+                transport,
+                f'Transport: RTP/AVP/TCP;unicast;interleaved={channels[0]}-{channels[1]}',
+                f'Session: {session_id};timeout=60')
+
+        elif option == 'SETUP' and 'multicast' in ask.header('Transport', ''):
+            if self._get_client_type(host) == 'web':
+                # multicast доступен только в локальной сети
+                self._response(transport, status='461 Unsupported Transport')
+                return self.camera_hash, None
+
+            track_id = self._get_next_track_id()
+            group, port = self._get_multicast_address(track_id)
+            self.udp_ports[track_id] = [port, port + 1]
+            self.multicast[track_id] = group
+            self._response(
+                transport,
+                f'Transport: RTP/AVP;multicast;destination={group};port={port}-{port + 1};ttl={Config.multicast_ttl}',
+                f'Session: {session_id};timeout=60')
+
         elif option == 'SETUP':
             udp_ports = self._get_ports(ask)
-            track_id = 'track1' if not self.udp_ports else 'track2'
+            track_id = self._get_next_track_id()
             self.udp_ports[track_id] = udp_ports
             self._response(
                 transport,
@@ -64,7 +107,11 @@ class Client():
 
             # if session_id not in Shared.data[self.camera_hash]['clients']:
             Shared.data[self.camera_hash]['clients'][session_id] = {
-                'host': host, 'ports': self.udp_ports, 'transport': transport}
+                'host': host, 'ports': self.udp_ports, 'transport': transport, 'multicast': self.multicast,
+                'interleaved': self.interleaved, 'protocol': transport.get_protocol(),
+                'skip_to_key': self.skip_to_key}
+            self._replay_gop(host, transport)
+            Fanout.rebuild(self.camera_hash)
 
             self._check_web_limit(host)
 
@@ -78,52 +125,93 @@ class Client():
     def _get_rtp_info(self):
         rtp_info = Shared.data[self.camera_hash]['rtp_info']
 
-        print(rtp_info)
-
         delta = time.time() - rtp_info['starttime']
         rtptime = int(rtp_info["rtptime"][0]) + int(delta * 90000)
         # 90000 is clock frequency in SDP a=rtpmap:96 H26*/90000
+        seq, rtptime = self._get_track_start('track1', rtp_info['seq'][0], rtptime)
 
         res = f'RTP-Info: url=rtsp://{Config.local_ip}:{Config.rtsp_port}/track1;' \
-            f'seq={rtp_info["seq"][0]};rtptime={rtptime}'
+            f'seq={seq};rtptime={rtptime}'
 
         if len(rtp_info['seq']) < 2:
             return res
 
         rtptime = int(rtp_info["rtptime"][1]) + int(delta * 8000)
         # 90000 is clock frequency in SDP a=rtpmap:8 PCMA/8000
+        seq, rtptime = self._get_track_start('track2', rtp_info['seq'][1], rtptime)
 
         res += f',url=rtsp://{Config.local_ip}:{Config.rtsp_port}/track2;' \
-            f'seq={rtp_info["seq"][1]};rtptime={rtptime}'
+            f'seq={seq};rtptime={rtptime}'
 
         return res
 
-    def _request(self, data):
-        try:
-            ask = data.decode()
-        except Exception:
-            raise RuntimeError(f"can't decode this ask:\n{data}")
-
-        print(f'*** Ask:\n{ask}')
-        # res = re.match(r'(.+?) rtsps?://.+?:\d+/(.+?)(/track.*?)? .+?\r\n', ask)
-        res = re.match(r'(.+?) rtsps?://.+?:\d+/?(.*?) .+?\r\n', ask)
+    def _get_track_start(self, track_id, seq, rtptime):
+        """
+        Если трек уже идет через прокси, RTP-Info указывает на первый пакет,
+        который получит клиент (начало GOP кеша или следующий живой пакет)
+        """
+        cache = GopCache.caches.get((self.camera_hash, track_id))
+        # в группу GOP не повторяем, его получили бы все зрители группы
+        replay = track_id not in self.multicast
+        if cache and track_id in self.interleaved and cache.size + 4 * len(cache.packets) > Config.tcp_write_buffer:
+            # GOP больше лимита буфера TCP соединения: клиент ждет следующий ключевой кадр
+            replay = False
+            self.skip_to_key.add(track_id)
+        start = cache.start(replay=replay) if cache else None
+        if start:
+            seq, rtptime = start
+        self.track_starts[track_id] = (int(seq), rtptime)
+        return seq, rtptime
+
+    def _replay_gop(self, host, client_transport):
+        for track_id, (seq, rtptime) in self.track_starts.items():
+            cache = GopCache.caches.get((self.camera_hash, track_id))
+            if not cache or not cache.packets or track_id in self.skip_to_key or track_id in self.multicast:
+                continue
+
+            if track_id in self.interleaved:
+                client_transport.write(TcpTarget.frame(self.interleaved[track_id][0], cache.replay(seq, rtptime)))
+                continue
+
+            transport = Fanout.transports.get((self.camera_hash, track_id))
+            ports = self.udp_ports.get(track_id)
+            if not transport or not ports:
+                continue
+            addr = (host, ports[0])
+            for data in cache.replay(seq, rtptime):
+                transport.sendto(data, addr)
+
+    def get_camera_hash(self, ask):
+        if self.camera_hash:
+            return self.camera_hash
+
+        url = ask.url
+        res = _URL.match(url) if url else None
         if not res:
             raise RuntimeError('invalid ask')
 
+        hash = res.group(1).split('/', 1)[0]
+        if hash not in Config.cameras:
+            raise RuntimeError('invalid camera hash')
+        return hash
+
+    def _request(self, ask):
+        # дампы запросов и ответов собираются только при включенном debug
+        if Log.enabled('debug'):
+            Log.debug(f'Ask:\n{ask.raw}')
+        hash = self.get_camera_hash(ask)
+
         self.cseq = self._get_cseq(ask)
 
         if not self.camera_hash:
-            hash = res.group(2)
-            if hash not in Config.cameras:
-                raise RuntimeError('invalid camera hash')
             if hash not in Shared.data:
                 raise RuntimeError('camera is offline')
             self.camera_hash = hash
 
-        return ask, res.group(1)
+        return ask.method
 
-    def _response(self, transport, *lines):
-        reply = 'RTSP/1.0 200 OK\r\n' \
+    def _response(self, transport, *lines, status='200 OK'):
+        reply = f'RTSP/1.0 {status}\r\n' \
             f'CSeq: {self.cseq}\r\n'
 
         for row in lines:
@@ -132,27 +220,44 @@ class Client():
 
         transport.write(reply.encode())
 
-        print(f'*** Reply:\n{reply}')
+        if Log.enabled('debug'):
+            Log.debug(f'Reply:\n{reply}')
 
     def _get_cseq(self, ask):
-        res = re.match(r'.+?\r\nCSeq: (\d+)', ask, re.DOTALL)
-        if not res:
+        cseq = ask.header('CSeq', '')
+        if not cseq.isdigit():
             raise RuntimeError('invalid incoming CSeq')
-        return int(res.group(1))
+        return int(cseq)
 
     def _get_session_id(self, ask):
-        res = re.match(r'.+?\nSession: *([^;\r\n]+)', ask, re.DOTALL)
-        if res:
-            return res.group(1).strip()
+        session = ask.header('Session')
+        if session:
+            return session.split(';', 1)[0].strip()
 
         return ''.join(choices(string.ascii_lowercase + string.digits, k=9))
 
     def _get_ports(self, ask):
-        res = re.match(r'.+?\nTransport:[^\n]+client_port=(\d+)-(\d+)', ask, re.DOTALL)
+        res = _CLIENT_PORT.search(ask.header('Transport', ''))
         if not res:
             raise RuntimeError('invalid transport ports')
         return [int(res.group(1)), int(res.group(2))]
 
+    def _get_channels(self, ask):
+        res = _INTERLEAVED.search(ask.header('Transport', ''))
+        if not res:
+            raise RuntimeError('invalid interleaved channels')
+        return [int(res.group(1)), int(res.group(2))]
+
+    def _get_next_track_id(self):
+        return 'track1' if not self.udp_ports and not self.interleaved else 'track2'
+
+    def _get_multicast_address(self, track_id):
+        idx = list(Config.cameras.keys()).index(self.camera_hash)
+        # камеры различаются группой, порты у всех групп одни и те же
+        group = ipaddress.IPv4Address(Config.multicast_group) + idx
+        port = Config.multicast_start_port + (2 if track_id == 'track2' else 0)
+        return str(group), port
+
     def _get_description(self):
         sdp = Shared.data[self.camera_hash]['description']
         res = 'v=0\r\n' \
@@ -181,12 +286,12 @@ class Client():
             return
         web_sessions = []
         for session_id, data in Shared.data[self.camera_hash]['clients'].items():
-            if self._get_client_type(data['host']) == 'web':
+            if not data.get('multicast') and self._get_client_type(data['host']) == 'web':
                 web_sessions.append(session_id)
         if len(web_sessions) > Config.web_limit:
             ws = web_sessions[:-Config.web_limit]
             for session_id in ws:
-                print('Web limit exceeded, cloce old connection\n')
+                Log.add(f'Web limit exceeded [{self.camera_hash}], close old connection [{session_id}]')
                 Shared.data[self.camera_hash]['clients'][session_id]['transport'].close()
                 # Shared.data item will be deleted by ClientTcpProtocol.connection_lost callback
 
@@ -201,24 +306,82 @@ class Client():
 class ClientTcpProtocol(asyncio.Protocol):
     def __init__(self):
         self.client = Client()
+        self.parser = RtspParser()
+        self.asks = []
+        self.waiting = False
         self.camera_hash, self.session_id = None, None
         # self.event = event
 
     def connection_made(self, transport):
         peername = transport.get_extra_info('peername')
         self.transport = transport
+        # при RTP поверх TCP буфер ограничен, дальше pause_writing и пропуск до ключевого кадра
+        transport.set_write_buffer_limits(high=Config.tcp_write_buffer)
+        self.paused = False
         self.host = peername[0]
-        print(f'*** New connection from {peername[0]}:{peername[1]} ***\n\n')
+        Metrics.inc('client_connections')
+        if Log.enabled('debug'):
+            Log.debug(f'New connection from {peername[0]}:{peername[1]}')
 
     def data_received(self, data):
         try:
-            self.camera_hash, self.session_id = self.client.handle_request(self.transport, self.host, data)
+            self.asks.extend(self.parser.feed(data))
         except Exception as e:
-            print(f'Error in clent request handler: {e}\n\n')
+            Log.error(f'Error in client request handler [{self.host}]: {e}')
+            Metrics.inc('client_errors')
             self.transport.close()
+            return
+
+        if not self.waiting:
+            self._handle_asks()
+
+    def pause_writing(self):
+        self.paused = True
+
+    def resume_writing(self):
+        self.paused = False
 
     def connection_lost(self, exc):
-        if not self.session_id or self.session_id not in Shared.data[self.camera_hash]['clients']:
+        if not self.camera_hash or self.camera_hash not in Shared.data:
             return
-        del(Shared.data[self.camera_hash]['clients'][self.session_id])
+        clients = Shared.data[self.camera_hash]['clients']
+        if not self.session_id or self.session_id not in clients:
+            return
+        del(clients[self.session_id])
+        Fanout.rebuild(self.camera_hash)
         Log.add(f'Close [{self.camera_hash}] [{self.session_id}] [{self.host}]')
+
+        if not clients:
+            Supervisor.schedule_idle_check(self.camera_hash)
+
+    def _handle_asks(self):
+        try:
+            while self.asks:
+                hash = self.client.get_camera_hash(self.asks[0])
+                if hash not in Shared.data:
+                    # камера еще не подключена: ждем ее SDP, запросы копятся в очереди
+                    self.waiting = True
+                    asyncio.create_task(self._wait_camera(hash))
+                    return
+
+                ask = self.asks.pop(0)
+                started = time.perf_counter()
+                self.camera_hash, self.session_id = self.client.handle_request(self.transport, self.host, ask)
+                Metrics.observe('client', ask.method, time.perf_counter() - started)
+        except Exception as e:
+            Log.error(f'Error in client request handler [{self.host}]: {e}')
+            Metrics.inc('client_errors')
+            self.transport.close()
+
+    async def _wait_camera(self, hash):
+        try:
+            await Supervisor.wait_ready(hash)
+        except Exception:
+            Log.error(f'Error in client request handler [{self.host}]: camera [{hash}] is offline')
+            Metrics.inc('client_errors')
+            self.transport.close()
+            return
+
+        self.waiting = False
+        if not self.transport.is_closing():
+            self._handle_asks()
@@ -4,11 +4,45 @@ class Config():
     cameras = {
         "hash": {
             "path": "your-path",
-            "url": "your-url"
+            "url": "your-url",
+            # "always_on": True,  # держать подключение даже при on_demand
+            # "record": True,  # писать поток на диск в record_path
+            # "scan": True,  # отдавать кадры сканеру QR через shared memory
         },
     }
     rtsp_port = 4554
+    workers = 1
+    metrics_port = 9554
+    # метки содержат hash камер (пути RTSP) и адреса клиентов: наружу только явно
+    metrics_host = "127.0.0.1"
     start_udp_port = 5550
+    udp_batch = 64
+    gop_cache_size = 4 * 1024 * 1024
+    tcp_write_buffer = 512 * 1024
+    multicast_group = "239.255.42.1"
+    multicast_start_port = 7550
+    multicast_ttl = 1
+    connect_timeout = 10
+    request_timeout = 10
+    reconnect_delay = 1
+    reconnect_max_delay = 60
+    # камера без RTP дольше этого считается отвалившейся
+    rtp_timeout = 10
+    on_demand = False
+    idle_timeout = 30
+    camera_wait_timeout = 10
     local_ip = socket.gethostbyname(socket.gethostname())
     web_limit = 2
-    log_file = ""
\ No newline at end of file
+    record_path = "records"
+    record_segment_seconds = 60
+    record_index_interval = 1
+    record_max_age = 7 * 24 * 3600
+    record_max_bytes = 50 * 1024 * 1024 * 1024
+    record_queue_size = 4096
+    scan_fps = 0
+    scan_frame_bytes = 1920 * 1080 * 3
+    log_file = ""
+    log_level = "info"
+    log_max_bytes = 10 * 1024 * 1024
+    log_rotate_interval = 24 * 3600
+    log_backups = 5
\ No newline at end of file
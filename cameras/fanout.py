@@ -0,0 +1,112 @@
+import struct
+from shared import Shared
+
+_INTERLEAVED = struct.Struct('!BBH')
+
+
+class Target:
+    """
+    Адресат рассылки: конкретный порт конкретного клиента,
+    плюс счетчики отправленных пакетов и байт
+    """
+    __slots__ = ('session_id', 'addr', 'packets', 'bytes', 'dropped')
+
+    def __init__(self, session_id, addr):
+        self.session_id = session_id
+        self.addr = addr
+        self.packets = 0
+        self.bytes = 0
+        self.dropped = 0
+
+    def send(self, transport, packets, size, key):
+        """Возвращает (пакеты, байты), действительно отданные в сокет"""
+        addr = self.addr
+        for data in packets:
+            transport.sendto(data, addr)
+        self.packets += len(packets)
+        self.bytes += size
+        return len(packets), size
+
+
+class TcpTarget(Target):
+    """
+    Адресат с RTP внутри RTSP соединения клиента ($, канал, длина, пакет).
+    Если клиент не успевает забирать данные, пакеты выбрасываются
+    до следующего ключевого кадра, а буфер соединения не растет
+    """
+    __slots__ = ('protocol', 'skipping')
+
+    def __init__(self, session_id, addr, protocol, skipping=False):
+        super().__init__(session_id, addr)
+        self.protocol = protocol
+        # новый клиент без повтора GOP тоже начинает с ключевого кадра
+        self.skipping = skipping
+
+    @staticmethod
+    def frame(channel, packets):
+        chunks = []
+        for data in packets:
+            chunks.append(_INTERLEAVED.pack(0x24, channel, len(data)))
+            chunks.append(data)
+        return b''.join(chunks)
+
+    def send(self, transport, packets, size, key):
+        """key - индекс первого пакета ключевого кадра в пачке или -1"""
+        protocol = self.protocol
+        if protocol.paused:
+            self.skipping = True
+        if self.skipping:
+            if protocol.paused or key < 0:
+                self.dropped += len(packets)
+                return 0, 0
+            self.dropped += key
+            packets = packets[key:]
+            size = sum(len(data) for data in packets)
+            self.skipping = False
+
+        protocol.transport.write(self.frame(self.addr[1], packets))
+        self.packets += len(packets)
+        self.bytes += size
+        return len(packets), size
+
+
+class Fanout:
+    """
+    Неизменяемые списки адресатов для каждой пары (камера, трек).
+    Список пересобирается только при подключении/отключении клиента,
+    а CameraUdpProtocol на каждом пакете просто проходит по готовому кортежу.
+    """
+    targets = {}
+    transports = {}
+
+    @staticmethod
+    def rebuild(hash):
+        clients = Shared.data[hash]['clients'] if hash in Shared.data else {}
+
+        for track_id in ('track1', 'track2'):
+            key = (hash, track_id)
+            # переиспользуем старые Target, чтобы не терять счетчики
+            old = {(t.session_id, t.addr): t for t in Fanout.targets.get(key, ())}
+            targets = []
+            for session_id, client in clients.items():
+                channels = client.get('interleaved', {}).get(track_id)
+                if channels:
+                    addr = (client['host'], channels[0])
+                    targets.append(old.get((session_id, addr)) or TcpTarget(
+                        session_id, addr, client['protocol'], track_id in client.get('skip_to_key', ())))
+                    continue
+
+                ports = client['ports'].get(track_id)
+                if not ports:
+                    continue
+                group = client.get('multicast', {}).get(track_id)
+                if group:
+                    # все multicast клиенты камеры получают одну копию на группу
+                    session_id = 'multicast'
+                    addr = (group, ports[0])
+                    if any(t.addr == addr for t in targets):
+                        continue
+                else:
+                    addr = (client['host'], ports[0])
+                targets.append(old.get((session_id, addr)) or Target(session_id, addr))
+            Fanout.targets[key] = tuple(targets)
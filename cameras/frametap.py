@@ -0,0 +1,332 @@
+import atexit
+import base64
+import queue
+import struct
+import threading
+import time
+from multiprocessing import resource_tracker, shared_memory
+from config import Config
+from log import Log
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+try:
+    import av
+except ImportError:
+    av = None
+
+_RTP_HEADER = struct.Struct('!BBHI')
+_START_CODE = b'\x00\x00\x00\x01'
+
+# заголовок кадра в shared memory: счетчик seqlock, ширина, высота, каналы, время приема, номер кадра
+_FRAME_HEADER = struct.Struct('=QIIIdQ')
+
+
+class H264Depacketizer:
+    """
+    Сборка NAL из RTP (одиночные, STAP-A, FU-A) в кадры Annex B.
+    Кадр с потерянным пакетом выбрасывается целиком
+    """
+
+    def __init__(self):
+        self.params = {}
+        self.reset()
+
+    def reset(self):
+        self.nals = []
+        self.ts = None
+        self.next_seq = None
+        self.fu = None
+        self.broken = False
+
+    def set_sprop(self, fmtp):
+        """SPS/PPS из sprop-parameter-sets в a=fmtp, если камера шлет их только в SDP"""
+        for item in fmtp.split(';'):
+            name, _, value = item.strip().partition('=')
+            if name != 'sprop-parameter-sets':
+                continue
+            for chunk in value.split(','):
+                try:
+                    nal = base64.b64decode(chunk)
+                except ValueError:
+                    continue
+                if nal:
+                    self.params[nal[0] & 0x1f] = nal
+
+    def push(self, data):
+        """Кладет пакет; возвращает (rtptime, кадр, ключевой) или None"""
+        if len(data) < 12:
+            return None
+        b0, b1, seq, ts = _RTP_HEADER.unpack_from(data)
+        res = None
+
+        if self.next_seq is not None and seq != self.next_seq:
+            self.broken = True
+            self.fu = None
+        self.next_seq = (seq + 1) & 0xffff
+
+        if ts != self.ts:
+            # у предыдущего кадра не дошел пакет с маркером
+            if self.nals:
+                self.broken = True
+            res = self._emit()
+            self.ts = ts
+
+        offset = 12 + (b0 & 0x0f) * 4
+        if b0 & 0x10 and len(data) >= offset + 4:
+            offset += 4 + struct.unpack_from('!H', data, offset + 2)[0] * 4
+        end = len(data) - (data[-1] if b0 & 0x20 else 0)
+        if end > offset:
+            self._payload(data, offset, end)
+
+        if b1 & 0x80:
+            res = self._emit()
+        return res
+
+    def _payload(self, data, offset, end):
+        nal_type = data[offset] & 0x1f
+        if nal_type == 24:
+            pos = offset + 1
+            while pos + 2 < end:
+                size = struct.unpack_from('!H', data, pos)[0]
+                self._add(data[pos + 2:pos + 2 + size])
+                pos += 2 + size
+        elif nal_type == 28:
+            if end <= offset + 2:
+                return
+            fu_header = data[offset + 1]
+            if fu_header & 0x80:
+                self.fu = bytearray([(data[offset] & 0xe0) | (fu_header & 0x1f)])
+            elif self.fu is None:
+                # середина NAL без начала
+                self.broken = True
+                return
+            self.fu += data[offset + 2:end]
+            if fu_header & 0x40:
+                self._add(bytes(self.fu))
+                self.fu = None
+        elif 0 < nal_type < 24:
+            self._add(data[offset:end])
+
+    def _add(self, nal):
+        if not nal:
+            return
+        nal_type = nal[0] & 0x1f
+        if nal_type in (7, 8):
+            self.params[nal_type] = nal
+        self.nals.append(nal)
+
+    def _emit(self):
+        nals, broken, ts = self.nals, self.broken, self.ts
+        self.nals, self.broken, self.fu = [], False, None
+        if broken or not nals:
+            return None
+
+        types = {nal[0] & 0x1f for nal in nals}
+        key = 5 in types
+        if key and not types & {7, 8}:
+            nals = [self.params[t] for t in (7, 8) if t in self.params] + nals
+        return ts, b''.join(_START_CODE + nal for nal in nals), key
+
+
+class FrameTap:
+    """
+    Кадры камеры для сканирования QR без второго подключения к ней.
+    Event loop только кладет пачку RTP пакетов в очередь; сборка, декодирование
+    и запись кадра в shared memory frametap_{hash} идут в отдельном потоке.
+    scan_fps = 0 - декодируются только ключевые кадры
+    """
+    taps = {}
+    unavailable = False
+
+    def __init__(self, hash):
+        camera = Config.cameras[hash]
+        self.hash = hash
+        self.fps = camera.get('scan_fps', Config.scan_fps)
+        self.queue = queue.Queue(maxsize=256)
+        # последнее описание видео из SDP, поток забирает его перед следующей пачкой
+        self.format = None
+        self.format_lock = threading.Lock()
+        self.dropped = 0
+        self.frames = 0
+        self.shm = None
+        self.thread = threading.Thread(target=self._run, name=f'frametap-{hash}', daemon=True)
+        self.thread.start()
+
+    @staticmethod
+    def get(hash):
+        """FrameTap камеры или None, если сканирование для нее не включено"""
+        if not Config.cameras[hash].get('scan'):
+            return None
+        if av is None or np is None:
+            if not FrameTap.unavailable:
+                Log.error('Frame tap needs PyAV and numpy: pip install av numpy')
+                FrameTap.unavailable = True
+            return None
+        if hash not in FrameTap.taps:
+            FrameTap.taps[hash] = FrameTap(hash)
+        return FrameTap.taps[hash]
+
+    def set_format(self, video):
+        """Описание видео из SDP после (пере)подключения камеры"""
+        with self.format_lock:
+            self.format = video
+        try:
+            # будим поток; если очередь полна, формат применится на следующей пачке
+            self.queue.put_nowait((None, -1))
+        except queue.Full:
+            pass
+
+    def feed(self, packets, key):
+        """Вызывается из event loop: никакой работы, кроме очереди"""
+        try:
+            self.queue.put_nowait((packets, key))
+        except queue.Full:
+            # поток не успевает: потерянный пакет испортит только текущий кадр
+            self.dropped += len(packets)
+
+    def _run(self):
+        depacketizer = H264Depacketizer()
+        decoder = None
+        synced = False
+        last_frame = 0
+
+        while True:
+            packets, _key = self.queue.get()
+            with self.format_lock:
+                video, self.format = self.format, None
+            if video is not None:
+                depacketizer = H264Depacketizer()
+                decoder = None
+                synced = False
+                if 'H264' not in video.get('rtpmap', '').upper():
+                    Log.error(f'Frame tap [{self.hash}]: only H264 is supported, got {video.get("rtpmap")!r}')
+                else:
+                    depacketizer.set_sprop(video.get('format', '').partition(' ')[2])
+                    decoder = av.CodecContext.create('h264', 'r')
+            if not decoder or packets is None:
+                continue
+
+            for data in packets:
+                unit = depacketizer.push(data)
+                if not unit:
+                    continue
+                _ts, frame, key = unit
+                if not self.fps and not key:
+                    continue
+                # P-кадры без предыдущего ключевого не декодируются
+                synced = synced or key
+                if not synced:
+                    continue
+
+                now = time.time()
+                try:
+                    images = decoder.decode(av.Packet(frame))
+                except (av.AVError, ValueError) as e:
+                    Log.debug(f'Frame tap [{self.hash}] decode error: {e}')
+                    synced = False
+                    continue
+
+                for image in images:
+                    if self.fps and now - last_frame < 1 / self.fps:
+                        continue
+                    last_frame = now
+                    self._publish(image.to_ndarray(format='bgr24'), now)
+
+    def _publish(self, image, now):
+        if image.nbytes > Config.scan_frame_bytes:
+            Log.error(f'Frame tap [{self.hash}]: frame {image.shape} exceeds scan_frame_bytes')
+            return
+        if not self.shm:
+            self.shm = _open_shm(self.hash, True)
+            atexit.register(self._close)
+
+        buf = self.shm.buf
+        seq = _FRAME_HEADER.unpack_from(buf)[0]
+        self.frames += 1
+        height, width, channels = image.shape
+
+        # seqlock: нечетный счетчик - кадр пишется, читатель повторит попытку
+        struct.pack_into('=Q', buf, 0, seq + 1)
+        buf[_FRAME_HEADER.size:_FRAME_HEADER.size + image.nbytes] = image.tobytes()
+        _FRAME_HEADER.pack_into(buf, 0, seq + 2, width, height, channels, now, self.frames)
+
+    def _close(self):
+        if self.shm:
+            self.shm.close()
+            self.shm.unlink()
+            self.shm = None
+
+
+class FrameReader:
+    """Чтение последнего кадра FrameTap из другого процесса"""
+
+    def __init__(self, hash):
+        self.hash = hash
+        self.shm = None
+        self.seq = 0
+
+    def read(self, timeout=None):
+        """
+        (время приема, кадр BGR) нового кадра или None, если за timeout
+        новых кадров не было; timeout=None - не ждать
+        """
+        deadline = time.monotonic() + (timeout or 0)
+        while True:
+            frame = self._try_read()
+            if frame or time.monotonic() >= deadline:
+                return frame
+            time.sleep(0.005)
+
+    def close(self):
+        if self.shm:
+            self.shm.close()
+            self.shm = None
+
+    def _try_read(self):
+        if not self.shm:
+            try:
+                self.shm = _open_shm(self.hash, False)
+            except FileNotFoundError:
+                # прокси еще не выдал ни одного кадра
+                return None
+
+        buf = self.shm.buf
+        for _ in range(10):
+            seq, width, height, channels, ts, _frame = _FRAME_HEADER.unpack_from(buf)
+            if seq & 1:
+                time.sleep(0.001)
+                continue
+            if seq == self.seq:
+                return None
+            size = width * height * channels
+            data = bytes(buf[_FRAME_HEADER.size:_FRAME_HEADER.size + size])
+            if _FRAME_HEADER.unpack_from(buf)[0] != seq:
+                # кадр перезаписали, пока мы его копировали
+                continue
+            self.seq = seq
+            return ts, np.frombuffer(data, np.uint8).reshape(height, width, channels)
+        return None
+
+
+def _open_shm(hash, create):
+    name = f'frametap_{hash}'
+    if create:
+        try:
+            # сегмент от упавшего процесса
+            old = shared_memory.SharedMemory(name)
+            old.close()
+            old.unlink()
+        except FileNotFoundError:
+            pass
+        shm = shared_memory.SharedMemory(name, create=True, size=_FRAME_HEADER.size + Config.scan_frame_bytes)
+        _FRAME_HEADER.pack_into(shm.buf, 0, 0, 0, 0, 0, 0, 0)
+        return shm
+
+    shm = shared_memory.SharedMemory(name)
+    # иначе resource_tracker читателя удалит сегмент прокси при своем выходе
+    resource_tracker.unregister(shm._name, 'shared_memory')
+    return shm
@@ -0,0 +1,162 @@
+import struct
+
+_RTP_HEADER = struct.Struct('!BBHI')
+
+# типы NAL: (наборы параметров, ключевой кадр, агрегация, фрагментация)
+_H264 = {'params': {7, 8}, 'key': {5}, 'stap': 24, 'fu': 28}
+_H265 = {'params': {32, 33, 34}, 'key': {16, 17, 18, 19, 20, 21}, 'stap': 48, 'fu': 49}
+
+
+class GopCache:
+    """
+    Кольцевой буфер трека: RTP пакеты с последнего ключевого кадра и
+    последние SPS/PPS. Новый клиент получает его сразу после PLAY,
+    чтобы картинка появилась без ожидания следующего IDR
+    """
+    caches = {}
+
+    def __init__(self, hash, track_id, max_bytes):
+        self.key = (hash, track_id)
+        self.max_bytes = max_bytes
+        self.codec = None
+        self.reset()
+        GopCache.caches[self.key] = self
+
+    def reset(self):
+        self.packets = []
+        self.size = 0
+        self.key_ts = None
+        self.has_params = False
+        self.params = {}
+        self.next_seq, self.last_ts = None, None
+
+    def set_codec(self, rtpmap):
+        """rtpmap из SDP, например '96 H264/90000'; для аудио кеш не нужен"""
+        rtpmap = rtpmap.upper()
+        if 'H264' in rtpmap:
+            self.codec = _H264
+        elif 'H265' in rtpmap or 'HEVC' in rtpmap:
+            self.codec = _H265
+        else:
+            self.codec = None
+        self.reset()
+
+    def add(self, data):
+        """Кладет пакет в кеш; True, если с пакета можно начать декодирование"""
+        if len(data) < 12:
+            return False
+        _b0, _b1, seq, ts = _RTP_HEADER.unpack_from(data)
+        self.next_seq, self.last_ts = (seq + 1) & 0xffff, ts
+
+        if not self.codec:
+            # аудио и неизвестные кодеки: каждый пакет самостоятелен
+            return True
+
+        params, key = self._nal_kinds(data)
+        if params:
+            for nal_type in params:
+                self.params[nal_type] = data
+
+        starts = bool(params or key) and ts != self.key_ts
+        if starts:
+            # начало нового ключевого кадра: старый GOP больше не нужен
+            self.packets = []
+            self.size = 0
+            self.key_ts = ts
+            self.has_params = bool(params)
+        elif self.key_ts is None:
+            return False
+
+        if self.size + len(data) > self.max_bytes:
+            # GOP не влезает в лимит: сбрасываем до следующего ключевого кадра
+            self.packets = []
+            self.size = 0
+            self.key_ts = None
+            return starts
+
+        self.packets.append(data)
+        self.size += len(data)
+        return starts
+
+    def start(self, replay=True):
+        """(seq, rtptime) первого пакета, который получит новый клиент"""
+        if replay and self.packets:
+            return (_RTP_HEADER.unpack_from(self.packets[0])[2] - len(self._extra_params())) & 0xffff, self.key_ts
+        if self.next_seq is not None:
+            return self.next_seq, self.last_ts
+        return None
+
+    def replay(self, seq, rtptime):
+        """
+        Пакеты GOP с номерами и метками времени, переписанными под RTP-Info:
+        первый пакет получает seq, ключевой кадр - rtptime
+        """
+        extra = self._extra_params()
+        res = []
+        for i, data in enumerate(extra + self.packets):
+            ts = self.key_ts if i < len(extra) else _RTP_HEADER.unpack_from(data)[3]
+            packet = bytearray(data)
+            struct.pack_into('!HI', packet, 2, seq, (rtptime + ts - self.key_ts) & 0xffffffff)
+            res.append(bytes(packet))
+            seq = (seq + 1) & 0xffff
+        return res
+
+    def _extra_params(self):
+        # SPS/PPS, которых нет в самом GOP (камера шлет их редко или один раз)
+        if self.has_params or not self.packets:
+            return []
+        res = []
+        for data in self.params.values():
+            if not any(data is d for d in res):
+                res.append(data)
+        return res
+
+    def _nal_kinds(self, data):
+        offset = 12 + (data[0] & 0x0f) * 4
+        if data[0] & 0x10 and len(data) >= offset + 4:
+            offset += 4 + struct.unpack_from('!H', data, offset + 2)[0] * 4
+        if len(data) <= offset + 1:
+            return (), False
+
+        codec = self.codec
+        if codec is _H264:
+            nal_types = self._h264_types(data, offset)
+        else:
+            nal_types = self._h265_types(data, offset)
+
+        params = [t for t in nal_types if t in codec['params']]
+        key = any(t in codec['key'] for t in nal_types)
+        return params, key
+
+    def _h264_types(self, data, offset):
+        nal_type = data[offset] & 0x1f
+        if nal_type == _H264['fu']:
+            # только первый фрагмент открывает NAL
+            fu_header = data[offset + 1]
+            return [fu_header & 0x1f] if fu_header & 0x80 else []
+        if nal_type == _H264['stap']:
+            types = []
+            pos = offset + 1
+            while pos + 2 < len(data):
+                size = struct.unpack_from('!H', data, pos)[0]
+                types.append(data[pos + 2] & 0x1f)
+                pos += 2 + size
+            return types
+        return [nal_type]
+
+    def _h265_types(self, data, offset):
+        nal_type = (data[offset] >> 1) & 0x3f
+        if nal_type == _H265['fu']:
+            if len(data) <= offset + 2:
+                return []
+            fu_header = data[offset + 2]
+            return [fu_header & 0x3f] if fu_header & 0x80 else []
+        if nal_type == _H265['stap']:
+            types = []
+            pos = offset + 2
+            while pos + 2 < len(data):
+                size = struct.unpack_from('!H', data, pos)[0]
+                types.append((data[pos + 2] >> 1) & 0x3f)
+                pos += 2 + size
+            return types
+        return [nal_type]
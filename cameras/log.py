@@ -1,13 +1,127 @@
+import atexit
+import os
+import queue
+import sys
+import threading
 import time
 from config import Config
 
+_LEVELS = {'debug': 10, 'info': 20, 'error': 40}
+_NAMES = {level: name.upper() for name, level in _LEVELS.items()}
+
+
 class Log:
+    """
+    Логи прокси. Event loop только кладет строку в очередь,
+    фоновый поток пишет их пачками и ротирует файл по размеру и по времени
+    """
+    queue = queue.Queue(maxsize=10000)
+    thread = None
+    dropped = 0
+
     @staticmethod
     def add(info):
-        print(f"*** {info} ***\n\n")
+        Log._put(_LEVELS['info'], info)
+
+    @staticmethod
+    def debug(info):
+        Log._put(_LEVELS['debug'], info)
+
+    @staticmethod
+    def error(info):
+        Log._put(_LEVELS['error'], info)
+
+    @staticmethod
+    def enabled(level):
+        return _LEVELS[level] >= _LEVELS[Config.log_level]
+
+    @staticmethod
+    def flush():
+        if not Log.thread:
+            return
+        Log.queue.put(None)
+        Log.thread.join(timeout=5)
+        Log.thread = None
+
+    @staticmethod
+    def _put(level, info):
+        if level < _LEVELS[Config.log_level]:
+            return
+        if not Log.thread:
+            Log.thread = threading.Thread(target=_Writer().run, name='log-writer', daemon=True)
+            Log.thread.start()
+            atexit.register(Log.flush)
         try:
-            with open(Config.log_file, 'a') as f:
-                f.write(f'{time.strftime("%Y-%m-%d %H:%M:%S")} {info}\n')
+            Log.queue.put_nowait((time.time(), level, info))
+        except queue.Full:
+            # лучше потерять строку лога, чем остановить event loop
+            Log.dropped += 1
+
+
+class _Writer:
+    def __init__(self):
+        self.file = None
+        self.opened_at = 0
+
+    def run(self):
+        while True:
+            items = [Log.queue.get()]
+            try:
+                while len(items) < 1000:
+                    items.append(Log.queue.get_nowait())
+            except queue.Empty:
+                pass
+
+            stop = None in items
+            lines = []
+            for item in items:
+                if item is None:
+                    continue
+                ts, level, info = item
+                lines.append(f'{time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(ts))} {_NAMES[level]} {info}\n')
+            if Log.dropped:
+                lines.append(f'{time.strftime("%Y-%m-%d %H:%M:%S")} ERROR log queue overflow, dropped {Log.dropped} lines\n')
+                Log.dropped = 0
+
+            self._write(''.join(lines))
+            if stop:
+                if self.file:
+                    self.file.close()
+                return
+
+    def _write(self, text):
+        if not text:
+            return
+        sys.stdout.write(text)
+        sys.stdout.flush()
+
+        if not Config.log_file:
+            return
+        try:
+            self._rotate(len(text))
+            if not self.file:
+                self.file = open(Config.log_file, 'a')
+                self.opened_at = time.time()
+            self.file.write(text)
+            self.file.flush()
         except Exception as e:
-            print(f"log error: {e}\n\n")
-            pass
+            sys.stdout.write(f"log error: {e}\n")
+            self.file = None
+
+    def _rotate(self, size):
+        if not self.file:
+            return
+        too_big = Config.log_max_bytes and self.file.tell() + size > Config.log_max_bytes
+        too_old = Config.log_rotate_interval and time.time() - self.opened_at > Config.log_rotate_interval
+        if not too_big and not too_old:
+            return
+
+        self.file.close()
+        self.file = None
+        for i in range(Config.log_backups - 1, 0, -1):
+            if os.path.exists(f'{Config.log_file}.{i}'):
+                os.replace(f'{Config.log_file}.{i}', f'{Config.log_file}.{i + 1}')
+        if Config.log_backups:
+            os.replace(Config.log_file, f'{Config.log_file}.1')
+        else:
+            os.remove(Config.log_file)
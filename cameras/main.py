@@ -1,13 +1,28 @@
 import asyncio
-from config import  Config
-from camera import Camera
+from config import Config
 from client import Client
+from supervisor import Supervisor
+from metrics import Metrics
+from workers import Workers
+
+def check_ports():
+    """UDP порты камер (start_udp_port + 4 на камеру) не должны задевать порты multicast групп"""
+    cameras = range(Config.start_udp_port, Config.start_udp_port + 4 * len(Config.cameras))
+    multicast = range(Config.multicast_start_port, Config.multicast_start_port + 4)
+    if cameras.start < multicast.stop and multicast.start < cameras.stop:
+        raise RuntimeError(f'multicast ports {multicast.start}-{multicast.stop - 1} overlap '
+                           f'camera UDP ports {cameras.start}-{cameras.stop - 1}')
 
 async def main():
-    for hash in Config.cameras.keys():
-        await Camera(hash).connect()
+    Supervisor.start()
+    if Config.metrics_port:
+        asyncio.create_task(Metrics.serve(Config.metrics_port))
 
     await Client.listen()
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    check_ports()
+    if Config.workers > 1:
+        Workers.run()
+    else:
+        asyncio.run(main())
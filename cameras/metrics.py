@@ -0,0 +1,190 @@
+import asyncio
+import struct
+from config import Config
+from shared import Shared
+from fanout import Fanout
+from log import Log
+
+_SEQ_TS = struct.Struct('!HI')
+
+# частоты RTP часов, как в SDP: a=rtpmap:96 H26*/90000 и a=rtpmap:8 PCMA/8000
+_CLOCKS = {'track1': 90000, 'track2': 8000}
+
+# метод приходит от клиента: все, что не из RFC 2326, попадает в одну серию
+_METHODS = {'OPTIONS', 'DESCRIBE', 'ANNOUNCE', 'SETUP', 'PLAY', 'PAUSE', 'TEARDOWN',
+            'GET_PARAMETER', 'SET_PARAMETER', 'REDIRECT', 'RECORD'}
+# экранирование значений меток в текстовом формате Prometheus
+_ESCAPE = str.maketrans({'\\': '\\\\', '"': '\\"', '\n': '\\n'})
+
+
+class TrackStats:
+    """Счетчики одного трека камеры, обновляются на каждом пакете"""
+    __slots__ = ('clock', 'packets_in', 'bytes_in', 'packets_out', 'bytes_out',
+                 'seq_gaps', 'send_errors', 'jitter', 'last_seq', 'transit')
+
+    def __init__(self, clock):
+        self.clock = clock
+        self.packets_in = 0
+        self.bytes_in = 0
+        self.packets_out = 0
+        self.bytes_out = 0
+        self.seq_gaps = 0
+        self.send_errors = 0
+        self.jitter = 0.0
+        self.reset()
+
+    def reset(self):
+        self.last_seq, self.transit = None, None
+
+    def received(self, data, now=None):
+        """now - время прихода пакета; None - неизвестно (пакет ждал в буфере сокета), без джиттера"""
+        self.packets_in += 1
+        self.bytes_in += len(data)
+        if len(data) < 12:
+            return
+
+        seq, ts = _SEQ_TS.unpack_from(data, 2)
+        if self.last_seq is not None:
+            gap = (seq - self.last_seq - 1) & 0xffff
+            if gap >= 0x8000:
+                # пакет пришел не по порядку
+                return
+            self.seq_gaps += gap
+        self.last_seq = seq
+        if now is None:
+            return
+
+        # межпакетный джиттер по RFC 3550, в единицах RTP часов
+        transit = now * self.clock - ts
+        if self.transit is not None:
+            d = abs(transit - self.transit)
+            if d < self.clock:
+                self.jitter += (d - self.jitter) / 16
+        self.transit = transit
+
+
+class Metrics:
+    """
+    Счетчики прокси в памяти процесса
+    и их выдача по HTTP в текстовом формате Prometheus
+    """
+    tracks = {}
+    requests = {}
+    counters = {'client_connections': 0, 'client_errors': 0, 'camera_connects': 0}
+
+    @staticmethod
+    def track(hash, track_id):
+        key = (hash, track_id)
+        if key not in Metrics.tracks:
+            Metrics.tracks[key] = TrackStats(_CLOCKS[track_id])
+        return Metrics.tracks[key]
+
+    @staticmethod
+    def inc(name, value=1):
+        Metrics.counters[name] += value
+
+    @staticmethod
+    def observe(side, method, seconds):
+        """Длительность RTSP запроса: side - 'client' или 'camera'"""
+        if method not in _METHODS:
+            method = 'other'
+        item = Metrics.requests.setdefault((side, method), [0, 0.0])
+        item[0] += 1
+        item[1] += seconds
+
+    @staticmethod
+    async def serve(port):
+        server = await asyncio.start_server(Metrics._handle, Config.metrics_host, port)
+        Log.add(f'Metrics on {Config.metrics_host}:{port}/metrics')
+        async with server:
+            await server.serve_forever()
+
+    @staticmethod
+    async def _handle(reader, writer):
+        try:
+            line = await asyncio.wait_for(reader.readline(), 5)
+            path = line.decode(errors='replace').split(' ')[1] if line.count(b' ') >= 2 else ''
+            if path.split('?')[0] == '/metrics':
+                status, body = '200 OK', Metrics.render()
+            else:
+                status, body = '404 Not Found', 'not found\n'
+            data = body.encode()
+            writer.write(
+                f'HTTP/1.0 {status}\r\n'
+                'Content-Type: text/plain; version=0.0.4\r\n'
+                f'Content-Length: {len(data)}\r\n\r\n'.encode() + data)
+            await writer.drain()
+        except Exception:
+            pass
+        finally:
+            writer.close()
+
+    @staticmethod
+    def render():
+        lines = []
+
+        def add(name, kind, help, samples):
+            lines.append(f'# HELP rtsp_proxy_{name} {help}')
+            lines.append(f'# TYPE rtsp_proxy_{name} {kind}')
+            for labels, value in samples:
+                lines.append(f'rtsp_proxy_{name}{_labels(labels)} {value}')
+
+        tracks = [({'camera': hash, 'track': track_id}, stats) for (hash, track_id), stats in Metrics.tracks.items()]
+        add('packets_in_total', 'counter', 'RTP packets received from cameras',
+            [(labels, s.packets_in) for labels, s in tracks])
+        add('bytes_in_total', 'counter', 'RTP bytes received from cameras',
+            [(labels, s.bytes_in) for labels, s in tracks])
+        add('packets_out_total', 'counter', 'RTP packets sent to clients',
+            [(labels, s.packets_out) for labels, s in tracks])
+        add('bytes_out_total', 'counter', 'RTP bytes sent to clients',
+            [(labels, s.bytes_out) for labels, s in tracks])
+        add('seq_gaps_total', 'counter', 'RTP packets lost between camera and proxy',
+            [(labels, s.seq_gaps) for labels, s in tracks])
+        add('send_errors_total', 'counter', 'UDP send errors reported for the track socket',
+            [(labels, s.send_errors) for labels, s in tracks])
+        add('jitter_seconds', 'gauge', 'RFC 3550 interarrival jitter',
+            [(labels, round(s.jitter / s.clock, 6)) for labels, s in tracks])
+
+        add('camera_up', 'gauge', 'Camera has an active upstream session',
+            [({'camera': hash}, int(hash in Shared.data)) for hash in Config.cameras])
+        add('sessions', 'gauge', 'Playing client sessions',
+            [({'camera': hash}, len(data['clients'])) for hash, data in Shared.data.items()])
+
+        # сессии одного хоста складываются: id сессии в метках плодил бы серии без ограничения
+        clients = {}
+        for (hash, track_id), targets in Fanout.targets.items():
+            for target in targets:
+                item = clients.setdefault((hash, track_id, target.addr[0]), [0, 0, 0])
+                item[0] += target.packets
+                item[1] += target.bytes
+                item[2] += target.dropped
+        clients = [({'camera': hash, 'track': track_id, 'host': host}, item)
+                   for (hash, track_id, host), item in clients.items()]
+        add('client_packets_sent_total', 'counter', 'RTP packets sent to a client host',
+            [(labels, item[0]) for labels, item in clients])
+        add('client_bytes_sent_total', 'counter', 'RTP bytes sent to a client host',
+            [(labels, item[1]) for labels, item in clients])
+        add('client_packets_dropped_total', 'counter', 'RTP packets skipped for a slow TCP client',
+            [(labels, item[2]) for labels, item in clients])
+
+        add('client_connections_total', 'counter', 'Accepted RTSP client connections',
+            [({}, Metrics.counters['client_connections'])])
+        add('client_errors_total', 'counter', 'RTSP client connections closed on error',
+            [({}, Metrics.counters['client_errors'])])
+        add('camera_connects_total', 'counter', 'Successful camera (re)connects',
+            [({}, Metrics.counters['camera_connects'])])
+
+        lines.append('# HELP rtsp_proxy_request_seconds RTSP request latency by method')
+        lines.append('# TYPE rtsp_proxy_request_seconds summary')
+        for (side, method), (count, total) in Metrics.requests.items():
+            labels = _labels({'side': side, 'method': method})
+            lines.append(f'rtsp_proxy_request_seconds_count{labels} {count}')
+            lines.append(f'rtsp_proxy_request_seconds_sum{labels} {round(total, 6)}')
+
+        return '\n'.join(lines) + '\n'
+
+
+def _labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{k}="{str(v).translate(_ESCAPE)}"' for k, v in labels.items()) + '}'
@@ -0,0 +1,209 @@
+import mmap
+import os
+import queue
+import struct
+import threading
+from bisect import bisect_right
+from config import Config
+from log import Log
+
+# запись в сегменте: время приема (мкс), трек, длина пакета, сам RTP пакет
+_RECORD = struct.Struct('!QBH')
+# запись индекса: время (мкс), смещение записи в сегменте
+_INDEX = struct.Struct('!QQ')
+
+
+class Recorder:
+    """
+    Запись RTP камеры в сегменты на диске с индексом время -> смещение.
+    Event loop только кладет пачку пакетов в очередь, на диск пишет
+    отдельный поток; старые сегменты удаляются по возрасту и общему размеру
+    """
+    recorders = {}
+    # пачки пакетов в ожидании записи; если диск не успевает, новые выбрасываются
+    queue = queue.Queue(maxsize=Config.record_queue_size)
+    thread = None
+
+    def __init__(self, hash):
+        self.hash = hash
+        self.path = os.path.join(Config.record_path, hash)
+        os.makedirs(self.path, exist_ok=True)
+        self.segments = _list_segments(self.path)
+        self.sizes = {start: os.path.getsize(self._segment_path(start)) for start in self.segments}
+        self.file, self.index = None, None
+        self.segment_start = 0
+        self.last_index = 0
+        self.dropped = 0
+        self.reported = 0
+
+    @staticmethod
+    def get(hash):
+        """Recorder камеры или None, если запись для нее не включена"""
+        if not Config.cameras[hash].get('record'):
+            return None
+        if hash not in Recorder.recorders:
+            Recorder.recorders[hash] = Recorder(hash)
+        if not Recorder.thread:
+            Recorder.thread = threading.Thread(target=Recorder._run, name='recorder', daemon=True)
+            Recorder.thread.start()
+        return Recorder.recorders[hash]
+
+    def write(self, track_id, packets, now, key):
+        """Вызывается из event loop: никакого I/O, только очередь"""
+        try:
+            Recorder.queue.put_nowait((self, track_id, packets, now, key))
+        except queue.Full:
+            # запись отстает: лучше дыра в архиве, чем рост памяти прокси
+            self.dropped += len(packets)
+
+    @staticmethod
+    def seek(hash, timestamp):
+        """
+        (путь сегмента, смещение) последней точки входа не позже timestamp:
+        бинарный поиск по списку сегментов, затем по индексу сегмента
+        """
+        recorder = Recorder.recorders.get(hash)
+        path = os.path.join(Config.record_path, hash)
+        segments = recorder.segments if recorder else _list_segments(path)
+
+        ts_us = int(timestamp * 1e6)
+        pos = bisect_right(segments, ts_us) - 1
+        if pos < 0:
+            return None
+        start = segments[pos]
+
+        with open(os.path.join(path, f'{start}.idx'), 'rb') as f:
+            if not os.fstat(f.fileno()).st_size:
+                return os.path.join(path, f'{start}.rtp'), 0
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as index:
+                lo, hi = 0, len(index) // _INDEX.size
+                while lo < hi:
+                    mid = (lo + hi) // 2
+                    if _INDEX.unpack_from(index, mid * _INDEX.size)[0] <= ts_us:
+                        lo = mid + 1
+                    else:
+                        hi = mid
+                offset = _INDEX.unpack_from(index, (lo - 1) * _INDEX.size)[1] if lo else 0
+
+        return os.path.join(path, f'{start}.rtp'), offset
+
+    @staticmethod
+    def read(hash, start, end):
+        """Пакеты (время, трек, пакет) с ближайшей точки входа до end"""
+        found = Recorder.seek(hash, start)
+        if not found:
+            return
+        segment, offset = found
+        path = os.path.dirname(segment)
+        segments = _list_segments(path)
+        pos = segments.index(int(os.path.basename(segment)[:-4]))
+
+        end_us = int(end * 1e6)
+        for start_us in segments[pos:]:
+            with open(os.path.join(path, f'{start_us}.rtp'), 'rb') as f:
+                f.seek(offset)
+                while True:
+                    header = f.read(_RECORD.size)
+                    if len(header) < _RECORD.size:
+                        break
+                    ts_us, track, size = _RECORD.unpack(header)
+                    if ts_us > end_us:
+                        return
+                    yield ts_us / 1e6, f'track{track}', f.read(size)
+            offset = 0
+
+    @staticmethod
+    def _run():
+        while True:
+            items = [Recorder.queue.get()]
+            try:
+                while len(items) < 10000:
+                    items.append(Recorder.queue.get_nowait())
+            except queue.Empty:
+                pass
+
+            touched = set()
+            for recorder, track_id, packets, now, key in items:
+                try:
+                    recorder._append(track_id, packets, now, key)
+                    touched.add(recorder)
+                except Exception as e:
+                    Log.error(f'Recorder [{recorder.hash}] error: {e!r}')
+
+            # очередь разобрана: сбрасываем буферы, чтобы seek видел свежие данные
+            for recorder in touched:
+                if recorder.file:
+                    recorder.file.flush()
+                    recorder.index.flush()
+
+            for recorder in list(Recorder.recorders.values()):
+                dropped = recorder.dropped
+                if dropped != recorder.reported:
+                    Log.error(f'Recorder [{recorder.hash}] queue overflow, dropped {dropped - recorder.reported} packets')
+                    recorder.reported = dropped
+
+    def _append(self, track_id, packets, now, key):
+        ts_us = int(now * 1e6)
+        if not self.file or ts_us - self.segment_start >= Config.record_segment_seconds * 1000000:
+            self._rotate(ts_us)
+
+        track = 1 if track_id == 'track1' else 2
+        # точки входа - начала ключевых кадров видео и не реже record_index_interval
+        if track == 1 and key >= 0:
+            self._write_packets(ts_us, track, packets[:key])
+            packets = packets[key:]
+            self._add_index(ts_us)
+        elif ts_us - self.last_index >= Config.record_index_interval * 1000000:
+            self._add_index(ts_us)
+        self._write_packets(ts_us, track, packets)
+
+    def _write_packets(self, ts_us, track, packets):
+        write = self.file.write
+        for data in packets:
+            write(_RECORD.pack(ts_us, track, len(data)))
+            write(data)
+            self.sizes[self.segment_start] += _RECORD.size + len(data)
+
+    def _add_index(self, ts_us):
+        self.index.write(_INDEX.pack(ts_us, self.file.tell()))
+        self.last_index = ts_us
+
+    def _rotate(self, ts_us):
+        if self.file:
+            self.file.close()
+            self.index.close()
+
+        self.segment_start = ts_us
+        self.file = open(self._segment_path(ts_us), 'wb', buffering=1024 * 1024)
+        self.index = open(os.path.join(self.path, f'{ts_us}.idx'), 'wb')
+        self.segments.append(ts_us)
+        self.sizes[ts_us] = 0
+        self.last_index = 0
+
+        self._cleanup(ts_us)
+
+    def _cleanup(self, now_us):
+        min_start = now_us - Config.record_max_age * 1000000
+        total = sum(self.sizes.values())
+        # текущий сегмент не трогаем
+        while len(self.segments) > 1:
+            start = self.segments[0]
+            if start >= min_start and total <= Config.record_max_bytes:
+                break
+            total -= self.sizes.pop(start, 0)
+            self.segments.pop(0)
+            for ext in ('rtp', 'idx'):
+                try:
+                    os.remove(os.path.join(self.path, f'{start}.{ext}'))
+                except FileNotFoundError:
+                    pass
+            Log.add(f'Recorder [{self.hash}] removed segment {start}')
+
+    def _segment_path(self, start):
+        return os.path.join(self.path, f'{start}.rtp')
+
+
+def _list_segments(path):
+    if not os.path.isdir(path):
+        return []
+    return sorted(int(name[:-4]) for name in os.listdir(path) if name.endswith('.rtp') and name[:-4].isdigit())
@@ -0,0 +1,113 @@
+import re
+
+_START_LINE = re.compile(r'(\S+) +(\S+) +(\S+)')
+_REPLY_LINE = re.compile(r'RTSP/\d\.\d (\d{3})')
+
+
+class RtspMessage:
+    """
+    Одно RTSP сообщение (запрос или ответ).
+    Заголовки разобраны один раз, ключи в нижнем регистре
+    """
+    __slots__ = ('start_line', 'headers', 'body', 'raw')
+
+    def __init__(self, start_line, headers, body, raw):
+        self.start_line = start_line
+        self.headers = headers
+        self.body = body
+        self.raw = raw
+
+    @property
+    def method(self):
+        res = _START_LINE.match(self.start_line)
+        return res.group(1) if res else None
+
+    @property
+    def url(self):
+        res = _START_LINE.match(self.start_line)
+        return res.group(2) if res else None
+
+    @property
+    def code(self):
+        res = _REPLY_LINE.match(self.start_line)
+        return int(res.group(1)) if res else 0
+
+    def header(self, name, default=None):
+        return self.headers.get(name.lower(), default)
+
+
+class RtspParser:
+    """
+    Потоковый разборщик RTSP: копит куски из TCP, режет поток на сообщения
+    по пустой строке и Content-Length, умеет несколько сообщений в одном куске
+    и пропускает interleaved RTP/RTCP кадры
+    """
+    def __init__(self, max_size=65536):
+        self.buffer = bytearray()
+        self.max_size = max_size
+        # разобранный заголовок сообщения, тело которого еще не пришло целиком
+        self.head = None
+
+    def feed(self, data):
+        self.buffer += data
+        messages = []
+
+        while True:
+            # пропускаем пустые строки между сообщениями
+            while self.buffer[:2] == b'\r\n':
+                del self.buffer[:2]
+
+            # interleaved кадры ($, канал, длина) от клиента (RTCP отчеты) не нужны
+            if self.buffer[:1] == b'$':
+                if len(self.buffer) < 4:
+                    break
+                total = 4 + int.from_bytes(self.buffer[2:4], 'big')
+                if len(self.buffer) < total:
+                    break
+                del self.buffer[:total]
+                continue
+
+            if self.head is None:
+                end = self.buffer.find(b'\r\n\r\n')
+                if end < 0:
+                    if len(self.buffer) > self.max_size:
+                        raise RuntimeError('RTSP message is too large')
+                    break
+                self.head = self._parse_head(end)
+
+            end, head, lines, headers, total = self.head
+            if len(self.buffer) < total:
+                break
+            self.head = None
+
+            body = self.buffer[end + 4:total].decode(errors='replace')
+            del self.buffer[:total]
+
+            messages.append(RtspMessage(lines[0], headers, body, f'{head}\r\n\r\n{body}'))
+
+        return messages
+
+    def _parse_head(self, end):
+        head = self.buffer[:end].decode(errors='replace')
+        lines = head.split('\r\n')
+        headers = {}
+        for line in lines[1:]:
+            name, sep, value = line.partition(':')
+            if not sep:
+                continue
+            name = name.strip().lower()
+            value = value.strip()
+            # повторяющиеся заголовки (например, WWW-Authenticate) склеиваем построчно
+            headers[name] = f'{headers[name]}\n{value}' if name in headers else value
+
+        try:
+            length = int(headers.get('content-length', 0))
+        except ValueError:
+            raise RuntimeError('invalid Content-Length')
+        if length < 0:
+            raise RuntimeError('invalid Content-Length')
+
+        total = end + 4 + length
+        if total > self.max_size:
+            raise RuntimeError('RTSP message is too large')
+        return end, head, lines, headers, total
@@ -0,0 +1,118 @@
+import asyncio
+import time
+from config import Config
+from camera import Camera
+from shared import Shared
+from log import Log
+
+
+class Supervisor:
+    """
+    Держит подключения ко всем камерам: подключает их параллельно,
+    следит за сессией и переподключает с экспоненциальной задержкой.
+    В режиме on_demand камера подключается по первому запросу клиента
+    и отключается, когда клиентов нет дольше idle_timeout
+    """
+    tasks = {}
+    ready = {}
+    idle = {}
+    setups = {}
+
+    @staticmethod
+    def start(hashes=None):
+        for hash in Config.cameras.keys() if hashes is None else hashes:
+            if Supervisor._always_on(hash):
+                Supervisor._start(hash)
+
+    @staticmethod
+    async def wait_ready(hash):
+        """Запускает камеру, если она еще не запущена, и ждет ее SDP"""
+        if hash not in Supervisor.tasks:
+            Supervisor._start(hash)
+        Supervisor.schedule_idle_check(hash)
+
+        await asyncio.wait_for(Supervisor.ready[hash].wait(), Config.camera_wait_timeout)
+
+    @staticmethod
+    def schedule_idle_check(hash):
+        if Supervisor._always_on(hash):
+            return
+
+        Supervisor._schedule_idle_check(hash, Config.idle_timeout)
+
+    @staticmethod
+    def touch(hash):
+        """
+        SETUP клиента: до PLAY он еще не в clients, поэтому камера
+        не считается простаивающей еще idle_timeout после последнего SETUP
+        """
+        if not Supervisor._always_on(hash):
+            Supervisor.setups[hash] = time.monotonic()
+
+    @staticmethod
+    def _schedule_idle_check(hash, delay):
+        handle = Supervisor.idle.pop(hash, None)
+        if handle:
+            handle.cancel()
+
+        loop = asyncio.get_running_loop()
+        Supervisor.idle[hash] = loop.call_later(delay, Supervisor._check_idle, hash)
+
+    @staticmethod
+    def _always_on(hash):
+        # записываемая и сканируемая камеры нужны всегда, даже без зрителей
+        camera = Config.cameras[hash]
+        return camera.get('always_on', not Config.on_demand or bool(camera.get('record') or camera.get('scan')))
+
+    @staticmethod
+    def _start(hash):
+        Supervisor.ready.setdefault(hash, asyncio.Event())
+        Supervisor.tasks[hash] = asyncio.create_task(Supervisor._run(hash))
+
+    @staticmethod
+    def _check_idle(hash):
+        Supervisor.idle.pop(hash, None)
+        if hash in Shared.data and Shared.data[hash]['clients']:
+            return
+        since_setup = time.monotonic() - Supervisor.setups.get(hash, float('-inf'))
+        if since_setup < Config.idle_timeout:
+            Supervisor._schedule_idle_check(hash, Config.idle_timeout - since_setup)
+            return
+
+        Supervisor.setups.pop(hash, None)
+        task = Supervisor.tasks.pop(hash, None)
+        if not task:
+            return
+        task.cancel()
+        Shared.data.pop(hash, None)
+        Supervisor.ready[hash].clear()
+        Log.add(f'Camera [{hash}] idle, disconnected')
+
+    @staticmethod
+    async def _run(hash):
+        try:
+            camera = Camera(hash)
+        except Exception as e:
+            Log.error(f"Can't create camera [{hash}]: {e}")
+            return
+
+        delay = Config.reconnect_delay
+        try:
+            while True:
+                try:
+                    await camera.connect()
+                    Supervisor.ready[hash].set()
+                    delay = Config.reconnect_delay
+                    await camera.keepalive()
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    Log.error(f"Camera [{hash}] error: {e!r}")
+
+                camera.close()
+                Log.add(f'Camera [{hash}] reconnect in {delay}s')
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, Config.reconnect_max_delay)
+        except asyncio.CancelledError:
+            camera.stop()
+            raise
@@ -0,0 +1,59 @@
+import pytest
+
+from client import Client
+from config import Config
+from gop import GopCache
+
+
+@pytest.fixture
+def cache():
+    cache = GopCache('cam', 'track1', Config.gop_cache_size)
+    # GOP из одного пакета с seq 10, следующий живой пакет - seq 11
+    cache.packets = [b'\x80\x60\x00\x0a\x00\x00\x03\x84' + bytes(4) + bytes(200)]
+    cache.size = len(cache.packets[0])
+    cache.key_ts = 900
+    cache.has_params = True
+    cache.next_seq, cache.last_ts = 11, 900
+    yield cache
+    GopCache.caches.pop(cache.key, None)
+
+
+def _client(interleaved):
+    client = Client()
+    client.camera_hash = 'cam'
+    if interleaved:
+        client.interleaved = {'track1': [0, 1]}
+    return client
+
+
+def test_gop_replayed_when_it_fits(cache):
+    client = _client(interleaved=True)
+    assert client._get_track_start('track1', 0, 0) == (10, 900)
+    assert not client.skip_to_key
+
+
+def test_gop_larger_than_tcp_buffer_not_replayed(cache, monkeypatch):
+    monkeypatch.setattr(Config, 'tcp_write_buffer', 100)
+    client = _client(interleaved=True)
+    assert client._get_track_start('track1', 0, 0) == (11, 900)
+    assert client.skip_to_key == {'track1'}
+
+
+def test_udp_client_replay_not_limited_by_tcp_buffer(cache, monkeypatch):
+    monkeypatch.setattr(Config, 'tcp_write_buffer', 100)
+    client = _client(interleaved=False)
+    assert client._get_track_start('track1', 0, 0) == (10, 900)
+
+
+def test_multicast_address_does_not_depend_on_camera_count(monkeypatch):
+    monkeypatch.setattr(Config, 'cameras', {f'cam{i}': {} for i in range(1000)})
+    client = Client()
+    client.camera_hash = 'cam999'
+    assert client._get_multicast_address('track1') == ('239.255.45.232', Config.multicast_start_port)
+    assert client._get_multicast_address('track2') == ('239.255.45.232', Config.multicast_start_port + 2)
+
+
+def test_multicast_track_not_replayed(cache):
+    client = _client(interleaved=False)
+    client.multicast = {'track1': '239.255.42.1'}
+    assert client._get_track_start('track1', 0, 0) == (11, 900)
@@ -0,0 +1,77 @@
+from fanout import Fanout, Target, TcpTarget
+from shared import Shared
+
+
+class FakeTransport:
+    def __init__(self):
+        self.sent = []
+
+    def sendto(self, data, addr):
+        self.sent.append((data, addr))
+
+    def write(self, data):
+        self.sent.append(data)
+
+
+class FakeProtocol:
+    def __init__(self):
+        self.paused = False
+        self.transport = FakeTransport()
+
+
+def test_udp_target_counts_sent():
+    transport = FakeTransport()
+    target = Target('s1', ('10.0.0.2', 5000))
+    assert target.send(transport, [b'a', b'bc'], 3, -1) == (2, 3)
+    assert (target.packets, target.bytes) == (2, 3)
+    assert len(transport.sent) == 2
+
+
+def test_tcp_target_skips_to_keyframe_after_pause():
+    protocol = FakeProtocol()
+    target = TcpTarget('s1', ('10.0.0.2', 0), protocol)
+
+    protocol.paused = True
+    assert target.send(None, [b'a', b'b'], 2, -1) == (0, 0)
+    protocol.paused = False
+    # буфер освободился, но ключевого кадра в пачке нет
+    assert target.send(None, [b'c'], 1, -1) == (0, 0)
+    assert target.send(None, [b'd', b'key', b'e'], 5, 1) == (2, 4)
+    assert target.dropped == 4
+    assert protocol.transport.sent == [TcpTarget.frame(0, [b'key', b'e'])]
+
+
+def test_rebuild_starts_tcp_target_without_gop_at_keyframe():
+    protocol = FakeProtocol()
+    Shared.data['cam'] = {'clients': {
+        's1': {'host': '10.0.0.2', 'ports': {}, 'multicast': {}, 'protocol': protocol,
+               'interleaved': {'track1': [0, 1], 'track2': [2, 3]}, 'skip_to_key': {'track1'}},
+        's2': {'host': '10.0.0.3', 'ports': {'track1': [6000, 6001]}, 'multicast': {},
+               'protocol': None, 'interleaved': {}},
+    }}
+    try:
+        Fanout.rebuild('cam')
+        track1 = Fanout.targets[('cam', 'track1')]
+        assert [type(t) for t in track1] == [TcpTarget, Target]
+        assert track1[0].skipping
+        assert not Fanout.targets[('cam', 'track2')][0].skipping
+    finally:
+        del Shared.data['cam']
+        Fanout.rebuild('cam')
+
+
+def test_multicast_is_per_track():
+    Shared.data['cam'] = {'clients': {
+        's1': {'host': '10.0.0.2', 'ports': {'track1': [7550, 7551], 'track2': [6002, 6003]},
+               'multicast': {'track1': '239.255.42.1'}, 'protocol': None, 'interleaved': {}},
+        's2': {'host': '10.0.0.3', 'ports': {'track1': [7550, 7551]},
+               'multicast': {'track1': '239.255.42.1'}, 'protocol': None, 'interleaved': {}},
+    }}
+    try:
+        Fanout.rebuild('cam')
+        # одна копия в группу на оба multicast клиента, аудио первому клиенту напрямую
+        assert [t.addr for t in Fanout.targets[('cam', 'track1')]] == [('239.255.42.1', 7550)]
+        assert [t.addr for t in Fanout.targets[('cam', 'track2')]] == [('10.0.0.2', 6002)]
+    finally:
+        del Shared.data['cam']
+        Fanout.rebuild('cam')
@@ -0,0 +1,67 @@
+import struct
+import threading
+
+import pytest
+
+from config import Config
+from frametap import FrameTap, H264Depacketizer
+
+SPS = b'\x67\x42\x00\x1f'
+PPS = b'\x68\xce\x38\x80'
+IDR = b'\x65' + bytes(range(1, 40))
+
+
+def _rtp(seq, ts, payload, marker=False):
+    return struct.pack('!BBHI', 0x80, 96 | (0x80 if marker else 0), seq, ts) + bytes(4) + payload
+
+
+def _annexb(*nals):
+    return b''.join(b'\x00\x00\x00\x01' + nal for nal in nals)
+
+
+def test_stap_and_fu_a_assembled_into_key_frame():
+    stap = b'\x18' + b''.join(struct.pack('!H', len(nal)) + nal for nal in (SPS, PPS))
+    fu_start = bytes([0x7c, 0x85]) + IDR[1:20]
+    fu_end = bytes([0x7c, 0x45]) + IDR[20:]
+
+    depacketizer = H264Depacketizer()
+    assert depacketizer.push(_rtp(1, 3000, stap)) is None
+    assert depacketizer.push(_rtp(2, 3000, fu_start)) is None
+    assert depacketizer.push(_rtp(3, 3000, fu_end, marker=True)) == (3000, _annexb(SPS, PPS, IDR), True)
+
+
+def test_lost_packet_drops_frame():
+    depacketizer = H264Depacketizer()
+    depacketizer.push(_rtp(1, 3000, bytes([0x7c, 0x85]) + IDR[1:20]))
+    # пакет 2 потерян
+    assert depacketizer.push(_rtp(3, 3000, bytes([0x7c, 0x45]) + IDR[20:], marker=True)) is None
+    assert depacketizer.push(_rtp(4, 6000, b'\x41\x9a', marker=True)) == (6000, _annexb(b'\x41\x9a'), False)
+
+
+def test_sprop_parameters_prepended_to_key_frame():
+    depacketizer = H264Depacketizer()
+    depacketizer.set_sprop('packetization-mode=1; sprop-parameter-sets=Z0IAHw==,aM44gA==')
+    assert depacketizer.push(_rtp(1, 3000, IDR, marker=True)) == (3000, _annexb(SPS, PPS, IDR), True)
+
+
+@pytest.fixture
+def tap(monkeypatch):
+    release = threading.Event()
+    # поток декодирования стоит, как будто не успевает за камерой
+    monkeypatch.setattr(FrameTap, '_run', lambda self: release.wait(5))
+    monkeypatch.setitem(Config.cameras, 'cam', {'scan': True})
+    tap = FrameTap('cam')
+    yield tap
+    release.set()
+    tap.thread.join()
+
+
+def test_set_format_does_not_block_on_full_queue(tap):
+    for _ in range(tap.queue.maxsize):
+        tap.feed([b'packet'], -1)
+    tap.feed([b'packet'], -1)
+    assert tap.dropped == 1
+
+    tap.set_format({'rtpmap': '96 H264/90000'})
+    assert tap.format == {'rtpmap': '96 H264/90000'}
+    assert tap.queue.full()
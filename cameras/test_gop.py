@@ -0,0 +1,102 @@
+import struct
+
+import pytest
+
+from gop import GopCache
+
+
+def _rtp(seq, ts, payload):
+    return struct.pack('!BBHI', 0x80, 96, seq, ts) + bytes(4) + payload
+
+
+def _nal(nal_type, size=10):
+    return bytes([0x60 | nal_type]) + bytes(size)
+
+
+def _fu(nal_type, start, size=10):
+    return bytes([0x60 | 28, (0x80 if start else 0) | nal_type]) + bytes(size)
+
+
+def _h265(nal_type, size=10):
+    return bytes([nal_type << 1, 1]) + bytes(size)
+
+
+@pytest.fixture
+def cache():
+    cache = GopCache('cam', 'track1', 1024)
+    cache.set_codec('96 H264/90000')
+    yield cache
+    GopCache.caches.pop(cache.key, None)
+
+
+def test_keyframe_detection_h264(cache):
+    assert cache.add(_rtp(1, 0, _nal(1))) is False
+    assert cache.add(_rtp(2, 3000, _nal(5))) is True
+    # продолжение того же кадра: та же метка времени
+    assert cache.add(_rtp(3, 3000, _nal(5))) is False
+    assert cache.add(_rtp(4, 6000, _fu(5, start=True))) is True
+    assert cache.add(_rtp(5, 9000, _fu(5, start=False))) is False
+    stap = bytes([0x60 | 24]) + struct.pack('!H', 3) + _nal(7, 2) + struct.pack('!H', 3) + _nal(8, 2)
+    assert cache.add(_rtp(6, 12000, stap)) is True
+    assert set(cache.params) == {7, 8}
+
+
+def test_keyframe_detection_h265():
+    cache = GopCache('cam', 'track1', 1024)
+    try:
+        cache.set_codec('96 H265/90000')
+        assert cache.add(_rtp(1, 0, _h265(1))) is False
+        assert cache.add(_rtp(2, 3000, _h265(19))) is True
+    finally:
+        GopCache.caches.pop(cache.key, None)
+
+
+def test_audio_packets_always_start():
+    cache = GopCache('cam', 'track2', 1024)
+    try:
+        cache.set_codec('8 PCMA/8000')
+        assert cache.add(_rtp(1, 0, bytes(20))) is True
+        assert cache.packets == []
+    finally:
+        GopCache.caches.pop(cache.key, None)
+
+
+def test_new_gop_replaces_cache(cache):
+    cache.add(_rtp(1, 0, _nal(5)))
+    cache.add(_rtp(2, 3000, _nal(1)))
+    assert len(cache.packets) == 2
+    second = _rtp(3, 6000, _nal(5))
+    cache.add(second)
+    assert cache.packets == [second]
+    assert cache.key_ts == 6000
+
+
+def test_gop_over_size_cap_dropped_until_next_keyframe(cache):
+    cache.add(_rtp(1, 0, _nal(5)))
+    for seq in range(2, 100):
+        cache.add(_rtp(seq, seq * 3000, _nal(1, 100)))
+    # лимит превышен: кеш пуст, неключевые пакеты в него не попадают
+    assert cache.packets == [] and cache.size == 0
+    assert cache.start() == (100, 99 * 3000)
+    key = _rtp(100, 300000, _nal(5))
+    assert cache.add(key) is True
+    assert cache.packets == [key]
+
+
+def test_replay_order_and_rewritten_headers(cache):
+    cache.add(_rtp(7, 0, _nal(7)))
+    cache.add(_rtp(8, 3000, _nal(5)))
+    cache.add(_rtp(9, 3000, _nal(5)))
+    cache.add(_rtp(10, 6000, _nal(1)))
+    # SPS пришел до GOP: отдается первым, перед ключевым кадром
+    assert cache.start() == (7, 3000)
+    packets = cache.replay(100, 50000)
+    headers = [struct.unpack_from('!HI', p, 2) for p in packets]
+    assert headers == [(100, 50000), (101, 50000), (102, 50000), (103, 53000)]
+    assert [p[12] & 0x1f for p in packets] == [7, 5, 5, 1]
+
+
+def test_start_without_replay_points_at_next_live_packet(cache):
+    cache.add(_rtp(1, 0, _nal(5)))
+    cache.add(_rtp(2, 3000, _nal(1)))
+    assert cache.start(replay=False) == (3, 3000)
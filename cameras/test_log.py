@@ -0,0 +1,21 @@
+import queue
+
+import pytest
+
+from config import Config
+from log import Log
+
+
+@pytest.mark.parametrize('level, enabled', [('debug', {'debug', 'info', 'error'}), ('info', {'info', 'error'}),
+                                            ('error', {'error'})])
+def test_enabled(monkeypatch, level, enabled):
+    monkeypatch.setattr(Config, 'log_level', level)
+    assert {name for name in ('debug', 'info', 'error') if Log.enabled(name)} == enabled
+
+
+def test_lines_below_level_not_queued(monkeypatch):
+    monkeypatch.setattr(Config, 'log_level', 'error')
+    monkeypatch.setattr(Log, 'queue', queue.Queue(maxsize=1))
+    Log.debug('dump')
+    Log.add('info')
+    assert Log.queue.empty()
@@ -0,0 +1,15 @@
+import pytest
+
+from config import Config
+from main import check_ports
+
+
+def test_default_ports_do_not_overlap(monkeypatch):
+    monkeypatch.setattr(Config, 'cameras', {f'cam{i}': {} for i in range(500)})
+    check_ports()
+
+
+def test_overlap_rejected(monkeypatch):
+    monkeypatch.setattr(Config, 'cameras', {f'cam{i}': {} for i in range(501)})
+    with pytest.raises(RuntimeError):
+        check_ports()
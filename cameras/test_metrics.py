@@ -0,0 +1,74 @@
+import asyncio
+
+import pytest
+
+from config import Config
+from fanout import Fanout, Target
+from metrics import Metrics, TrackStats
+
+
+@pytest.fixture(autouse=True)
+def clean(monkeypatch):
+    monkeypatch.setattr(Metrics, 'requests', {})
+    monkeypatch.setattr(Metrics, 'tracks', {})
+    monkeypatch.setattr(Fanout, 'targets', {})
+    monkeypatch.setattr(Config, 'cameras', {'cam"1\n': {}})
+
+
+def _samples(text):
+    return [line for line in text.splitlines() if not line.startswith('#')]
+
+
+def test_unknown_methods_share_one_series():
+    Metrics.observe('client', 'PLAY', 0.5)
+    for i in range(100):
+        Metrics.observe('client', f'X{i}', 0.1)
+    assert set(Metrics.requests) == {('client', 'PLAY'), ('client', 'other')}
+    assert Metrics.requests[('client', 'other')][0] == 100
+
+
+def test_label_values_escaped():
+    text = Metrics.render()
+    assert 'rtsp_proxy_camera_up{camera="cam\\"1\\n"} 0' in text
+    # каждая серия - одна строка формата "имя{метки} значение"
+    for line in _samples(text):
+        assert len(line.rsplit(' ', 1)) == 2
+
+
+def test_client_series_have_no_session_label():
+    first, second = Target('s1', ('10.0.0.2', 5000)), Target('s2', ('10.0.0.2', 5002))
+    first.packets, second.packets = 3, 4
+    Fanout.targets[('cam', 'track1')] = (first, second)
+    text = Metrics.render()
+    assert not any('session=' in line for line in _samples(text))
+    assert 'rtsp_proxy_client_packets_sent_total{camera="cam",track="track1",host="10.0.0.2"} 7' in text
+
+
+def _rtp(seq, ts):
+    return bytes(2) + seq.to_bytes(2, 'big') + ts.to_bytes(4, 'big') + bytes(4)
+
+
+def test_packets_without_arrival_time_skip_jitter():
+    stats = TrackStats(90000)
+    # пачка из одного чтения: без времени прихода пакеты не дают ложного джиттера
+    stats.received(_rtp(1, 0), 100.0)
+    for seq in range(2, 10):
+        stats.received(_rtp(seq, seq * 3000))
+    assert stats.jitter == 0.0
+    assert (stats.packets_in, stats.seq_gaps) == (9, 0)
+
+    stats.received(_rtp(10, 30000), 100.0 + 30000 / 90000 + 0.01)
+    assert stats.jitter == pytest.approx(900 / 16)
+
+
+def test_serve_binds_metrics_host(monkeypatch):
+    calls = []
+
+    async def start_server(handler, host, port):
+        calls.append((host, port))
+        raise OSError('stop')
+
+    monkeypatch.setattr(asyncio, 'start_server', start_server)
+    with pytest.raises(OSError):
+        asyncio.run(Metrics.serve(9554))
+    assert calls == [('127.0.0.1', 9554)]
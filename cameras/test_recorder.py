@@ -0,0 +1,68 @@
+import queue
+
+import pytest
+
+from config import Config
+from recorder import Recorder
+
+
+def _packet(seq):
+    return b'\x80\x60' + seq.to_bytes(2, 'big') + bytes(8) + b'payload'
+
+
+@pytest.fixture
+def recorder(tmp_path, monkeypatch):
+    monkeypatch.setattr(Config, 'record_path', str(tmp_path))
+    monkeypatch.setattr(Config, 'record_segment_seconds', 10)
+    recorder = Recorder('cam')
+    Recorder.recorders['cam'] = recorder
+    yield recorder
+    del Recorder.recorders['cam']
+    if recorder.file:
+        recorder.file.close()
+        recorder.index.close()
+
+
+def _flush(recorder):
+    recorder.file.flush()
+    recorder.index.flush()
+
+
+def test_seek_lands_on_keyframe(recorder):
+    recorder._append('track1', [_packet(1), _packet(2)], 100.0, 1)
+    recorder._append('track1', [_packet(3)], 100.5, -1)
+    recorder._append('track1', [_packet(4)], 101.0, 0)
+    _flush(recorder)
+
+    segment, offset = Recorder.seek('cam', 100.7)
+    assert segment.endswith('100000000.rtp')
+    packets = list(Recorder.read('cam', 100.7, 100.9))
+    # чтение идет с точки входа не позже start и заканчивается на end
+    assert [data for _ts, _track, data in packets] == [_packet(2), _packet(3)]
+    assert offset > 0
+
+
+def test_read_spans_segments(recorder):
+    recorder._append('track1', [_packet(1)], 100.0, 0)
+    recorder._append('track2', [_packet(2)], 105.0, -1)
+    recorder._append('track1', [_packet(3)], 111.0, 0)
+    _flush(recorder)
+
+    assert len(recorder.segments) == 2
+    packets = list(Recorder.read('cam', 100.0, 120.0))
+    assert [(ts, track) for ts, track, _data in packets] == [(100.0, 'track1'), (105.0, 'track2'), (111.0, 'track1')]
+
+
+def test_seek_before_first_segment(recorder):
+    recorder._append('track1', [_packet(1)], 100.0, 0)
+    _flush(recorder)
+    assert Recorder.seek('cam', 50.0) is None
+    assert list(Recorder.read('cam', 50.0, 60.0)) == []
+
+
+def test_write_drops_when_queue_full(recorder, monkeypatch):
+    monkeypatch.setattr(Recorder, 'queue', queue.Queue(maxsize=1))
+    recorder.write('track1', [_packet(1)], 100.0, 0)
+    recorder.write('track1', [_packet(2), _packet(3)], 100.1, -1)
+    assert Recorder.queue.qsize() == 1
+    assert recorder.dropped == 2
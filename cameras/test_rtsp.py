@@ -0,0 +1,62 @@
+import pytest
+
+from rtsp import RtspParser
+
+OPTIONS = b'OPTIONS rtsp://cam/stream RTSP/1.0\r\nCSeq: 1\r\n\r\n'
+ANNOUNCE = b'ANNOUNCE rtsp://cam/stream RTSP/1.0\r\nCSeq: 2\r\nContent-Length: 5\r\n\r\nv=0\r\n'
+
+
+def test_several_messages_in_one_chunk():
+    messages = RtspParser().feed(OPTIONS + ANNOUNCE)
+    assert [m.method for m in messages] == ['OPTIONS', 'ANNOUNCE']
+    assert messages[1].header('CSeq') == '2'
+    assert messages[1].body == 'v=0\r\n'
+
+
+def test_message_split_across_chunks():
+    parser = RtspParser()
+    data = ANNOUNCE
+    messages = []
+    for i in range(len(data)):
+        messages += parser.feed(data[i:i + 1])
+    assert len(messages) == 1
+    assert messages[0].body == 'v=0\r\n'
+    assert not parser.buffer
+
+
+def test_header_parsed_once_while_body_incomplete():
+    parser = RtspParser()
+    head, body = ANNOUNCE.split(b'\r\n\r\n')
+    assert parser.feed(head + b'\r\n\r\n') == []
+    cached = parser.head
+    assert cached is not None
+    assert parser.feed(body[:2]) == []
+    assert parser.head is cached
+    assert len(parser.feed(body[2:])) == 1
+    assert parser.head is None
+
+
+def test_interleaved_frames_skipped():
+    frame = b'$\x01\x00\x03abc'
+    messages = RtspParser().feed(frame + OPTIONS + frame)
+    assert [m.method for m in messages] == ['OPTIONS']
+
+
+@pytest.mark.parametrize('length', [b'-54', b'-1', b'abc', b''])
+def test_invalid_content_length(length):
+    data = b'OPTIONS rtsp://cam/stream RTSP/1.0\r\nContent-Length: ' + length + b'\r\n\r\n'
+    with pytest.raises(RuntimeError):
+        RtspParser().feed(data)
+
+
+def test_too_large():
+    parser = RtspParser(max_size=64)
+    with pytest.raises(RuntimeError):
+        parser.feed(b'OPTIONS rtsp://cam RTSP/1.0\r\nContent-Length: 100\r\n\r\n')
+    with pytest.raises(RuntimeError):
+        RtspParser(max_size=64).feed(b'x' * 100)
+
+
+def test_invalid_utf8_replaced():
+    messages = RtspParser().feed(b'OPTIONS rtsp://cam/\xff RTSP/1.0\r\nCSeq: 1\r\n\r\n')
+    assert messages[0].url == 'rtsp://cam/�'
@@ -0,0 +1,141 @@
+import asyncio
+
+import pytest
+
+import supervisor
+from config import Config
+from shared import Shared
+from supervisor import Supervisor
+
+_sleep = asyncio.sleep
+
+
+class FakeCamera:
+    """Камера, у которой connect падает failures раз, а keepalive живет alive секунд"""
+    failures = 0
+    alive = 0
+    instances = []
+
+    def __init__(self, hash):
+        self.hash = hash
+        self.connects = 0
+        self.closed = 0
+        self.stopped = False
+        FakeCamera.instances.append(self)
+
+    async def connect(self):
+        self.connects += 1
+        if self.connects <= FakeCamera.failures:
+            raise ConnectionError('refused')
+        Shared.data[self.hash] = {'clients': {}}
+
+    async def keepalive(self):
+        await _sleep(FakeCamera.alive)
+        raise ConnectionError('Camera closed connection')
+
+    def close(self):
+        self.closed += 1
+
+    def stop(self):
+        self.stopped = True
+
+
+@pytest.fixture(autouse=True)
+def fake(monkeypatch):
+    monkeypatch.setattr(supervisor, 'Camera', FakeCamera)
+    monkeypatch.setattr(Config, 'cameras', {'cam': {}})
+    monkeypatch.setattr(Config, 'on_demand', False)
+    monkeypatch.setattr(Config, 'reconnect_delay', 1)
+    monkeypatch.setattr(Config, 'reconnect_max_delay', 4)
+    monkeypatch.setattr(Supervisor, 'tasks', {})
+    monkeypatch.setattr(Supervisor, 'ready', {})
+    monkeypatch.setattr(Supervisor, 'idle', {})
+    monkeypatch.setattr(Supervisor, 'setups', {})
+    monkeypatch.setattr(FakeCamera, 'instances', [])
+    delays = []
+
+    async def fast_sleep(delay):
+        # записываем только паузы перед переподключением
+        if delay:
+            delays.append(delay)
+        await _sleep(0)
+    monkeypatch.setattr(supervisor.asyncio, 'sleep', fast_sleep)
+    yield delays
+    Shared.data.pop('cam', None)
+
+
+def _run_until(condition, setup=None):
+    async def run():
+        if setup:
+            setup()
+        else:
+            Supervisor.start()
+        for _ in range(1000):
+            await _sleep(0)
+            if condition():
+                break
+        for task in Supervisor.tasks.values():
+            task.cancel()
+        await asyncio.gather(*Supervisor.tasks.values(), return_exceptions=True)
+    asyncio.run(run())
+
+
+def test_reconnect_backoff_doubles_up_to_max(fake, monkeypatch):
+    monkeypatch.setattr(FakeCamera, 'failures', 5)
+    _run_until(lambda: FakeCamera.instances and FakeCamera.instances[0].connects > 5)
+    camera = FakeCamera.instances[0]
+    assert fake[:5] == [1, 2, 4, 4, 4]
+    assert camera.closed >= 5
+    assert camera.stopped
+    assert Supervisor.ready['cam'].is_set()
+
+
+def test_backoff_resets_after_successful_connect(fake, monkeypatch):
+    monkeypatch.setattr(FakeCamera, 'failures', 2)
+    _run_until(lambda: len(fake) >= 5)
+    # две неудачи: 1, 2; после удачного подключения обрыв снова с начальной задержки
+    assert fake[:5] == [1, 2, 1, 1, 1]
+
+
+def _idle_check(prepare):
+    """Камера по требованию подключена, prepare меняет состояние, затем срабатывает проверка простоя"""
+    async def run():
+        Supervisor._start('cam')
+        for _ in range(10):
+            await _sleep(0)
+        prepare()
+        Supervisor._check_idle('cam')
+        running = 'cam' in Supervisor.tasks
+        for task in Supervisor.tasks.values():
+            task.cancel()
+        await asyncio.gather(*Supervisor.tasks.values(), return_exceptions=True)
+        return running
+    return asyncio.run(run())
+
+
+@pytest.fixture
+def on_demand(monkeypatch):
+    monkeypatch.setattr(Config, 'on_demand', True)
+    monkeypatch.setattr(Config, 'idle_timeout', 30)
+    monkeypatch.setattr(FakeCamera, 'alive', 3600)
+
+
+def test_idle_camera_torn_down(on_demand):
+    assert _idle_check(lambda: None) is False
+    assert 'cam' not in Shared.data
+    assert not Supervisor.ready['cam'].is_set()
+    assert FakeCamera.instances[0].stopped
+
+
+def test_camera_with_playing_client_kept(on_demand):
+    def play():
+        Shared.data['cam']['clients']['s1'] = {}
+    assert _idle_check(play) is True
+    assert 'cam' in Shared.data
+
+
+def test_camera_kept_between_setup_and_play(on_demand):
+    assert _idle_check(lambda: Supervisor.touch('cam')) is True
+    # проверка перенесена на конец окна после SETUP
+    assert 'cam' in Supervisor.idle
+    assert 'cam' in Shared.data
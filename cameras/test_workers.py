@@ -0,0 +1,62 @@
+import asyncio
+import os
+import socket
+
+import pytest
+
+from workers import Workers, _send_fd
+
+
+def test_read_hash_waits_for_first_line():
+    async def main():
+        client, conn = socket.socketpair()
+        with client, conn:
+            task = asyncio.create_task(Workers._read_hash(conn))
+            client.sendall(b'OPTIONS rtsp://proxy:4554/ca')
+            await asyncio.sleep(0.05)
+            assert not task.done()
+            client.sendall(b'm1 RTSP/1.0\r\nCSeq: 1\r\n')
+            return await asyncio.wait_for(task, 1)
+
+    assert asyncio.run(main()) == ('cam1', b'OPTIONS rtsp://proxy:4554/cam1 RTSP/1.0\r\nCSeq: 1\r\n')
+
+
+def test_read_hash_rejects_long_line():
+    async def main():
+        client, conn = socket.socketpair()
+        with client, conn:
+            client.sendall(b'x' * 10000)
+            await Workers._read_hash(conn)
+
+    with pytest.raises(RuntimeError):
+        asyncio.run(main())
+
+
+def test_send_fd_waits_for_buffer_space():
+    async def main():
+        parent, child = socket.socketpair(socket.AF_UNIX, socket.SOCK_SEQPACKET)
+        parent.setblocking(False)
+        with parent, child:
+            # забиваем буфер пары, как если бы воркер не успевал забирать сокеты
+            sent = 0
+            try:
+                while True:
+                    parent.send(b'x' * 1024)
+                    sent += 1
+            except BlockingIOError:
+                pass
+
+            read_fd, write_fd = os.pipe()
+            task = asyncio.create_task(_send_fd(parent, b'ask', read_fd))
+            await asyncio.sleep(0.05)
+            assert not task.done()
+
+            for _ in range(sent):
+                child.recv(1024)
+            await asyncio.wait_for(task, 1)
+            msg, fds, _flags, _addr = socket.recv_fds(child, 8192, 1)
+            for fd in (read_fd, write_fd, *fds):
+                os.close(fd)
+            return msg, len(fds)
+
+    assert asyncio.run(main()) == (b'ask', 1)
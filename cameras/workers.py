@@ -0,0 +1,167 @@
+import asyncio
+import multiprocessing
+import re
+import socket
+from config import Config
+from client import ClientTcpProtocol
+from supervisor import Supervisor
+from metrics import Metrics
+from log import Log
+
+_URL = re.compile(rb'\S+ rtsps?://[^/]+?:\d+/?([^/\s]*)')
+# первая строка запроса длиннее - не RTSP
+_FIRST_LINE_MAX = 4096
+# сообщение воркеру: прочитанное начало запроса, не больше двух порций чтения
+_MESSAGE_MAX = 2 * _FIRST_LINE_MAX
+
+
+class Workers:
+    """
+    Режим нескольких процессов: камеры делятся между воркерами по индексу,
+    главный процесс принимает RTSP подключения, по первой строке запроса
+    определяет камеру и передает сокет клиента воркеру-владельцу
+    вместе с уже прочитанным началом запроса
+    """
+    processes = {}
+    sockets = {}
+
+    @staticmethod
+    def owner(hash):
+        return list(Config.cameras.keys()).index(hash) % Config.workers
+
+    @staticmethod
+    def run():
+        asyncio.run(Workers._main())
+
+    @staticmethod
+    async def _main():
+        for index in range(Config.workers):
+            Workers._start_worker(index)
+
+        host = "0.0.0.0"
+        server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        server.bind((host, Config.rtsp_port))
+        server.listen(1024)
+        server.setblocking(False)
+        Log.add(f'Start listening {host}:{Config.rtsp_port} with {Config.workers} workers')
+
+        asyncio.create_task(Workers._watch())
+
+        loop = asyncio.get_running_loop()
+        while True:
+            conn, _addr = await loop.sock_accept(server)
+            asyncio.create_task(Workers._route(conn))
+
+    @staticmethod
+    def _start_worker(index):
+        # SEQPACKET: начало запроса и дескриптор приходят воркеру одним сообщением
+        parent_sock, child_sock = socket.socketpair(socket.AF_UNIX, socket.SOCK_SEQPACKET)
+        parent_sock.setblocking(False)
+        # spawn: дочерний процесс не наследует запущенный event loop
+        ctx = multiprocessing.get_context('spawn')
+        process = ctx.Process(target=_worker_main, args=(index, child_sock), daemon=True)
+        process.start()
+        child_sock.close()
+
+        Workers.processes[index] = process
+        Workers.sockets[index] = parent_sock
+
+    @staticmethod
+    async def _watch():
+        while True:
+            await asyncio.sleep(1)
+            for index, process in list(Workers.processes.items()):
+                if process.is_alive():
+                    continue
+                Log.add(f'Worker [{index}] exited with code {process.exitcode}, restarting')
+                Workers.sockets[index].close()
+                Workers._start_worker(index)
+
+    @staticmethod
+    async def _route(conn):
+        try:
+            hash, data = await asyncio.wait_for(Workers._read_hash(conn), Config.request_timeout)
+            if hash not in Config.cameras:
+                raise RuntimeError('invalid camera hash')
+            await _send_fd(Workers.sockets[Workers.owner(hash)], data, conn.fileno())
+        except Exception as e:
+            Log.error(f'Error in client routing: {e!r}')
+        finally:
+            # у воркера своя копия дескриптора
+            conn.close()
+
+    @staticmethod
+    async def _read_hash(conn):
+        """Читаем запрос до конца первой строки; прочитанное уйдет воркеру вместе с сокетом"""
+        loop = asyncio.get_running_loop()
+        conn.setblocking(False)
+        data = b''
+        while b'\r\n' not in data:
+            if len(data) >= _FIRST_LINE_MAX:
+                raise RuntimeError('invalid ask')
+            chunk = await loop.sock_recv(conn, _FIRST_LINE_MAX)
+            if not chunk:
+                raise ConnectionError('client closed connection')
+            data += chunk
+        res = _URL.match(data)
+        if not res:
+            raise RuntimeError('invalid ask')
+        return res.group(1).decode(), data
+
+
+async def _wait_readable(loop, sock):
+    fut = loop.create_future()
+    loop.add_reader(sock.fileno(), lambda: fut.done() or fut.set_result(None))
+    try:
+        await fut
+    finally:
+        loop.remove_reader(sock.fileno())
+
+
+async def _send_fd(sock, data, fd):
+    """send_fds на неблокирующем сокете: ждем места в буфере через add_writer, а не блокируем loop"""
+    loop = asyncio.get_running_loop()
+    while True:
+        try:
+            socket.send_fds(sock, [data], [fd])
+            return
+        except BlockingIOError:
+            pass
+        fut = loop.create_future()
+        loop.add_writer(sock.fileno(), lambda: fut.done() or fut.set_result(None))
+        try:
+            await fut
+        finally:
+            loop.remove_writer(sock.fileno())
+
+
+def _worker_main(index, sock):
+    asyncio.run(_serve(index, sock))
+
+
+async def _serve(index, sock):
+    if Config.log_file:
+        # у каждого воркера свой файл, чтобы ротация не мешала соседям
+        Config.log_file = f'{Config.log_file}.worker{index}'
+    Supervisor.start([hash for hash in Config.cameras.keys() if Workers.owner(hash) == index])
+    if Config.metrics_port:
+        # у каждого воркера свои счетчики и свой порт
+        asyncio.create_task(Metrics.serve(Config.metrics_port + index))
+
+    loop = asyncio.get_running_loop()
+    sock.setblocking(False)
+    while True:
+        await _wait_readable(loop, sock)
+        try:
+            msg, fds, _flags, _addr = socket.recv_fds(sock, _MESSAGE_MAX, 1)
+        except BlockingIOError:
+            continue
+        if not msg:
+            # главный процесс завершился
+            return
+        for fd in fds:
+            conn = socket.socket(fileno=fd)
+            _transport, protocol = await loop.connect_accepted_socket(lambda: ClientTcpProtocol(), conn)
+            # начало запроса главный процесс уже забрал из сокета
+            protocol.data_received(msg)
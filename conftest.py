@@ -0,0 +1,15 @@
+import pytest
+
+
+@pytest.fixture
+def database(tmp_path, monkeypatch):
+    """модуль db.db с пустой базой во временном каталоге"""
+    from db import db
+
+    monkeypatch.setattr(db, "db_path", str(tmp_path / "test.db"))
+    # таймер не должен сбрасывать очередь посреди теста
+    monkeypatch.setattr(db, "flush_interval", 60)
+    db.create()
+    yield db
+    db._pending.clear()
+    db.close_db()
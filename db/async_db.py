@@ -0,0 +1,146 @@
+import asyncio
+from typing import Any, Literal
+from urllib.request import pathname2url
+
+import aiosqlite
+
+from db import db as sync_db
+
+# соединений только для чтения; писатель всегда один
+readers_count = 4
+# таймаут запроса по умолчанию, секунды
+timeout = 5.0
+# подготовленных выражений в кеше каждого соединения
+cached_statements = 256
+
+_writer: aiosqlite.Connection | None = None
+_writer_lock: asyncio.Lock | None = None
+_readers: asyncio.Queue | None = None
+_all_readers: list[aiosqlite.Connection] = []
+# первые конкурентные вызовы не должны открыть соединения дважды;
+# создается в работающем цикле событий, close сбрасывает его вместе с соединениями
+_connect_lock: asyncio.Lock | None = None
+
+
+async def connect(path: str | None = None, readers: int | None = None) -> None:
+    """Открывает писателя и пул читателей; повторный вызов ничего не делает"""
+    global _writer, _writer_lock, _readers, _connect_lock
+    if _writer is not None:
+        return
+    if _connect_lock is None:
+        _connect_lock = asyncio.Lock()
+    async with _connect_lock:
+        if _writer is not None:
+            return
+
+        # по умолчанию та же база, что и у синхронного db.db
+        path = sync_db.db_path if path is None else path
+        writer = await aiosqlite.connect(path, cached_statements=cached_statements)
+        # WAL: читатели не ждут писателя и видят последний закоммиченный снимок
+        await writer.execute("PRAGMA journal_mode=WAL")
+        await writer.execute("PRAGMA synchronous=NORMAL")
+        await writer.commit()
+
+        pool = asyncio.Queue()
+        for _ in range(readers_count if readers is None else readers):
+            # путь в URI экранируется: ?, # и % в имени иначе читаются как часть URI
+            reader = await aiosqlite.connect(f"file:{pathname2url(path)}?mode=ro", uri=True,
+                                             cached_statements=cached_statements)
+            _all_readers.append(reader)
+            pool.put_nowait(reader)
+
+        _writer, _writer_lock, _readers = writer, asyncio.Lock(), pool
+
+
+async def close() -> None:
+    global _writer, _writer_lock, _readers, _connect_lock
+    if _writer is None:
+        return
+    async with _connect_lock:
+        if _writer is None:
+            return
+        for reader in _all_readers:
+            await reader.close()
+        _all_readers.clear()
+        await _writer.close()
+        _writer, _writer_lock, _readers = None, None, None
+    _connect_lock = None
+
+
+async def fetch_all(sql: Literal[str], params: tuple[Any, ...] | None = None,
+                    timeout: float | None = None) -> list[dict]:
+    async def run(db: aiosqlite.Connection) -> list[dict]:
+        async with db.execute(sql, params or ()) as cursor:
+            rows = await cursor.fetchall()
+            column_names = [d[0] for d in cursor.description]
+        return [dict(zip(column_names, row)) for row in rows]
+
+    return await _read(run, timeout)
+
+
+async def fetch_one(sql: Literal[str], params: tuple[Any, ...] | None = None,
+                    timeout: float | None = None) -> dict | None:
+    async def run(db: aiosqlite.Connection) -> dict | None:
+        async with db.execute(sql, params or ()) as cursor:
+            row = await cursor.fetchone()
+            if not row:
+                return None
+            return dict(zip([d[0] for d in cursor.description], row))
+
+    return await _read(run, timeout)
+
+
+async def execute(sql: Literal[str], params: tuple[Any, ...] | None = None,
+                  timeout: float | None = None) -> int:
+    """Выполняет запрос на писателе и коммитит; возвращает число измененных строк"""
+    async def run(db: aiosqlite.Connection) -> int:
+        async with db.execute(sql, params or ()) as cursor:
+            rowcount = cursor.rowcount
+        await db.commit()
+        return rowcount
+
+    return await _write(run, timeout)
+
+
+async def execute_many(sql: Literal[str], params_seq: list[tuple[Any, ...]],
+                       timeout: float | None = None) -> int:
+    async def run(db: aiosqlite.Connection) -> int:
+        async with db.executemany(sql, params_seq) as cursor:
+            rowcount = cursor.rowcount
+        await db.commit()
+        return rowcount
+
+    return await _write(run, timeout)
+
+
+async def _read(run, timeout_: float | None):
+    if _readers is None:
+        await connect()
+    db = await _readers.get()
+    try:
+        return await _run(db, run, timeout_)
+    finally:
+        _readers.put_nowait(db)
+
+
+async def _write(run, timeout_: float | None):
+    if _writer is None:
+        await connect()
+    async with _writer_lock:
+        try:
+            return await _run(_writer, run, timeout_)
+        except BaseException:
+            # незавершенная транзакция не должна попасть в коммит следующего запроса
+            if _writer.in_transaction:
+                await asyncio.shield(_writer.rollback())
+            raise
+
+
+async def _run(db: aiosqlite.Connection, run, timeout_: float | None):
+    try:
+        return await asyncio.wait_for(run(db), timeout if timeout_ is None else timeout_)
+    except (asyncio.TimeoutError, asyncio.CancelledError):
+        # запрос продолжает выполняться в потоке соединения: прерываем его,
+        # чтобы соединение освободилось для следующего вызова
+        await db.interrupt()
+        raise
@@ -0,0 +1,54 @@
+"""
+Микро-бенчмарк чтения таблицы products: fetch_all против fetch_iter
+с разными типами строк. Для каждого варианта печатает время полного
+прохода и пик памяти Python (tracemalloc) во время прохода.
+
+    python -m db.benchmark --rows 1000000 --batch 1000
+"""
+import argparse
+import os
+import tempfile
+import time
+import tracemalloc
+
+from db import db
+
+
+def _fill(rows: int) -> None:
+    db.create()
+    db.execute_many(
+        "INSERT INTO products (id, status, qr_code) VALUES (?, ?, ?)",
+        ((f"{i:032x}", str(i % 4 + 1), f"qr-{i}") for i in range(rows)),
+    )
+
+
+def _measure(name: str, read) -> None:
+    tracemalloc.start()
+    started = time.perf_counter()
+    count = read()
+    elapsed = time.perf_counter() - started
+    _current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"{name:<24} {count} rows  {elapsed:7.3f} s  {count / elapsed:10.0f} rows/s  peak {peak / 1024 / 1024:8.2f} MiB")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="products read benchmark")
+    parser.add_argument("--rows", type=int, default=200000)
+    parser.add_argument("--batch", type=int, default=500, help="fetchmany batch size")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db.db_path = os.path.join(tmp, "benchmark.db")
+        _fill(args.rows)
+        sql = "SELECT id, status, qr_code FROM products"
+
+        _measure("fetch_all", lambda: len(db.fetch_all(sql)))
+        for row_type in ("dict", "tuple", "row", "namedtuple"):
+            _measure(f"fetch_iter {row_type}",
+                     lambda: sum(1 for _ in db.fetch_iter(sql, batch_size=args.batch, row_type=row_type)))
+        db.close_db()
+
+
+if __name__ == "__main__":
+    main()
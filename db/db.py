@@ -1,46 +1,153 @@
+import atexit
+import itertools
+import logging
 import os
 import sqlite3
-from typing import Any, Literal
+import threading
+from collections import OrderedDict, namedtuple
+from contextlib import contextmanager
+from functools import lru_cache
+from typing import Any, Iterator, Literal
+
+log = logging.getLogger(__name__)
 
 db_path = os.path.join(os.path.dirname(__file__), "database.db")
 
+# отложенная запись: пачка сбрасывается при flush_size операциях или через flush_interval секунд
+flush_size = 500
+flush_interval = 0.5
+
+# одно соединение на процесс, обращения к нему из разных потоков идут по очереди
+_lock = threading.RLock()
+_pending: OrderedDict[tuple[str, Any], tuple[Any, ...]] = OrderedDict()
+_flush_timer: threading.Timer | None = None
+_unique_keys = itertools.count()
+
 
 def get_db() -> sqlite3.Connection:
-    if not hasattr(get_db, "db"):
-        db = sqlite3.connect(db_path)
-        get_db.db = db
+    with _lock:
+        if not hasattr(get_db, "db"):
+            db = sqlite3.connect(db_path, check_same_thread=False)
+            # WAL: коммит без fsync журнала на каждую запись, читатели не блокируют писателя
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            get_db.db = db
+            atexit.register(close_db)
 
-    return get_db.db
+        return get_db.db
 
 
 def fetch_all(sql: Literal[str], params: tuple[Any, ...] | None = None) -> list[dict]:
-    cursor = _get_cursor(sql, params)
-    rows = cursor.fetchall()
-    results = []
-    for row_ in rows:
-        results.append(_get_result_with_column_names(cursor, row_))
-    cursor.close()
-    return results
-
-
-def fetch_one(sql: Literal[str], params: tuple[Any, ...] | None = None) -> dict | None:
-    cursor = _get_cursor(sql, params)
-    row_ = cursor.fetchone()
-    if not row_:
+    with _lock:
+        cursor = _get_cursor(sql, params)
+        rows = cursor.fetchall()
+        column_names = _get_column_names(cursor)
+        cursor.close()
+    return [dict(zip(column_names, row_)) for row_ in rows]
+
+
+def fetch_iter(sql: Literal[str], params: tuple[Any, ...] | None = None, batch_size: int = 500,
+               row_type: Literal["dict", "tuple", "row", "namedtuple"] = "dict") -> Iterator[Any]:
+    """
+    Строки результата пачками по batch_size, без загрузки всей выборки в память.
+    row_type: dict, tuple, sqlite3.Row или namedtuple (класс кешируется по набору колонок)
+    """
+    with _lock:
+        cursor = _get_cursor(sql, params, sqlite3.Row if row_type == "row" else None)
+        column_names = _get_column_names(cursor)
+    make_row = None
+    if row_type == "dict":
+        make_row = lambda row_: dict(zip(column_names, row_))
+    elif row_type == "namedtuple":
+        make_row = _get_row_class(column_names)._make
+    elif row_type not in ("tuple", "row"):
+        raise ValueError(f"Unknown row_type: {row_type}")
+
+    try:
+        while True:
+            # блокировка только на время чтения пачки: между пачками соединение свободно
+            with _lock:
+                rows = cursor.fetchmany(batch_size)
+            if not rows:
+                return
+            if make_row is None:
+                yield from rows
+            else:
+                yield from map(make_row, rows)
+    finally:
+        cursor.close()
+
+
+def fetch_one(sql: Literal[str], params: tuple[Any, ...] | None = None, flush: bool = True) -> dict | None:
+    """flush=False: читать без сброса отложенных записей (см. get_pending)"""
+    with _lock:
+        cursor = _get_cursor(sql, params, flush=flush)
+        row_ = cursor.fetchone()
+        if not row_:
+            cursor.close()
+            return None
+        row = _get_result_with_column_names(cursor, row_)
         cursor.close()
-        return None
-    row = _get_result_with_column_names(cursor, row_)
-    cursor.close()
     return row
 
 
 def execute(sql: Literal[str], params: tuple[Any, ...] | None = None, autocommit: bool = True) -> None:
-    db = get_db()
-    args: tuple[Literal[str], tuple[Any, ...] | None] = (sql, params)
-    cursor = db.cursor()
-    cursor.execute(*args)
-    if autocommit:
-        db.commit()
+    with _lock:
+        _flush_pending()
+        db = get_db()
+        args: tuple[Literal[str], tuple[Any, ...]] = (sql, params or ())
+        cursor = db.cursor()
+        cursor.execute(*args)
+        if autocommit:
+            db.commit()
+
+
+def execute_many(sql: Literal[str], params_seq: list[tuple[Any, ...]], autocommit: bool = True) -> None:
+    with _lock:
+        _flush_pending()
+        db = get_db()
+        cursor = db.cursor()
+        cursor.executemany(sql, params_seq)
+        if autocommit:
+            db.commit()
+
+
+@contextmanager
+def transaction() -> Iterator[sqlite3.Connection]:
+    """Несколько запросов одной транзакцией: коммит в конце блока, откат при исключении"""
+    with _lock:
+        _flush_pending()
+        db = get_db()
+        with db:
+            yield db
+
+
+def execute_later(sql: Literal[str], params: tuple[Any, ...], key: Any = None) -> None:
+    """
+    Отложенная запись. Повторная операция с тем же sql и key (например, id товара)
+    заменяет еще не записанную, так что в базу попадает только последнее значение
+    """
+    with _lock:
+        coalesce_key = (sql, key if key is not None else ("unique", next(_unique_keys)))
+        # замена значения оставляет операцию на ее месте в очереди
+        _pending[coalesce_key] = params
+
+        if len(_pending) >= flush_size:
+            _flush_pending()
+        else:
+            _schedule_flush()
+
+
+def get_pending(sql: Literal[str], key: Any) -> tuple[Any, ...] | None:
+    """Параметры еще не записанной операции execute_later с этими sql и key"""
+    with _lock:
+        return _pending.get((sql, key))
+
+
+def flush() -> int:
+    """Записывает отложенные операции одной транзакцией, возвращает количество записанных"""
+    with _lock:
+        return _flush_pending()
 
 
 def close_db() -> None:
@@ -48,17 +155,104 @@ def close_db() -> None:
 
 
 def _close_db() -> None:
-    get_db().close()
+    with _lock:
+        if not hasattr(get_db, "db"):
+            return
+        _flush_pending()
+        get_db.db.close()
+        del get_db.db
+
+
+def _flush_pending() -> int:
+    global _flush_timer
+    if _flush_timer is not None:
+        _flush_timer.cancel()
+        _flush_timer = None
+    if not _pending:
+        return 0
+
+    items = list(_pending.items())
+    db = get_db()
+    try:
+        # подряд идущие операции с одним sql - один executemany, все вместе - один коммит
+        with db:
+            for sql, group in itertools.groupby(items, key=lambda item: item[0][0]):
+                db.executemany(sql, [params for _key, params in group])
+    except sqlite3.OperationalError as e:
+        if not _is_transient(e):
+            return _flush_one_by_one(db, items)
+        # база занята: транзакция откатилась, пачка остается в очереди до следующего сброса
+        _schedule_flush()
+        raise
+    except sqlite3.Error:
+        return _flush_one_by_one(db, items)
+    _pending.clear()
+    return len(items)
+
+
+def _flush_one_by_one(db: sqlite3.Connection, items: list) -> int:
+    """Пачка не записалась из-за ошибки в данных: пишем операции по одной, ошибочные отбрасываем"""
+    written = 0
+    for coalesce_key, params in items:
+        try:
+            with db:
+                db.execute(coalesce_key[0], params)
+            written += 1
+        except sqlite3.OperationalError as e:
+            if _is_transient(e):
+                # записанные уже убраны из очереди, остальные повторим позже
+                _schedule_flush()
+                raise
+            log.error("Dropped deferred write %r %r: %r", coalesce_key[0], params, e)
+        except sqlite3.Error as e:
+            log.error("Dropped deferred write %r %r: %r", coalesce_key[0], params, e)
+        del _pending[coalesce_key]
+    return written
+
+
+def _is_transient(error: sqlite3.OperationalError) -> bool:
+    message = str(error).lower()
+    return "locked" in message or "busy" in message
+
+
+def _try_flush() -> None:
+    """Сброс перед чтением: занятая база не мешает читать, пачка запишется позже"""
+    try:
+        _flush_pending()
+    except sqlite3.OperationalError as e:
+        log.warning("Deferred writes postponed: %r", e)
+
+
+def _schedule_flush() -> None:
+    global _flush_timer
+    if _flush_timer is None:
+        _flush_timer = threading.Timer(flush_interval, flush)
+        _flush_timer.daemon = True
+        _flush_timer.start()
 
 
-def _get_cursor(sql: Literal[str], params: tuple[Any, ...] | None) -> sqlite3.Cursor:
+def _get_cursor(sql: Literal[str], params: tuple[Any, ...] | None, row_factory: Any = None,
+                flush: bool = True) -> sqlite3.Cursor:
+    if flush:
+        _try_flush()
     db = get_db()
-    args: tuple[Literal[str], tuple[Any, ...] | None] = (sql, params)
+    args: tuple[Literal[str], tuple[Any, ...]] = (sql, params or ())
     cursor = db.cursor()
+    if row_factory:
+        cursor.row_factory = row_factory
     cursor.execute(*args)
     return cursor
 
 
+def _get_column_names(cursor: sqlite3.Cursor) -> tuple[str, ...]:
+    return tuple(d[0] for d in cursor.description) if cursor.description else ()
+
+
+@lru_cache(maxsize=128)
+def _get_row_class(column_names: tuple[str, ...]) -> type:
+    return namedtuple("Row", column_names, rename=True)
+
+
 def _get_result_with_column_names(cursor: sqlite3.Cursor, row: sqlite3.Row) -> dict:
     column_names = [d[0] for d in cursor.description]
     resulting_row = {}
@@ -67,12 +261,124 @@ def _get_result_with_column_names(cursor: sqlite3.Cursor, row: sqlite3.Row) -> d
     return resulting_row
 
 
+# миграции схемы по порядку; номер последней примененной хранится в PRAGMA user_version.
+# уже выпущенные миграции не меняются, изменения схемы - только новыми элементами в конце
+MIGRATIONS: list[list[str]] = [
+    # 1: исходная таблица товаров
+    [
+        """
+        CREATE TABLE IF NOT EXISTS products (
+            id TEXT PRIMARY KEY,
+            status TEXT,
+            qr_code TEXT
+        )
+        """,
+    ],
+    # 2: коды, полученные из 1С
+    [
+        """
+        CREATE TABLE IF NOT EXISTS qr_data (
+            qr_code TEXT PRIMARY KEY,
+            payload TEXT,
+            synced_at REAL NOT NULL DEFAULT ((julianday('now') - 2440587.5) * 86400.0)
+        )
+        """,
+    ],
+    # 3: покрывающие индексы: поиск по qr-коду и выборка товаров в статусе без чтения таблицы
+    [
+        "CREATE INDEX IF NOT EXISTS idx_products_qr_code ON products (qr_code, status, id)",
+        "CREATE INDEX IF NOT EXISTS idx_products_status ON products (status, id)",
+    ],
+    # 4: история смены статусов, только на добавление, заполняется триггерами
+    [
+        """
+        CREATE TABLE IF NOT EXISTS status_history (
+            id INTEGER PRIMARY KEY,
+            product_id TEXT NOT NULL,
+            old_status TEXT,
+            new_status TEXT,
+            changed_at REAL NOT NULL DEFAULT ((julianday('now') - 2440587.5) * 86400.0)
+        )
+        """,
+        # покрывающие индексы для выборок status_transitions за период и по товару
+        "CREATE INDEX IF NOT EXISTS idx_status_history_period "
+        "ON status_history (changed_at, old_status, new_status, product_id)",
+        "CREATE INDEX IF NOT EXISTS idx_status_history_product_period "
+        "ON status_history (product_id, changed_at, old_status, new_status)",
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_products_status_insert AFTER INSERT ON products
+        WHEN NEW.status IS NOT NULL
+        BEGIN
+            INSERT INTO status_history (product_id, old_status, new_status) VALUES (NEW.id, NULL, NEW.status);
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_products_status_update AFTER UPDATE OF status ON products
+        WHEN OLD.status IS NOT NEW.status
+        BEGIN
+            INSERT INTO status_history (product_id, old_status, new_status) VALUES (NEW.id, OLD.status, NEW.status);
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_status_history_no_update BEFORE UPDATE ON status_history
+        BEGIN
+            SELECT RAISE(ABORT, 'status_history is append-only');
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_status_history_no_delete BEFORE DELETE ON status_history
+        BEGIN
+            SELECT RAISE(ABORT, 'status_history is append-only');
+        END
+        """,
+    ],
+]
+
+
+def migrate() -> int:
+    """Применяет недостающие миграции, каждую в своей транзакции; возвращает версию схемы"""
+    with _lock:
+        _flush_pending()
+        db = get_db()
+        version = db.execute("PRAGMA user_version").fetchone()[0]
+        for target in range(version + 1, len(MIGRATIONS) + 1):
+            # DDL в sqlite3 не открывает транзакцию сам, поэтому BEGIN явно
+            db.execute("BEGIN")
+            try:
+                for statement in MIGRATIONS[target - 1]:
+                    db.execute(statement)
+                db.execute(f"PRAGMA user_version = {target}")
+                db.commit()
+            except BaseException:
+                db.rollback()
+                raise
+            version = target
+        return version
+
+
+def status_transitions(start: float, end: float, product_id: str | None = None) -> list[dict]:
+    """Смены статусов за период [start, end) (unix time), например за смену; только по покрывающему индексу"""
+    if product_id is not None:
+        return fetch_all(
+            "SELECT product_id, old_status, new_status, changed_at FROM status_history "
+            "WHERE product_id = ? AND changed_at >= ? AND changed_at < ? ORDER BY changed_at",
+            (product_id, start, end),
+        )
+    return fetch_all(
+        "SELECT product_id, old_status, new_status, changed_at FROM status_history "
+        "WHERE changed_at >= ? AND changed_at < ? ORDER BY changed_at",
+        (start, end),
+    )
+
+
+def transition_counts(start: float, end: float) -> list[dict]:
+    """Количество переходов old_status -> new_status за период, только по покрывающему индексу"""
+    return fetch_all(
+        "SELECT old_status, new_status, count(*) AS count FROM status_history "
+        "WHERE changed_at >= ? AND changed_at < ? GROUP BY old_status, new_status",
+        (start, end),
+    )
+
+
 def create() -> None:
-    create_table_sql = """
-    CREATE TABLE IF NOT EXISTS products (
-        id TEXT PRIMARY KEY,
-        status TEXT,
-        qr_code TEXT
-    );
-    """
-    execute(create_table_sql, params=())
\ No newline at end of file
+    migrate()
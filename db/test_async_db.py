@@ -0,0 +1,79 @@
+import asyncio
+
+import pytest
+
+pytest.importorskip("aiosqlite")
+
+from db import async_db  # noqa: E402
+
+
+@pytest.fixture
+def adb(database):
+    return async_db
+
+
+def _run(coro):
+    # соединения aiosqlite привязаны к циклу событий: закрываем их в том же цикле
+    async def main():
+        try:
+            return await coro
+        finally:
+            await async_db.close()
+
+    return asyncio.run(main())
+
+
+def test_concurrent_first_calls_connect_once(adb):
+    async def main():
+        await asyncio.gather(
+            adb.fetch_all("SELECT id FROM products"),
+            adb.execute("INSERT INTO products (id, status) VALUES (?, ?)", ("a", "1")),
+            adb.fetch_one("SELECT COUNT(*) AS n FROM products"),
+        )
+        return len(adb._all_readers)
+
+    assert _run(main()) == adb.readers_count
+
+
+def test_reads_run_while_write_in_flight(adb):
+    rows = 50000
+
+    async def main():
+        await adb.connect()
+        write = asyncio.create_task(adb.execute_many(
+            "INSERT INTO products (id, status) VALUES (?, ?)", [(str(i), "1") for i in range(rows)]))
+        counts = []
+        while not write.done():
+            row = await adb.fetch_one("SELECT COUNT(*) AS n FROM products")
+            counts.append(row["n"])
+        await write
+        counts.append((await adb.fetch_one("SELECT COUNT(*) AS n FROM products"))["n"])
+        return counts
+
+    counts = _run(main())
+    # читатель видит только закоммиченный снимок: всю пачку или ничего
+    assert set(counts) <= {0, rows}
+    assert counts[-1] == rows
+
+
+def test_timeout_interrupts_query(adb):
+    async def main():
+        with pytest.raises(asyncio.TimeoutError):
+            await adb.fetch_one("WITH RECURSIVE c(x) AS (SELECT 1 UNION ALL SELECT x + 1 FROM c) "
+                                "SELECT COUNT(*) FROM c", timeout=0.05)
+        # соединение освободилось и принимает следующие запросы
+        return await adb.fetch_one("SELECT 1 AS one", timeout=1)
+
+    assert _run(main()) == {"one": 1}
+
+
+def test_readers_open_path_with_uri_characters(adb, tmp_path, monkeypatch):
+    directory = tmp_path / "a?b#c%20d"
+    directory.mkdir()
+    monkeypatch.setattr(adb.sync_db, "db_path", str(directory / "test.db"))
+    adb.sync_db.close_db()
+    adb.sync_db.create()
+    adb.sync_db.execute("INSERT INTO products (id, status) VALUES (?, ?)", ("a", "1"))
+
+    row = _run(adb.fetch_one("SELECT status FROM products WHERE id = ?", ("a",)))
+    assert row["status"] == "1"
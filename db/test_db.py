@@ -0,0 +1,148 @@
+import sqlite3
+
+import pytest
+
+from db import db
+
+
+def _status(product_id: str) -> str:
+    return db.fetch_one("SELECT status FROM products WHERE id = ?", (product_id,))["status"]
+
+
+def test_execute_later_keeps_last_value_per_key(database):
+    database.execute_many("INSERT INTO products (id, status) VALUES (?, ?)", [("a", "1"), ("b", "1")])
+    sql = "UPDATE products SET status = ? WHERE id = ?;"
+    database.execute_later(sql, ("2", "a"), key="a")
+    database.execute_later(sql, ("3", "b"), key="b")
+    database.execute_later(sql, ("4", "a"), key="a")
+
+    # повторная запись по ключу не переносит операцию в конец очереди
+    assert [key for _sql, key in database._pending] == ["a", "b"]
+    assert database.flush() == 2
+    assert (_status("a"), _status("b")) == ("4", "3")
+
+
+def test_reads_see_pending_writes(database):
+    database.execute("INSERT INTO products (id, status) VALUES (?, ?)", ("a", "1"))
+    database.execute_later("UPDATE products SET status = ? WHERE id = ?;", ("2", "a"), key="a")
+    assert _status("a") == "2"
+    assert not database._pending
+
+
+def test_failed_flush_keeps_pending(database):
+    database.execute("INSERT INTO products (id, status) VALUES (?, ?)", ("a", "3"))
+    database.get_db().execute("PRAGMA busy_timeout=0")
+    database.execute_later("UPDATE products SET status = ? WHERE id = ?;", ("4", "a"), key="a")
+
+    other = sqlite3.connect(database.db_path)
+    other.execute("BEGIN IMMEDIATE")
+    with pytest.raises(sqlite3.OperationalError):
+        database.flush()
+    assert list(database._pending.values()) == [("4", "a")]
+    other.rollback()
+    other.close()
+
+    assert database.flush() == 1
+    assert _status("a") == "4"
+
+
+def test_failed_write_is_dropped_alone(database):
+    database.execute("INSERT INTO products (id, status) VALUES (?, ?)", ("a", "1"))
+    database.execute_later("UPDATE products SET status = ? WHERE id = ?;", ("2", "a"), key="a")
+    database.execute_later("INSERT INTO products (id, status) VALUES (?, ?)", ("a", "5"))
+    database.execute_later("INSERT INTO products (id, status) VALUES (?, ?)", ("b", "3"))
+
+    # UNIQUE нарушает только одна операция: остальные записаны, очередь пуста
+    assert database.flush() == 2
+    assert not database._pending
+    assert (_status("a"), _status("b")) == ("2", "3")
+    database.execute("UPDATE products SET status = ? WHERE id = ?", ("4", "b"))
+    assert _status("b") == "4"
+
+
+def test_reads_do_not_fail_while_flush_is_postponed(database):
+    database.execute("INSERT INTO products (id, status) VALUES (?, ?)", ("a", "1"))
+    database.get_db().execute("PRAGMA busy_timeout=0")
+    database.execute_later("UPDATE products SET status = ? WHERE id = ?;", ("2", "a"), key="a")
+
+    other = sqlite3.connect(database.db_path)
+    other.execute("BEGIN IMMEDIATE")
+    try:
+        assert _status("a") == "1"
+        assert len(database._pending) == 1
+    finally:
+        other.rollback()
+        other.close()
+    assert _status("a") == "2"
+
+
+def test_close_db_flushes(database):
+    database.execute("INSERT INTO products (id, status) VALUES (?, ?)", ("a", "1"))
+    database.execute_later("UPDATE products SET status = ? WHERE id = ?;", ("2", "a"), key="a")
+    database.close_db()
+    assert _status("a") == "2"
+
+
+@pytest.mark.parametrize("row_type", ["dict", "tuple", "row", "namedtuple"])
+def test_fetch_iter_row_types(database, row_type):
+    database.execute_many("INSERT INTO products (id, status) VALUES (?, ?)", [(str(i), "1") for i in range(7)])
+    rows = list(database.fetch_iter("SELECT id, status FROM products ORDER BY id", batch_size=3, row_type=row_type))
+    assert len(rows) == 7
+    assert [tuple(row.values()) if row_type == "dict" else tuple(row) for row in rows][0] == ("0", "1")
+
+
+def test_fetch_one_without_flush(database):
+    database.execute("INSERT INTO products (id, status) VALUES (?, ?)", ("a", "1"))
+    sql = "UPDATE products SET status = ? WHERE id = ?;"
+    database.execute_later(sql, ("2", "a"), key="a")
+    row = database.fetch_one("SELECT status FROM products WHERE id = ?", ("a",), flush=False)
+    assert row["status"] == "1"
+    assert database.get_pending(sql, "a") == ("2", "a")
+    assert database.get_pending(sql, "b") is None
+
+
+def test_migrations_applied_once(database):
+    assert database.get_db().execute("PRAGMA user_version").fetchone()[0] == len(database.MIGRATIONS)
+    assert database.migrate() == len(database.MIGRATIONS)
+    indexes = {row[0] for row in database.get_db().execute(
+        "SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = 'status_history'")}
+    assert indexes == {"idx_status_history_period", "idx_status_history_product_period"}
+
+
+def _plan(database, sql, params):
+    rows = database.get_db().execute(f"EXPLAIN QUERY PLAN {sql}", params).fetchall()
+    return " ".join(row[-1] for row in rows)
+
+
+@pytest.mark.parametrize("sql, params", [
+    ("SELECT product_id, old_status, new_status, changed_at FROM status_history "
+     "WHERE changed_at >= ? AND changed_at < ? ORDER BY changed_at", (0, 1)),
+    ("SELECT product_id, old_status, new_status, changed_at FROM status_history "
+     "WHERE product_id = ? AND changed_at >= ? AND changed_at < ? ORDER BY changed_at", ("a", 0, 1)),
+    ("SELECT old_status, new_status, count(*) AS count FROM status_history "
+     "WHERE changed_at >= ? AND changed_at < ? GROUP BY old_status, new_status", (0, 1)),
+    ("SELECT id, status FROM products WHERE qr_code = ?", ("qr",)),
+])
+def test_history_and_lookup_queries_are_covered(database, sql, params):
+    assert "COVERING INDEX" in _plan(database, sql, params)
+
+
+def test_status_history_written_by_triggers(database):
+    database.execute("INSERT INTO products (id, status) VALUES (?, ?)", ("a", "1"))
+    database.execute("UPDATE products SET status = ? WHERE id = ?", ("1", "a"))
+    database.execute("UPDATE products SET status = ? WHERE id = ?", ("2", "a"))
+    transitions = database.status_transitions(0, 2 ** 40, product_id="a")
+    assert [(t["old_status"], t["new_status"]) for t in transitions] == [(None, "1"), ("1", "2")]
+    assert {(c["old_status"], c["new_status"]): c["count"] for c in database.transition_counts(0, 2 ** 40)} == {
+        (None, "1"): 1, ("1", "2"): 1}
+
+    with pytest.raises(sqlite3.IntegrityError):
+        database.execute("DELETE FROM status_history")
+
+
+def test_transaction_rolls_back_on_error(database):
+    with pytest.raises(sqlite3.IntegrityError):
+        with database.transaction() as db_:
+            db_.execute("INSERT INTO qr_data (qr_code, payload) VALUES (?, ?)", ("qr", "{}"))
+            db_.execute("INSERT INTO qr_data (qr_code, payload) VALUES (?, ?)", ("qr", "{}"))
+    assert database.fetch_one("SELECT COUNT(*) AS n FROM qr_data")["n"] == 0
@@ -0,0 +1,50 @@
+import argparse
+import os
+
+from dotenv import load_dotenv
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(prog="python -m qrscanner", description="Сканер qr-кодов")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    live = commands.add_parser("live", help="сканирование камер из QR_SOURCES")
+    live.add_argument("--sources", help="источники через запятую, по умолчанию QR_SOURCES")
+    live.add_argument("--workers", type=int, help="процессов-декодеров, по умолчанию QR_WORKERS")
+    live.add_argument("--show", action="store_true", help="показывать окна с кадрами (по умолчанию без GUI)")
+
+    offline = commands.add_parser("offline", help="сканирование видеофайла или каталога изображений")
+    offline.add_argument("path")
+    offline.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    offline.add_argument("--scales", default=None, help="уровни пирамиды, например 0.5,1 (по умолчанию QR_SCALES)")
+    offline.add_argument("--step", type=int, default=1, help="брать каждый N-й кадр или файл")
+    offline.add_argument("--no-db", "--dry-run", dest="no_db", action="store_true",
+                         help="не записывать статусы в базу")
+
+    args = parser.parse_args()
+    load_dotenv(os.path.join(os.path.dirname(os.path.abspath(os.path.dirname(__file__))), "env.env"))
+
+    if args.command == "live":
+        from qrscanner.qrcode import main as run_live
+
+        if args.sources:
+            os.environ["QR_SOURCES"] = args.sources
+        if args.workers:
+            os.environ["QR_WORKERS"] = str(args.workers)
+        run_live(show=args.show)
+        return
+
+    from qrscanner.offline import scan_offline
+    from qrscanner.pipeline import parse_scales
+
+    summary = scan_offline(
+        args.path, args.workers, parse_scales(args.scales or os.getenv("QR_SCALES", "1")),
+        step=max(1, args.step), update_db=not args.no_db,
+    )
+    width = max(len(name) for name in summary)
+    for name, value in summary.items():
+        print(f"{name:<{width}}  {value}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,186 @@
+import time
+from collections import namedtuple
+
+import numpy as np
+
+# распознанный qr-код: данные, прямоугольник (x, y, w, h) и контур
+Detection = namedtuple("Detection", ["data", "rect", "polygon"])
+
+# cv2 и pyzbar.decode после первого обращения, см. opencv()
+_cv2 = None
+_decode = None
+
+
+def opencv():
+    """модуль cv2: загружается один раз при первом обращении, импорт qrscanner его не требует"""
+
+    global _cv2
+    if _cv2 is None:
+        import cv2
+
+        _cv2 = cv2
+    return _cv2
+
+
+def _zbar_decode():
+    global _decode
+    if _decode is None:
+        from pyzbar.pyzbar import decode
+
+        _decode = decode
+    return _decode
+
+
+def decode_frame(image: np.ndarray) -> list[Detection]:
+    """функция для поиска qr-кодов на кадре (цветном или уже сером)"""
+
+    cv2 = opencv()
+
+    # в серый переводим только если кадр пришел цветным, а не на каждом уровне
+    gray_img = image if image.ndim == 2 else cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+
+    detections = []
+    for obj in _zbar_decode()(gray_img):
+        if obj.type != 'QRCODE':
+            continue
+        detections.append(Detection(
+            obj.data.decode("utf-8", errors="replace"),
+            tuple(obj.rect),
+            tuple((point.x, point.y) for point in obj.polygon),
+        ))
+    return detections
+
+
+def decode_roi(image: np.ndarray, rect: tuple[int, int, int, int], pad: float) -> list[Detection]:
+    """функция для поиска qr-кодов в окрестности прямоугольника rect с запасом pad от его размера"""
+
+    x, y, w, h = rect
+    height, width = image.shape[:2]
+    dx, dy = int(w * pad), int(h * pad)
+    left, top = max(0, x - dx), max(0, y - dy)
+    right, bottom = min(width, x + w + dx), min(height, y + h + dy)
+    if right <= left or bottom <= top:
+        return []
+
+    # координаты кодов переводим обратно в координаты всего кадра
+    return [
+        Detection(
+            obj.data,
+            (obj.rect[0] + left, obj.rect[1] + top, obj.rect[2], obj.rect[3]),
+            tuple((px + left, py + top) for px, py in obj.polygon),
+        )
+        for obj in decode_frame(image[top:bottom, left:right])
+    ]
+
+
+def decode_pyramid(gray: np.ndarray, scales: tuple[float, ...], pad: float,
+                   levels: list[tuple[str, bool, float]]) -> list[Detection]:
+    """
+    функция для декодирования от грубого к точному: уменьшенные уровни по возрастанию scales,
+    затем полное разрешение только в областях, найденных QRCodeDetector на грубом уровне,
+    и, если 1 есть в scales, весь кадр в полном разрешении.
+    в levels добавляется (уровень, успех, время) каждой попытки
+    """
+
+    cv2 = opencv()
+
+    coarse, coarse_scale = None, 1.0
+    for scale in sorted(scales):
+        if scale >= 1:
+            break
+        started = time.perf_counter()
+        coarse = cv2.resize(gray, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+        coarse_scale = scale
+        detections = [_scale_detection(obj, 1 / scale) for obj in decode_frame(coarse)]
+        levels.append((f"x{scale:g}", bool(detections), time.perf_counter() - started))
+        if detections:
+            return detections
+
+    if coarse is not None:
+        # дешевый поиск шаблонов qr на грубом уровне, pyzbar - только по найденным областям
+        started = time.perf_counter()
+        candidates = _find_candidates(coarse, 1 / coarse_scale)
+        detections = []
+        for rect in candidates:
+            detections.extend(decode_roi(gray, rect, pad))
+        levels.append(("finder", bool(detections), time.perf_counter() - started))
+        if detections:
+            return detections
+
+    if max(scales) >= 1:
+        started = time.perf_counter()
+        detections = decode_frame(gray)
+        levels.append(("full", bool(detections), time.perf_counter() - started))
+        return detections
+    return []
+
+
+def decode_job(source: str, frame_id: int, image: np.ndarray, roi: tuple[int, int, int, int] | None = None,
+               pad: float = 0.5, scales: tuple[float, ...] = (1.0,)
+               ) -> tuple[str, int, list[Detection], float, list[tuple[str, bool, float]]]:
+    """
+    задача для процесса-декодера: сначала область последнего найденного кода,
+    при промахе пирамида уровней; возвращает коды, общее время и статистику по уровням
+    """
+
+    cv2 = opencv()
+
+    started = time.perf_counter()
+    levels = []
+    gray = image if image.ndim == 2 else cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+
+    detections = []
+    if roi:
+        detections = decode_roi(gray, roi, pad)
+        levels.append(("roi", bool(detections), time.perf_counter() - started))
+    if not detections:
+        detections = decode_pyramid(gray, scales, pad, levels)
+    return source, frame_id, detections, time.perf_counter() - started, levels
+
+
+def decode_file_job(path: str, scales: tuple[float, ...] = (1.0,)
+                    ) -> tuple[str, int, list[Detection], float, list[tuple[str, bool, float]]]:
+    """задача для офлайн-сканирования: изображение читается в процессе-декодере, а не передается ему"""
+
+    cv2 = opencv()
+
+    # IMREAD_GRAYSCALE сразу дает серый кадр без отдельного преобразования
+    image = cv2.imread(path, cv2.IMREAD_GRAYSCALE)
+    if image is None:
+        return path, 0, [], 0.0, []
+    return decode_job(path, 0, image, scales=scales)
+
+
+def warmup() -> None:
+    """функция для загрузки cv2 и pyzbar в процессе-декодере до первого кадра"""
+
+    opencv()
+    _zbar_decode()
+
+
+_detector = None
+
+
+def _find_candidates(gray: np.ndarray, factor: float) -> list[tuple[int, int, int, int]]:
+    global _detector
+    if _detector is None:
+        # свой детектор в каждом процессе-декодере
+        _detector = opencv().QRCodeDetector()
+
+    found, points = _detector.detectMulti(gray)
+    if not found or points is None:
+        return []
+    rects = []
+    for quad in points:
+        xs, ys = quad[:, 0] * factor, quad[:, 1] * factor
+        rects.append((int(xs.min()), int(ys.min()), int(xs.max() - xs.min()) + 1, int(ys.max() - ys.min()) + 1))
+    return rects
+
+
+def _scale_detection(obj: Detection, factor: float) -> Detection:
+    x, y, w, h = obj.rect
+    return Detection(
+        obj.data,
+        (int(x * factor), int(y * factor), int(w * factor), int(h * factor)),
+        tuple((int(px * factor), int(py * factor)) for px, py in obj.polygon),
+    )
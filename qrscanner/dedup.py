@@ -0,0 +1,83 @@
+import time
+from collections import OrderedDict
+from typing import Any, Callable
+
+from statuses.product_id import hash_from_barcode
+
+
+class DedupCache:
+    """
+    ограниченный LRU кеш недавно увиденных qr-кодов с временем жизни записи.
+    побочные эффекты (запись статуса, сохранение изображения) срабатывают
+    один раз за окно ttl, пока код остается в кадре.
+    с status_of код срабатывает снова и внутри окна, если статус товара
+    сменил кто-то другой (например, синхронизация с 1С)
+    """
+
+    def __init__(self, max_size: int = 10000, ttl: float = 10, sliding: bool = True,
+                 status_of: Callable[[str], Any] | None = None):
+        self.max_size = max_size
+        self.ttl = ttl
+        # sliding: каждое повторное появление продлевает окно, код в кадре не срабатывает снова
+        self.sliding = sliding
+        # hash -> текущий статус товара
+        self.status_of = status_of
+        # data -> [hash, конец окна, статусы, при которых повтор не нужен]
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.evicted = 0
+        self.status_changed = 0
+
+    def check(self, data: str, now: float | None = None, target: Any = None) -> tuple[str, bool]:
+        """
+        функция возвращает hash кода и нужно ли выполнять побочные эффекты.
+        target - статус, который запишут побочные эффекты
+        """
+
+        now = time.monotonic() if now is None else now
+        entry = self.entries.get(data)
+        if entry is not None:
+            if entry[1] > now and not self._status_changed(entry):
+                self.hits += 1
+                self.entries.move_to_end(data)
+                if self.sliding:
+                    entry[1] = now + self.ttl
+                return entry[0], False
+            if entry[1] > now:
+                self.status_changed += 1
+            else:
+                self.expired += 1
+            code_hash = entry[0]
+        else:
+            code_hash = hash_from_barcode(data)
+
+        self.misses += 1
+        # статус до срабатывания и тот, что запишем сами, - не изменение
+        known = (self.status_of(code_hash), target) if self.status_of else ()
+        self.entries[data] = [code_hash, now + self.ttl, known]
+        self.entries.move_to_end(data)
+        if len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+            self.evicted += 1
+        return code_hash, True
+
+    def _status_changed(self, entry: list) -> bool:
+        return self.status_of is not None and self.status_of(entry[0]) not in entry[2]
+
+    def forget(self, data: str) -> None:
+        """побочные эффекты не выполнены: следующее появление кода сработает снова"""
+        self.entries.pop(data, None)
+
+    def stats(self) -> dict[str, float]:
+        total = self.hits + self.misses
+        return {
+            "dedup_hits": self.hits,
+            "dedup_misses": self.misses,
+            "dedup_hit_ratio": round(self.hits / total, 3) if total else 0.0,
+            "dedup_expired": self.expired,
+            "dedup_evicted": self.evicted,
+            "dedup_status_changed": self.status_changed,
+            "dedup_size": len(self.entries),
+        }
@@ -0,0 +1,157 @@
+import contextlib
+import os
+import queue
+import threading
+import time
+
+import numpy as np
+
+from qrscanner.decoding import Detection, opencv
+
+
+class ImageSink:
+    """
+    фоновое сохранение изображений qr-кодов: ограниченная очередь и несколько
+    потоков, кодирование jpeg и запись через временный файл с переименованием.
+    свежий image_{hash}.jpg повторно не кодируется и не пишется
+    """
+
+    def __init__(self, images_path: str, workers: int = 2, max_queue: int = 32, quality: int = 85,
+                 max_width: int = 0, crop_to_code: bool = False, crop_pad: float = 0.5, fresh_seconds: float = 60):
+        self.images_path = images_path
+        self.quality = quality
+        self.max_width = max_width
+        self.crop_to_code = crop_to_code
+        self.crop_pad = crop_pad
+        self.fresh_seconds = fresh_seconds
+
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.lock = threading.Lock()
+        self.counters = {"written": 0, "skipped_fresh": 0, "dropped": 0, "errors": 0, "max_depth": 0}
+        self.timings = {"encode": [0, 0.0], "write": [0, 0.0], "wait": [0, 0.0]}
+
+        self.threads = [
+            threading.Thread(target=self._run, name=f"image-sink-{i}", daemon=True) for i in range(workers)
+        ]
+        for thread in self.threads:
+            thread.start()
+
+    def submit(self, frame: np.ndarray, codes: list[tuple[str, Detection]], detections: list[Detection]) -> bool:
+        """кладет кадр в очередь; False, если диск не успевает и кадр выброшен"""
+
+        try:
+            self.queue.put_nowait((time.perf_counter(), frame, codes, detections))
+        except queue.Full:
+            with self.lock:
+                self.counters["dropped"] += 1
+            return False
+        with self.lock:
+            self.counters["max_depth"] = max(self.counters["max_depth"], self.queue.qsize())
+        return True
+
+    def close(self, timeout: float = 5) -> None:
+        """дописывает очередь и останавливает потоки"""
+
+        for _ in self.threads:
+            self.queue.put(None)
+        for thread in self.threads:
+            thread.join(timeout=timeout)
+
+    def stats(self) -> dict[str, float]:
+        with self.lock:
+            res = {f"image_{name}": value for name, value in self.counters.items()}
+            for name, (count, total) in self.timings.items():
+                res[f"image_{name}_ms"] = round(total / count * 1000, 1) if count else 0.0
+            self.counters["max_depth"] = 0
+        res["image_queue_depth"] = self.queue.qsize()
+        return res
+
+    def _run(self) -> None:
+        cv2 = opencv()
+
+        while True:
+            item = self.queue.get()
+            if item is None:
+                return
+            queued, frame, codes, detections = item
+            self._time("wait", time.perf_counter() - queued)
+            annotated = None
+
+            for code_hash, obj in codes:
+                file_path = os.path.join(self.images_path, f"image_{code_hash}.jpg")
+                if self._is_fresh(file_path):
+                    with self.lock:
+                        self.counters["skipped_fresh"] += 1
+                    continue
+                try:
+                    started = time.perf_counter()
+                    if annotated is None:
+                        annotated = annotate(frame, detections)
+                    ok, data = cv2.imencode(".jpg", self._prepare(annotated, obj),
+                                            [cv2.IMWRITE_JPEG_QUALITY, self.quality])
+                    if not ok:
+                        raise RuntimeError("jpeg encoding failed")
+                    encoded = time.perf_counter()
+                    self._time("encode", encoded - started)
+
+                    # читатель никогда не увидит наполовину записанный файл
+                    tmp_path = f"{file_path}.{threading.get_ident()}.tmp"
+                    try:
+                        with open(tmp_path, "wb") as f:
+                            f.write(data.tobytes())
+                        os.replace(tmp_path, file_path)
+                    except OSError:
+                        # недописанный временный файл не остается в каталоге
+                        with contextlib.suppress(OSError):
+                            os.remove(tmp_path)
+                        raise
+                    self._time("write", time.perf_counter() - encoded)
+                    with self.lock:
+                        self.counters["written"] += 1
+                except Exception as e:
+                    print(f"Image write failed for {file_path}: {e!r}")
+                    with self.lock:
+                        self.counters["errors"] += 1
+
+    def _is_fresh(self, file_path: str) -> bool:
+        if not self.fresh_seconds:
+            return False
+        try:
+            return time.time() - os.stat(file_path).st_mtime < self.fresh_seconds
+        except FileNotFoundError:
+            return False
+
+    def _prepare(self, image: np.ndarray, obj: Detection) -> np.ndarray:
+        cv2 = opencv()
+
+        if self.crop_to_code:
+            x, y, w, h = obj.rect
+            dx, dy = int(w * self.crop_pad), int(h * self.crop_pad)
+            height, width = image.shape[:2]
+            crop = image[max(0, y - dy):min(height, y + h + dy), max(0, x - dx):min(width, x + w + dx)]
+            if crop.size:
+                image = crop
+        if self.max_width and image.shape[1] > self.max_width:
+            scale = self.max_width / image.shape[1]
+            image = cv2.resize(image, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+        return image
+
+    def _time(self, name: str, seconds: float) -> None:
+        with self.lock:
+            item = self.timings[name]
+            item[0] += 1
+            item[1] += seconds
+
+
+def annotate(frame: np.ndarray, detections: list[Detection]) -> np.ndarray:
+    """функция для отрисовки контуров и данных qr-кодов"""
+
+    cv2 = opencv()
+
+    image = frame.copy()
+    for obj in detections:
+        pts = np.array(obj.polygon, np.int32).reshape((-1, 1, 2))
+        cv2.polylines(image, [pts], True, (0, 255, 0), 3)
+        (x, y, w, h) = obj.rect
+        cv2.putText(image, f"Data {obj.data} | Type QRCODE", (x, y), cv2.FONT_ITALIC, 0.8, (255, 0, 0), 2)
+    return image
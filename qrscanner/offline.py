@@ -0,0 +1,98 @@
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+from db.db import create, execute_many
+from qrscanner.decoding import decode_file_job, decode_job, opencv
+from statuses.product_id import hash_from_barcode
+from statuses.types_of_statuses import Statuses
+
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".bmp", ".tif", ".tiff", ".webp"}
+
+
+def scan_offline(path: str, workers: int, scales: tuple[float, ...] = (1.0,), step: int = 1,
+                 update_db: bool = True) -> dict[str, float]:
+    """
+    функция для сканирования видеофайла или каталога изображений на всех ядрах;
+    статусы найденных кодов записываются одной транзакцией в конце
+    """
+
+    started = time.perf_counter()
+    codes = {}
+    frames = 0
+    decode_seconds = 0.0
+
+    with ProcessPoolExecutor(workers) as pool:
+        if os.path.isdir(path):
+            files = sorted(
+                os.path.join(path, name) for name in os.listdir(path)
+                if os.path.splitext(name)[1].lower() in IMAGE_EXTENSIONS
+            )
+            jobs = ((decode_file_job, file_path, scales) for file_path in files[::step])
+        else:
+            jobs = ((decode_job, path, frame_id, frame, None, 0.5, scales)
+                    for frame_id, frame in _video_frames(path, step))
+
+        # ограничиваем число кадров в работе, чтобы видео не читалось в память целиком
+        pending = set()
+        for job in jobs:
+            pending.add(pool.submit(*job))
+            if len(pending) >= workers * 2:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                frames, decode_seconds = _collect(done, codes, frames, decode_seconds)
+        done, _ = wait(pending)
+        frames, decode_seconds = _collect(done, codes, frames, decode_seconds)
+
+    scanned = time.perf_counter()
+    if update_db and codes:
+        create()
+        status = Statuses.exists_production.value
+        execute_many("""UPDATE products SET status = ? WHERE id = ?;""",
+                     [(status, hash_from_barcode(data)) for data in codes])
+    finished = time.perf_counter()
+
+    elapsed = scanned - started
+    detections = sum(codes.values())
+    return {
+        "frames": frames,
+        "seconds": round(elapsed, 3),
+        "frames_per_sec": round(frames / elapsed, 1) if elapsed else 0.0,
+        "detections": detections,
+        "codes_per_sec": round(detections / elapsed, 1) if elapsed else 0.0,
+        "unique_codes": len(codes),
+        "decode_ms_per_frame": round(decode_seconds / frames * 1000, 2) if frames else 0.0,
+        "db_seconds": round(finished - scanned, 3),
+    }
+
+
+def _video_frames(path: str, step: int):
+    cv2 = opencv()
+
+    cap = cv2.VideoCapture(path)
+    if not cap.isOpened():
+        raise RuntimeError(f"Cannot open video {path}")
+    frame_id = 0
+    try:
+        while True:
+            # пропускаемые кадры только извлекаются из потока, без преобразования в BGR
+            if frame_id % step:
+                if not cap.grab():
+                    return
+            else:
+                ret, frame = cap.read()
+                if not ret:
+                    return
+                yield frame_id, frame
+            frame_id += 1
+    finally:
+        cap.release()
+
+
+def _collect(done, codes: dict[str, int], frames: int, decode_seconds: float) -> tuple[int, float]:
+    for future in done:
+        _source, _frame_id, detections, seconds, _levels = future.result()
+        frames += 1
+        decode_seconds += seconds
+        for obj in detections:
+            codes[obj.data] = codes.get(obj.data, 0) + 1
+    return frames, decode_seconds
@@ -0,0 +1,434 @@
+import logging
+import os
+import queue
+import sys
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+import numpy as np
+
+from db.db import close_db
+from qrscanner.decoding import Detection, decode_job, opencv, warmup
+from qrscanner.dedup import DedupCache
+from qrscanner.image_sink import ImageSink, annotate
+from statuses.status_cache import status_cache
+from statuses.types_of_statuses import Statuses
+
+log = logging.getLogger(__name__)
+
+# модули cameras (frametap) импортируют соседей по имени, как при запуске из каталога cameras
+_CAMERAS_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "cameras")
+if _CAMERAS_PATH not in sys.path:
+    sys.path.append(_CAMERAS_PATH)
+
+
+class LatestFrame:
+    """слот на один кадр: новый кадр вытесняет еще не взятый в обработку"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.item = None
+        self.dropped = 0
+
+    def put(self, item) -> bool:
+        """кладет кадр; True, если слот был пуст"""
+        with self.lock:
+            empty = self.item is None
+            if not empty:
+                self.dropped += 1
+            self.item = item
+            return empty
+
+    def take(self):
+        with self.lock:
+            item, self.item = self.item, None
+            return item
+
+
+class MotionGate:
+    """
+    дешевая проверка движения перед декодированием: доля пикселей уменьшенного
+    кадра, изменившихся относительно последнего пропущенного дальше кадра
+    """
+
+    def __init__(self, threshold: float, step: int, max_interval: float):
+        self.threshold = threshold
+        self.step = step
+        self.max_interval = max_interval
+        self.reference = None
+        self.passed_at = 0.0
+
+    def changed(self, frame: np.ndarray, now: float) -> bool:
+        if not self.threshold:
+            return True
+        small = frame[::self.step, ::self.step]
+        if small.ndim == 3:
+            # зеленый канал достаточно близок к яркости
+            small = small[..., 1]
+        small = small.astype(np.int16)
+
+        reference = self.reference
+        if (reference is None or reference.shape != small.shape or now - self.passed_at >= self.max_interval
+                or (np.abs(small - reference) > 25).mean() >= self.threshold):
+            # сравниваем с последним пропущенным кадром, чтобы медленное движение накапливалось
+            self.reference = small
+            self.passed_at = now
+            return True
+        return False
+
+
+class StageStats:
+    """задержки по стадиям конвейера: количество, среднее и максимум за интервал"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.stages = {}
+        self.counters = {}
+
+    def add(self, stage: str, seconds: float) -> None:
+        with self.lock:
+            item = self.stages.setdefault(stage, [0, 0.0, 0.0])
+            item[0] += 1
+            item[1] += seconds
+            item[2] = max(item[2], seconds)
+
+    def inc(self, counter: str, value: int = 1) -> None:
+        with self.lock:
+            self.counters[counter] = self.counters.get(counter, 0) + value
+
+    def report(self) -> str:
+        with self.lock:
+            stages, self.stages = self.stages, {}
+            counters, self.counters = self.counters, {}
+        lines = []
+        for stage, (count, total, longest) in sorted(stages.items()):
+            lines.append(f"{stage:<24} n={count:<6} avg={total / count * 1000:8.1f} ms  max={longest * 1000:8.1f} ms")
+        if counters:
+            lines.append(", ".join(f"{name}={value}" for name, value in sorted(counters.items())))
+        return "\n".join(lines)
+
+
+class Source(threading.Thread):
+    """поток захвата одного источника: номер камеры, rtsp url или tap:<hash> прокси"""
+
+    def __init__(self, name: str, stats: StageStats, events: queue.Queue, stopped: threading.Event,
+                 gate: MotionGate):
+        super().__init__(name=f"capture-{name}", daemon=True)
+        self.source = name
+        self.stats = stats
+        self.events = events
+        self.stopped = stopped
+        self.gate = gate
+        self.slot = LatestFrame()
+        self.frames = 0
+
+    def run(self) -> None:
+        while not self.stopped.is_set():
+            read, close = self._open()
+            try:
+                while not self.stopped.is_set():
+                    started = time.perf_counter()
+                    frame = read()
+                    if frame is None:
+                        break
+                    now = time.perf_counter()
+                    self.stats.add(f"{self.source} capture", now - started)
+                    if not self.gate.changed(frame, now):
+                        self.stats.inc(f"{self.source} still")
+                        continue
+                    self.frames += 1
+                    if self.slot.put((self.frames, now, frame)):
+                        self.events.put(("frame", self.source))
+            finally:
+                close()
+
+            log.warning("Source %s lost, reconnecting", self.source)
+            self.stopped.wait(1)
+
+    def _open(self):
+        if self.source.startswith("tap:"):
+            # кадры из прокси камер без отдельного подключения к камере;
+            # импорт здесь: config камер не нужен сканеру без tap-источников
+            from frametap import FrameReader
+
+            reader = FrameReader(self.source[4:])
+
+            def read_tap():
+                while not self.stopped.is_set():
+                    frame = reader.read(timeout=1)
+                    if frame:
+                        return frame[1]
+                return None
+
+            return read_tap, reader.close
+
+        cv2 = opencv()
+
+        cap = cv2.VideoCapture(int(self.source) if self.source.isdigit() else self.source)
+        # не копить кадры в буфере драйвера, нужен только последний
+        cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+
+        def read_capture():
+            ret, frame = cap.read()
+            return frame if ret else None
+
+        return read_capture, cap.release
+
+
+class Pipeline:
+    """
+    конвейер сканирования: поток захвата на источник, пул процессов-декодеров,
+    отдельные потоки записи статусов в базу и сохранения изображений
+    """
+
+    def __init__(self, sources: list[str], workers: int, images: ImageSink | None, show: bool = False,
+                 report_interval: float = 10, motion_threshold: float = 0.002, motion_step: int = 8,
+                 motion_interval: float = 2, roi_ttl: float = 1, roi_pad: float = 0.5,
+                 scales: dict[str, tuple[float, ...]] | None = None, dedup: DedupCache | None = None,
+                 started: float | None = None, cold_start_target: float = 3):
+        self.stats = StageStats()
+        self.events = queue.Queue()
+        self.stopped = threading.Event()
+        self.sources = {
+            name: Source(name, self.stats, self.events, self.stopped,
+                         MotionGate(motion_threshold, motion_step, motion_interval))
+            for name in sources
+        }
+        self.workers = workers
+        self.images = images
+        self.show = show
+        self.report_interval = report_interval
+
+        # кадров одного источника в работе одновременно: остальные воркеры достаются другим камерам
+        self.inflight_limit = max(1, workers // len(sources))
+        self.inflight = {name: {} for name in sources}
+
+        self.db_queue = queue.Queue(maxsize=1000)
+        self.latest = {}
+
+        # последний найденный код по источникам: (прямоугольник, время)
+        self.roi_ttl = roi_ttl
+        self.roi_pad = roi_pad
+        self.rois = {}
+
+        # уровни пирамиды декодирования по источникам, по умолчанию только полное разрешение
+        self.scales = {name: (scales or {}).get(name, (1.0,)) for name in sources}
+
+        # повторные срабатывания одного кода не доходят до базы и диска
+        self.dedup = dedup or DedupCache()
+
+        # холодный старт: от запуска процесса (main) до первого декодированного кадра
+        self.started = time.perf_counter() if started is None else started
+        self.cold_start_target = cold_start_target
+        self.cold_start = None
+
+    @staticmethod
+    def from_env(started: float | None = None) -> "Pipeline":
+        sources = [s.strip() for s in os.getenv("QR_SOURCES", "0").split(",") if s.strip()]
+        workers = int(os.getenv("QR_WORKERS", 0)) or max(1, (os.cpu_count() or 2) - 1)
+        images_path = os.getenv("IMAGES_PATH")
+        images = ImageSink(
+            images_path,
+            workers=int(os.getenv("QR_IMAGE_WORKERS", 2)),
+            quality=int(os.getenv("QR_JPEG_QUALITY", 85)),
+            max_width=int(os.getenv("QR_IMAGE_MAX_WIDTH", 0)),
+            crop_to_code=os.getenv("QR_IMAGE_CROP", "0") == "1",
+            fresh_seconds=float(os.getenv("QR_IMAGE_FRESH", 60)),
+        ) if images_path else None
+        return Pipeline(
+            sources, workers, images, os.getenv("QR_SHOW", "1") == "1",
+            motion_threshold=float(os.getenv("QR_MOTION_THRESHOLD", 0.002)),
+            motion_interval=float(os.getenv("QR_MOTION_INTERVAL", 2)),
+            roi_ttl=float(os.getenv("QR_ROI_TTL", 1)),
+            scales={name: parse_scales(os.getenv(f"QR_SCALES_{_env_name(name)}", os.getenv("QR_SCALES", "1")))
+                    for name in sources},
+            dedup=DedupCache(
+                max_size=int(os.getenv("QR_DEDUP_SIZE", 10000)),
+                ttl=float(os.getenv("QR_DEDUP_TTL", 10)),
+                sliding=os.getenv("QR_DEDUP_SLIDING", "1") == "1",
+                status_of=status_cache.get if os.getenv("QR_DEDUP_RESAVE_ON_STATUS_CHANGE", "1") == "1" else None,
+            ),
+            started=started,
+            cold_start_target=float(os.getenv("QR_COLD_START_TARGET", 3)),
+        )
+
+    def run(self) -> None:
+        pool = ProcessPoolExecutor(self.workers)
+        # процессы-декодеры загружают cv2 и pyzbar, пока источники открываются
+        for _ in range(self.workers):
+            pool.submit(warmup)
+        threads = [threading.Thread(target=self._db_stage, name="db-stage", daemon=True)]
+        started = time.perf_counter()
+        print(f"Status cache warmed: {status_cache.warm()} products in {(time.perf_counter() - started) * 1000:.0f} ms")
+        for thread in list(self.sources.values()) + threads:
+            thread.start()
+
+        next_report = time.monotonic() + self.report_interval
+        try:
+            while True:
+                self._dispatch(pool)
+                try:
+                    event = self.events.get(timeout=0.01 if self.show else 0.5)
+                except queue.Empty:
+                    event = None
+                if event and event[0] == "result":
+                    self._handle_result(*event[1:])
+
+                if self.show and self._show_frames():
+                    break
+                if time.monotonic() >= next_report:
+                    next_report = time.monotonic() + self.report_interval
+                    self._report()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.stopped.set()
+            pool.shutdown(wait=False, cancel_futures=True)
+            # дописываем то, что уже распознано
+            self.db_queue.put(None)
+            for thread in threads:
+                thread.join(timeout=5)
+            close_db()
+            if self.images:
+                self.images.close()
+            if self.show:
+                cv2 = opencv()
+
+                cv2.destroyAllWindows()
+            self._report()
+
+    def _dispatch(self, pool: ProcessPoolExecutor) -> None:
+        for name, source in self.sources.items():
+            inflight = self.inflight[name]
+            while len(inflight) < self.inflight_limit:
+                item = source.slot.take()
+                if item is None:
+                    break
+                frame_id, captured, frame = item
+                submitted = time.perf_counter()
+                self.stats.add(f"{name} queue", submitted - captured)
+                inflight[frame_id] = (captured, submitted, frame)
+                roi = self.rois.get(name)
+                rect = roi[0] if roi and submitted - roi[1] < self.roi_ttl else None
+                future = pool.submit(decode_job, name, frame_id, frame, rect, self.roi_pad, self.scales[name])
+                future.add_done_callback(partial(self._post_result, name, frame_id))
+
+    def _post_result(self, name: str, frame_id: int, future) -> None:
+        self.events.put(("result", name, frame_id, future))
+
+    def _handle_result(self, name: str, frame_id: int, future) -> None:
+        # слот источника освобождается при любом исходе, иначе ошибка декодера останавливает камеру
+        captured, submitted, frame = self.inflight[name].pop(frame_id)
+        if future.cancelled():
+            return
+        try:
+            _name, _frame_id, detections, decode_seconds, levels = future.result()
+        except Exception:
+            log.exception("Decode failed: source %s, frame %s", name, frame_id)
+            return
+
+        now = time.perf_counter()
+        self.stats.add(f"{name} decode", decode_seconds)
+        if self.cold_start is None:
+            self.cold_start = now - self.started
+            verdict = "ok" if self.cold_start <= self.cold_start_target else "above target"
+            print(f"Cold start to first decoded frame: {self.cold_start * 1000:.0f} ms "
+                  f"({verdict}, target {self.cold_start_target * 1000:.0f} ms)")
+        # передача кадра в процесс и результата обратно
+        self.stats.add(f"{name} transfer", now - submitted - decode_seconds)
+        self.latest[name] = (frame, detections)
+        for level, hit, seconds in levels:
+            self.stats.add(f"{name} level {level}", seconds)
+            self.stats.inc(f"{name} {level} {'hit' if hit else 'miss'}")
+
+        if not detections:
+            return
+        self.rois[name] = (_bounding_rect(detections), now)
+
+        status = Statuses.exists_production
+        fresh = []
+        for obj in detections:
+            code_hash, fire = self.dedup.check(obj.data, target=status)
+            if fire:
+                print(f"Barcode: {obj.data} | Source: {name}")
+                fresh.append((code_hash, obj))
+        if not fresh:
+            return
+        try:
+            self.db_queue.put_nowait((captured, [(status, code_hash) for code_hash, _obj in fresh]))
+        except queue.Full:
+            log.warning("Stage db is overloaded, result dropped")
+            # иначе код, пока он в кадре, так и не попадет в базу
+            for _code_hash, obj in fresh:
+                self.dedup.forget(obj.data)
+            return
+        if self.images:
+            self.images.submit(frame, fresh, detections)
+
+    def _db_stage(self) -> None:
+        while True:
+            item = self.db_queue.get()
+            if item is None:
+                return
+            captured, updates = item
+            started = time.perf_counter()
+            for status, code_hash in updates:
+                # товар уже в этом статусе - в базу не идем
+                if status_cache.get(code_hash) is status:
+                    self.stats.inc("db unchanged")
+                    continue
+                # запись отложенная: повторы одного товара схлопываются, коммит - раз в пачку
+                status_cache.update_status(code_hash, status)
+            now = time.perf_counter()
+            self.stats.add("db", now - started)
+            self.stats.add("total", now - captured)
+
+    def _show_frames(self) -> bool:
+        """окна с последними обработанными кадрами; True - нажата q"""
+        cv2 = opencv()
+
+        for name, (frame, detections) in list(self.latest.items()):
+            cv2.imshow(f"Image {name}", annotate(frame, detections) if detections else frame)
+        self.latest = {}
+        return cv2.waitKey(1) == ord('q')
+
+    def _report(self) -> None:
+        dropped = ", ".join(f"{name}: {source.slot.dropped}" for name, source in self.sources.items())
+        print(f"--- stage latency, stale frames dropped ({dropped})")
+        report = self.stats.report()
+        if report:
+            print(report)
+        counters = self.dedup.stats()
+        counters.update(status_cache.stats())
+        if self.images:
+            counters.update(self.images.stats())
+        print(", ".join(f"{name}={value}" for name, value in counters.items()))
+
+
+def _bounding_rect(detections: list[Detection]) -> tuple[int, int, int, int]:
+    """общий прямоугольник всех найденных на кадре кодов"""
+
+    left = min(obj.rect[0] for obj in detections)
+    top = min(obj.rect[1] for obj in detections)
+    right = max(obj.rect[0] + obj.rect[2] for obj in detections)
+    bottom = max(obj.rect[1] + obj.rect[3] for obj in detections)
+    return left, top, right - left, bottom - top
+
+
+def parse_scales(value: str) -> tuple[float, ...]:
+    """"0.25,0.5,1" -> (0.25, 0.5, 1.0); пустое значение - только полное разрешение"""
+
+    scales = tuple(sorted({float(scale) for scale in value.split(",") if scale.strip()}))
+    if not scales:
+        return (1.0,)
+    if scales[0] <= 0:
+        raise ValueError(f"QR scales must be positive: {value!r}")
+    return scales
+
+
+def _env_name(source: str) -> str:
+    """имя источника для переменной окружения: tap:abc -> TAP_ABC"""
+
+    return "".join(c if c.isalnum() else "_" for c in source).upper()
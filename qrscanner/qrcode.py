@@ -1,74 +1,34 @@
-import hashlib
+import logging
+import os
+import time
 
-import cv2
-import numpy as np
 from dotenv import load_dotenv
-from pyzbar.pyzbar import decode
 
-from statuses.get_info_from_1c import *
-from statuses.types_of_statuses import *
+from db.db import create
+from qrscanner.pipeline import Pipeline
+from statuses.get_info_from_1c import start_sync
 
-load_dotenv(os.path.join(os.path.dirname(os.path.abspath(os.path.dirname(__file__))), "env.env"))
+ENV_PATH = os.path.join(os.path.dirname(os.path.abspath(os.path.dirname(__file__))), "env.env")
 
-# путь для сохранения изображений
-images_path = os.getenv("IMAGES_PATH")
 
-get_qr_info_and_insert(os.getenv("1C_URL"))
+def main(show: bool | None = None) -> None:
+    """точка входа сканера: окружение, фоновая синхронизация с 1С и конвейер"""
 
-def hash_from_barcode(barcode_data: str) -> str:
-    """функция для преобразования данных из qr-кода в hash"""
+    started = time.perf_counter()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s %(message)s")
+    load_dotenv(ENV_PATH)
+    if show is not None:
+        os.environ["QR_SHOW"] = "1" if show else "0"
+    # схема базы: недостающие таблицы, индексы и история статусов
+    create()
 
-    barcode_bytes = barcode_data.encode('utf-8')
-    return hashlib.md5(barcode_bytes).hexdigest()
+    # сканирование не ждет ответа 1С
+    if os.getenv("1C_URL"):
+        start_sync(os.getenv("1C_URL"), float(os.getenv("1C_SYNC_INTERVAL", 0)))
 
+    # источники задаются в QR_SOURCES через запятую: номер веб-камеры, rtsp url или tap:<hash камеры прокси>
+    Pipeline.from_env(started).run()
 
-def process_and_save_barcode_image(image):
-    """функция для обработки сохранения qr-кодов"""
 
-    # преобразование изображения в оттенки серого
-    gray_img = cv2.cvtColor(image, 0)
-
-    qr_code_objects = [obj for obj in decode(gray_img) if obj.type == 'QRCODE']
-
-    # для каждого распознанного qr-кода
-    for obj in qr_code_objects:
-        # извлечение координат и создание контура вокруг qr-кода
-        points = obj.polygon
-        (x, y, w, h) = obj.rect
-        pts = np.array(points, np.int32)
-        pts = pts.reshape((-1, 1, 2))
-        cv2.polylines(image, [pts], True, (0, 255, 0), 3)
-
-        # извлечение данных и типа qr-кода
-        barcode_data = obj.data.decode("utf-8")
-        barcode_type = obj.type
-        string = "Data " + str(barcode_data) + " | Type " + str(barcode_type)
-
-        # отображение данных и типа qr-кода
-        cv2.putText(frame, string, (x, y), cv2.FONT_ITALIC, 0.8, (255, 0, 0), 2)
-        print("Barcode: " + barcode_data + " | Type: " + barcode_type)
-
-        # генерация имени файла
-        hash = hash_from_barcode(barcode_data)
-
-        file_path = os.path.join(images_path, f"image_{hash}.jpg")
-        sql = """UPDATE products SET status = ? WHERE id = ?;"""
-        execute(sql, (Statuses.exists_production, hash))
-
-        # сохранение изображения
-        cv2.imwrite(file_path, image)
-
-
-# захват видео с камеры
-# в этом случае захват происходит в веб-камеры
-cap = cv2.VideoCapture(0)
-while True:
-    ret, frame = cap.read()
-    process_and_save_barcode_image(frame)
-    cv2.imshow('Image', frame)
-    code = cv2.waitKey(10)
-    if code == ord('q'):
-        break
-
-cv2.destroyAllWindows()
-cap.release()
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,39 @@
+import sys
+import types
+
+import pytest
+
+np = pytest.importorskip("numpy")
+
+from qrscanner import decoding  # noqa: E402
+from qrscanner.decoding import Detection  # noqa: E402
+
+
+def test_opencv_imported_once(monkeypatch):
+    fake = types.ModuleType("cv2")
+    monkeypatch.setattr(decoding, "_cv2", None)
+    monkeypatch.setitem(sys.modules, "cv2", fake)
+    assert decoding.opencv() is fake
+    # повторные обращения не идут в механизм импорта
+    monkeypatch.delitem(sys.modules, "cv2")
+    assert decoding.opencv() is fake
+
+
+def test_decode_roi_returns_frame_coordinates(monkeypatch):
+    crops = []
+
+    def decode_frame(image):
+        crops.append(image.shape)
+        return [Detection("code", (1, 2, 3, 4), ((1, 2), (4, 6)))]
+
+    monkeypatch.setattr(decoding, "decode_frame", decode_frame)
+    image = np.zeros((100, 200), np.uint8)
+    detections = decoding.decode_roi(image, (50, 40, 20, 10), pad=0.5)
+    # область с запасом pad, обрезанная по краям кадра
+    assert crops == [(20, 40)]
+    assert detections == [Detection("code", (41, 37, 3, 4), ((41, 37), (44, 41)))]
+
+
+def test_decode_roi_outside_frame():
+    image = np.zeros((100, 200), np.uint8)
+    assert decoding.decode_roi(image, (300, 300, 10, 10), pad=0.5) == []
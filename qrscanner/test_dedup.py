@@ -0,0 +1,60 @@
+from qrscanner.dedup import DedupCache
+from statuses.product_id import hash_from_barcode
+
+
+def test_fires_once_per_window():
+    cache = DedupCache(ttl=10)
+    assert cache.check("code", now=0) == (hash_from_barcode("code"), True)
+    assert cache.check("code", now=5)[1] is False
+    # sliding: код в кадре продлевает окно
+    assert cache.check("code", now=14)[1] is False
+    assert cache.check("code", now=25)[1] is True
+    assert cache.stats()["dedup_expired"] == 1
+
+
+def test_fixed_window():
+    cache = DedupCache(ttl=10, sliding=False)
+    cache.check("code", now=0)
+    assert cache.check("code", now=9)[1] is False
+    assert cache.check("code", now=10)[1] is True
+
+
+def test_forget_fires_again():
+    cache = DedupCache()
+    cache.check("code", now=0)
+    cache.forget("code")
+    assert cache.check("code", now=1)[1] is True
+
+
+def test_evicts_least_recently_seen():
+    cache = DedupCache(max_size=2)
+    cache.check("a", now=0)
+    cache.check("b", now=0)
+    cache.check("a", now=1)
+    cache.check("c", now=1)
+    assert list(cache.entries) == ["a", "c"]
+    assert cache.stats()["dedup_evicted"] == 1
+
+
+def test_fires_again_when_status_changed_elsewhere():
+    statuses = {}
+    cache = DedupCache(ttl=10, status_of=statuses.get)
+    code_hash = hash_from_barcode("code")
+    assert cache.check("code", now=0, target="production")[1] is True
+    # запись статуса самим сканером - не изменение
+    statuses[code_hash] = "production"
+    assert cache.check("code", now=1, target="production")[1] is False
+    # статус сменила синхронизация с 1С: код в кадре срабатывает снова
+    statuses[code_hash] = "shipped"
+    assert cache.check("code", now=2, target="production")[1] is True
+    assert cache.check("code", now=3, target="production")[1] is False
+    assert cache.stats()["dedup_status_changed"] == 1
+    assert cache.stats()["dedup_expired"] == 0
+
+
+def test_status_rule_off_by_default():
+    statuses = {}
+    cache = DedupCache(ttl=10)
+    cache.check("code", now=0, target="production")
+    statuses[hash_from_barcode("code")] = "shipped"
+    assert cache.check("code", now=1, target="production")[1] is False
@@ -0,0 +1,94 @@
+import os
+import types
+
+import pytest
+
+np = pytest.importorskip("numpy")
+
+from qrscanner import decoding, image_sink  # noqa: E402
+from qrscanner.decoding import Detection  # noqa: E402
+from qrscanner.image_sink import ImageSink  # noqa: E402
+
+DETECTION = Detection("code", (1, 1, 4, 4), ((1, 1), (5, 1), (5, 5), (1, 5)))
+
+
+@pytest.fixture
+def cv2(monkeypatch):
+    fake = types.SimpleNamespace(
+        IMWRITE_JPEG_QUALITY=1, FONT_ITALIC=0, INTER_AREA=3,
+        polylines=lambda *args: None, putText=lambda *args: None,
+        imencode=lambda ext, image, params: (True, np.frombuffer(b"jpeg", np.uint8)),
+    )
+    monkeypatch.setattr(decoding, "_cv2", fake)
+    return fake
+
+
+def _write(sink, code_hash="h1"):
+    sink.submit(np.zeros((8, 8, 3), np.uint8), [(code_hash, DETECTION)], [DETECTION])
+
+
+def test_image_written_through_temporary_file(cv2, tmp_path, monkeypatch):
+    replaced = []
+    replace = os.replace
+
+    def record(src, dst):
+        replaced.append((src, dst))
+        replace(src, dst)
+    monkeypatch.setattr(image_sink.os, "replace", record)
+
+    sink = ImageSink(str(tmp_path), workers=1, fresh_seconds=0)
+    _write(sink)
+    sink.close()
+
+    target = str(tmp_path / "image_h1.jpg")
+    assert (tmp_path / "image_h1.jpg").read_bytes() == b"jpeg"
+    [(src, dst)] = replaced
+    assert dst == target and src.startswith(target) and src.endswith(".tmp")
+    assert os.listdir(tmp_path) == ["image_h1.jpg"]
+    assert sink.stats()["image_written"] == 1
+
+
+def test_encode_error_counted_and_writer_keeps_running(cv2, tmp_path):
+    calls = []
+
+    def imencode(ext, image, params):
+        calls.append(ext)
+        # первый кадр не кодируется, следующие - как обычно
+        return (False, None) if len(calls) == 1 else (True, np.frombuffer(b"jpeg", np.uint8))
+    cv2.imencode = imencode
+
+    sink = ImageSink(str(tmp_path), workers=1, fresh_seconds=0)
+    _write(sink, "h1")
+    _write(sink, "h2")
+    sink.close()
+    stats = sink.stats()
+    assert (stats["image_errors"], stats["image_written"]) == (1, 1)
+    assert os.listdir(tmp_path) == ["image_h2.jpg"]
+
+
+def test_failed_rename_leaves_no_temporary_file(cv2, tmp_path, monkeypatch):
+    def fail(src, dst):
+        raise OSError("disk full")
+    monkeypatch.setattr(image_sink.os, "replace", fail)
+
+    sink = ImageSink(str(tmp_path), workers=1, fresh_seconds=0)
+    _write(sink)
+    sink.close()
+    assert sink.stats()["image_errors"] == 1
+    assert os.listdir(tmp_path) == []
+
+
+def test_full_queue_drops_frames(cv2, tmp_path):
+    sink = ImageSink(str(tmp_path), workers=0, max_queue=2)
+    assert [sink.submit(np.zeros((8, 8, 3), np.uint8), [], []) for _ in range(3)] == [True, True, False]
+    stats = sink.stats()
+    assert (stats["image_dropped"], stats["image_queue_depth"], stats["image_max_depth"]) == (1, 2, 2)
+
+
+def test_fresh_image_not_rewritten(cv2, tmp_path):
+    (tmp_path / "image_h1.jpg").write_bytes(b"old")
+    sink = ImageSink(str(tmp_path), workers=1, fresh_seconds=60)
+    _write(sink)
+    sink.close()
+    assert (tmp_path / "image_h1.jpg").read_bytes() == b"old"
+    assert sink.stats()["image_skipped_fresh"] == 1
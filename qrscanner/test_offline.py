@@ -0,0 +1,138 @@
+import sys
+import types
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+np = pytest.importorskip("numpy")
+
+from qrscanner import __main__ as cli, decoding, offline  # noqa: E402
+from qrscanner.decoding import Detection  # noqa: E402
+from statuses.product_id import hash_from_barcode  # noqa: E402
+from statuses.types_of_statuses import Statuses  # noqa: E402
+
+
+def _detection(data):
+    return Detection(data, (0, 0, 1, 1), ((0, 0), (1, 1)))
+
+
+@pytest.fixture(autouse=True)
+def threads(monkeypatch):
+    # задачи-заглушки не передаются в процессы, пул потоков с тем же интерфейсом
+    monkeypatch.setattr(offline, "ProcessPoolExecutor", ThreadPoolExecutor)
+
+
+@pytest.fixture
+def images(tmp_path, monkeypatch):
+    for name in ("a.jpg", "b.PNG", "c.jpg", "notes.txt"):
+        (tmp_path / name).write_bytes(b"")
+    decoded = []
+
+    def decode_file_job(path, scales=(1.0,)):
+        decoded.append((path.rsplit("/", 1)[-1], scales))
+        codes = {"a.jpg": ["A"], "b.PNG": ["A", "B"], "c.jpg": []}[path.rsplit("/", 1)[-1]]
+        return path, 0, [_detection(code) for code in codes], 0.01, []
+    monkeypatch.setattr(offline, "decode_file_job", decode_file_job)
+    return tmp_path, decoded
+
+
+@pytest.fixture
+def video(monkeypatch):
+    class VideoCapture:
+        def __init__(self, path):
+            self.frames = 5
+            self.read_ids = []
+            self.released = False
+
+        def isOpened(self):
+            return True
+
+        def grab(self):
+            self.frames -= 1
+            return self.frames >= 0
+
+        def read(self):
+            if not self.grab():
+                return False, None
+            return True, np.full((4, 4, 3), self.frames, np.uint8)
+
+        def release(self):
+            self.released = True
+
+    monkeypatch.setattr(decoding, "_cv2", types.SimpleNamespace(VideoCapture=VideoCapture))
+    frames = []
+
+    def decode_job(source, frame_id, image, roi=None, pad=0.5, scales=(1.0,)):
+        frames.append(frame_id)
+        return source, frame_id, [_detection("V")] if frame_id == 2 else [], 0.01, []
+    monkeypatch.setattr(offline, "decode_job", decode_job)
+    return frames
+
+
+def test_image_directory(images):
+    path, decoded = images
+    summary = offline.scan_offline(str(path), workers=2, scales=(0.5, 1.0), update_db=False)
+    assert sorted(decoded) == [("a.jpg", (0.5, 1.0)), ("b.PNG", (0.5, 1.0)), ("c.jpg", (0.5, 1.0))]
+    assert (summary["frames"], summary["detections"], summary["unique_codes"]) == (3, 3, 2)
+
+
+def test_image_directory_step(images):
+    path, decoded = images
+    offline.scan_offline(str(path), workers=1, step=2, update_db=False)
+    assert sorted(name for name, _scales in decoded) == ["a.jpg", "c.jpg"]
+
+
+def test_video_frames_with_step(video):
+    summary = offline.scan_offline("recording.mp4", workers=1, step=2, update_db=False)
+    # пропущенные кадры только grab, в декодер идут 0, 2, 4
+    assert sorted(video) == [0, 2, 4]
+    assert (summary["frames"], summary["unique_codes"]) == (3, 1)
+
+
+def test_statuses_written_once_at_the_end(images, database, monkeypatch):
+    database.execute_many("INSERT INTO products (id, status) VALUES (?, ?)",
+                          [(hash_from_barcode("A"), 1), (hash_from_barcode("B"), 1)])
+    calls = []
+    execute_many = offline.execute_many
+
+    def record(sql, params_seq, autocommit=True):
+        calls.append(list(params_seq))
+        execute_many(sql, params_seq, autocommit)
+    monkeypatch.setattr(offline, "execute_many", record)
+
+    offline.scan_offline(str(images[0]), workers=2)
+    status = Statuses.exists_production.value
+    assert [sorted(params) for params in calls] == [
+        sorted([(status, hash_from_barcode("A")), (status, hash_from_barcode("B"))])]
+    rows = database.fetch_all("SELECT status FROM products")
+    # status - TEXT колонка
+    assert {row["status"] for row in rows} == {str(status)}
+
+
+def test_no_db_leaves_statuses(images, monkeypatch):
+    monkeypatch.setattr(offline, "execute_many", lambda *args: pytest.fail("db written"))
+    offline.scan_offline(str(images[0]), workers=1, update_db=False)
+
+
+def _cli(monkeypatch, *args):
+    calls = []
+
+    def scan_offline(path, workers, scales, step=1, update_db=True):
+        calls.append((path, workers, scales, step, update_db))
+        return {"frames": 1, "codes_per_sec": 2.0}
+    monkeypatch.setattr(offline, "scan_offline", scan_offline)
+    monkeypatch.setattr(sys, "argv", ["qrscanner", *args])
+    cli.main()
+    return calls
+
+
+@pytest.mark.parametrize("flag", ["--no-db", "--dry-run"])
+def test_cli_offline_without_db(monkeypatch, capsys, flag):
+    calls = _cli(monkeypatch, "offline", "images", "--workers", "3", "--scales", "0.5,1", "--step", "0", flag)
+    assert calls == [("images", 3, (0.5, 1.0), 1, False)]
+    assert "codes_per_sec  2.0" in capsys.readouterr().out
+
+
+def test_cli_offline_writes_db_by_default(monkeypatch, capsys):
+    monkeypatch.setenv("QR_SCALES", "1")
+    assert _cli(monkeypatch, "offline", "video.mp4") == [("video.mp4", cli.os.cpu_count() or 1, (1.0,), 1, True)]
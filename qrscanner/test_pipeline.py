@@ -0,0 +1,139 @@
+import queue
+import sys
+import threading
+from concurrent.futures import Future
+
+import pytest
+
+np = pytest.importorskip("numpy")
+
+from qrscanner.decoding import Detection  # noqa: E402
+from qrscanner import pipeline as pipeline_module  # noqa: E402
+from qrscanner.pipeline import MotionGate, Pipeline, Source, StageStats, parse_scales  # noqa: E402
+
+
+def _pipeline(**kwargs) -> Pipeline:
+    return Pipeline(["cam"], workers=1, images=None, show=False, **kwargs)
+
+
+def test_failed_decode_frees_inflight_slot():
+    pipeline = _pipeline()
+    future = Future()
+    pipeline.inflight["cam"][7] = (0.0, 0.0, None)
+    pipeline._post_result("cam", 7, future)
+    future.set_exception(RuntimeError("decoder crashed"))
+
+    event = pipeline.events.get_nowait()
+    pipeline._handle_result(*event[1:])
+    assert pipeline.inflight["cam"] == {}
+
+
+def test_cancelled_decode_frees_inflight_slot():
+    pipeline = _pipeline()
+    future = Future()
+    future.cancel()
+    pipeline.inflight["cam"][1] = (0.0, 0.0, None)
+    pipeline._handle_result("cam", 1, future)
+    assert pipeline.inflight["cam"] == {}
+
+
+def test_dropped_db_update_is_not_deduplicated():
+    pipeline = _pipeline()
+    pipeline.db_queue.maxsize = 1
+    pipeline.db_queue.put_nowait("busy")
+
+    detection = Detection("code", (0, 0, 10, 10), [])
+    for frame_id in (1, 2):
+        future = Future()
+        future.set_result(("cam", frame_id, [detection], 0.01, []))
+        pipeline.inflight["cam"][frame_id] = (0.0, 0.0, np.zeros((4, 4, 3), np.uint8))
+        pipeline._handle_result("cam", frame_id, future)
+    # очередь в базу полна: код не запоминается и сработает, когда место появится
+    assert "code" not in pipeline.dedup.entries
+
+    pipeline.db_queue.get_nowait()
+    future = Future()
+    future.set_result(("cam", 3, [detection], 0.01, []))
+    pipeline.inflight["cam"][3] = (0.0, 0.0, np.zeros((4, 4, 3), np.uint8))
+    pipeline._handle_result("cam", 3, future)
+    assert pipeline.db_queue.qsize() == 1
+
+
+@pytest.mark.parametrize("value, scales", [
+    ("0.5,1", (0.5, 1.0)),
+    ("1, 0.25,0.5,1", (0.25, 0.5, 1.0)),
+    ("", (1.0,)),
+    (" , ", (1.0,)),
+])
+def test_parse_scales(value, scales):
+    assert parse_scales(value) == scales
+
+
+@pytest.mark.parametrize("value", ["0,1", "-0.5", "half"])
+def test_parse_scales_rejects_invalid(value):
+    with pytest.raises(ValueError):
+        parse_scales(value)
+
+
+def test_tap_reopen_does_not_grow_sys_path(monkeypatch):
+    frametap = pytest.importorskip("frametap")
+
+    class FakeReader:
+        def __init__(self, hash):
+            self.hash = hash
+
+        def close(self):
+            pass
+
+    monkeypatch.setattr(frametap, "FrameReader", FakeReader)
+    source = Source("tap:cam", StageStats(), queue.Queue(), threading.Event(), MotionGate(0.002, 8, 2))
+    before = list(sys.path)
+    for _ in range(3):
+        _read, close = source._open()
+        close()
+    assert sys.path == before
+    assert sys.path.count(pipeline_module._CAMERAS_PATH) == 1
+
+
+def _frame(value=0):
+    return np.full((64, 64, 3), value, dtype=np.uint8)
+
+
+def test_motion_gate_skips_static_frame():
+    gate = MotionGate(threshold=0.01, step=8, max_interval=2)
+    assert gate.changed(_frame(), now=0) is True
+    assert gate.changed(_frame(), now=0.1) is False
+    # шум ниже порога яркости - не движение
+    assert gate.changed(_frame(20), now=0.2) is False
+
+
+def test_motion_gate_passes_motion_above_threshold():
+    gate = MotionGate(threshold=0.01, step=8, max_interval=2)
+    gate.changed(_frame(), now=0)
+    moved = _frame()
+    moved[:16, :16] = 255
+    assert gate.changed(moved, now=0.1) is True
+    # опорный кадр - последний пропущенный
+    assert gate.changed(moved, now=0.2) is False
+
+
+def test_motion_gate_below_threshold_skipped():
+    gate = MotionGate(threshold=0.5, step=8, max_interval=2)
+    gate.changed(_frame(), now=0)
+    moved = _frame()
+    moved[:16, :16] = 255
+    assert gate.changed(moved, now=0.1) is False
+
+
+def test_motion_gate_max_interval_forces_decode():
+    gate = MotionGate(threshold=0.01, step=8, max_interval=2)
+    gate.changed(_frame(), now=0)
+    assert gate.changed(_frame(), now=1.9) is False
+    assert gate.changed(_frame(), now=2.0) is True
+    assert gate.changed(_frame(), now=2.5) is False
+
+
+def test_motion_gate_disabled_passes_everything():
+    gate = MotionGate(threshold=0, step=8, max_interval=2)
+    assert gate.changed(_frame(), now=0) is True
+    assert gate.changed(_frame(), now=0) is True
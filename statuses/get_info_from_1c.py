@@ -1,12 +1,17 @@
-import requests
+import json
+import threading
+import time
 
+from db.db import fetch_one, transaction
+from statuses.product_id import hash_from_barcode
+from statuses.status_cache import status_cache
 from statuses.types_of_statuses import Statuses
 
-from db.db import *
 
+def get_qr_info_and_insert(url: str, timeout: float = 10):
+    import requests
 
-def get_qr_info_and_insert(url: str):
-    response = requests.get(url)
+    response = requests.get(url, timeout=timeout)
 
     if response.status_code == 200:
         data = response.json()
@@ -18,9 +23,36 @@ def get_qr_info_and_insert(url: str):
             if existing_record:
                 print("Record with this QR code already exists.")
             else:
-                execute("INSERT INTO products (qr_code, status) VALUES (?, ?)", (qr_code, Statuses.expected_production))
+                # id - тот же hash, по которому сканер обновляет статус
+                product_id = hash_from_barcode(qr_code)
+                # код и товар появляются вместе или не появляются вовсе
+                with transaction() as db:
+                    db.execute("INSERT INTO qr_data (qr_code, payload) VALUES (?, ?)",
+                               (qr_code, json.dumps(data, ensure_ascii=False)))
+                    db.execute("INSERT OR IGNORE INTO products (id, qr_code, status) VALUES (?, ?, ?)",
+                               (product_id, qr_code, Statuses.expected_production.value))
+                # кеш мог запомнить, что такого товара нет
+                status_cache.invalidate(product_id, qr_code)
 
         return data
     else:
         print("Failed to fetch data. Status code:", response.status_code)
         return None
+
+
+def start_sync(url: str, interval: float = 0) -> threading.Thread:
+    """Синхронизация с 1С в фоновом потоке: один раз или каждые interval секунд"""
+
+    def run():
+        while True:
+            try:
+                get_qr_info_and_insert(url)
+            except Exception as e:
+                print("1C sync failed:", repr(e))
+            if not interval:
+                return
+            time.sleep(interval)
+
+    thread = threading.Thread(target=run, name="1c-sync", daemon=True)
+    thread.start()
+    return thread
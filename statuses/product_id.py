@@ -0,0 +1,8 @@
+import hashlib
+
+
+def hash_from_barcode(barcode_data: str) -> str:
+    """функция для преобразования данных из qr-кода в hash - id товара в products"""
+
+    barcode_bytes = barcode_data.encode('utf-8')
+    return hashlib.md5(barcode_bytes).hexdigest()
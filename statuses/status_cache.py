@@ -0,0 +1,142 @@
+import sys
+import threading
+from collections import OrderedDict
+
+from db.db import execute_later, fetch_iter, fetch_one, get_pending
+from statuses.types_of_statuses import Statuses
+
+_UPDATE_STATUS = "UPDATE products SET status = ? WHERE id = ?;"
+
+# товар есть в кеше, но в базе его нет: повторный промах не идет в базу
+_MISSING = object()
+# товара нет в кеше
+_ABSENT = object()
+
+
+class StatusCache:
+    """
+    Ограниченный LRU кеш статусов товаров по id (hash кода) и по qr-коду.
+    Заполняется одним запросом при старте, обновляется при записи статуса
+    через update_status и сбрасывается синхронизацией с 1С
+    """
+
+    def __init__(self, max_size: int = 100000):
+        self.max_size = max_size
+        self.lock = threading.Lock()
+        # id -> Statuses или _MISSING
+        self.statuses = OrderedDict()
+        self.ids_by_qr = {}
+        self.qr_by_id = {}
+        self.hits = 0
+        self.misses = 0
+
+    def warm(self) -> int:
+        """Загружает до max_size товаров одним запросом, возвращает их количество"""
+        rows = fetch_iter("SELECT id, qr_code, status FROM products LIMIT ?", (self.max_size,), row_type="tuple")
+        count = 0
+        with self.lock:
+            for product_id, qr_code, status in rows:
+                self._put(product_id, qr_code, _to_status(status))
+                count += 1
+        return count
+
+    def get(self, product_id: str) -> Statuses | None:
+        with self.lock:
+            status = self.statuses.get(product_id, _ABSENT)
+            if status is not _ABSENT:
+                self.hits += 1
+                self.statuses.move_to_end(product_id)
+                return None if status is _MISSING else status
+            self.misses += 1
+
+        return self._load(product_id)
+
+    def get_by_qr(self, qr_code: str) -> Statuses | None:
+        with self.lock:
+            product_id = self.ids_by_qr.get(qr_code)
+        if product_id is not None:
+            return self.get(product_id)
+
+        with self.lock:
+            self.misses += 1
+        row = fetch_one("SELECT id FROM products WHERE qr_code = ?", (qr_code,), flush=False)
+        if not row:
+            return None
+        return self._load(row["id"])
+
+    def update_status(self, product_id: str, status: Statuses) -> None:
+        """Пишет статус в базу (отложенно) и сразу в кеш"""
+        execute_later(_UPDATE_STATUS, (status.value, product_id), key=product_id)
+        with self.lock:
+            if self.statuses.get(product_id) is not _MISSING:
+                self._put(product_id, self.qr_by_id.get(product_id), status)
+
+    def invalidate(self, product_id: str | None = None, qr_code: str | None = None) -> None:
+        """Сбрасывает записи товара; без аргументов - весь кеш"""
+        with self.lock:
+            if product_id is None and qr_code is None:
+                self.statuses.clear()
+                self.ids_by_qr.clear()
+                self.qr_by_id.clear()
+                return
+            if product_id is None:
+                product_id = self.ids_by_qr.get(qr_code)
+            if qr_code is not None:
+                self.ids_by_qr.pop(qr_code, None)
+            if product_id is not None:
+                self._remove(product_id)
+
+    def stats(self) -> dict[str, float]:
+        with self.lock:
+            total = self.hits + self.misses
+            # примерный размер: контейнеры и ключи, сами Statuses - общие объекты enum
+            memory = sys.getsizeof(self.statuses) + sys.getsizeof(self.ids_by_qr) + sys.getsizeof(self.qr_by_id)
+            memory += sum(sys.getsizeof(key) for key in self.statuses)
+            memory += sum(sys.getsizeof(key) for key in self.ids_by_qr)
+            return {
+                "status_cache_hits": self.hits,
+                "status_cache_misses": self.misses,
+                "status_cache_hit_ratio": round(self.hits / total, 3) if total else 0.0,
+                "status_cache_size": len(self.statuses),
+                "status_cache_bytes": memory,
+            }
+
+    def _load(self, product_id: str) -> Statuses | None:
+        # промах не сбрасывает отложенную запись: еще не записанный статус берем из ее очереди.
+        # очередь читаем до базы, чтобы сброс между двумя чтениями не вернул старое значение
+        pending = get_pending(_UPDATE_STATUS, product_id)
+        row = fetch_one("SELECT qr_code, status FROM products WHERE id = ?", (product_id,), flush=False)
+        with self.lock:
+            if row:
+                status = pending[0] if pending else row["status"]
+                return self._put(product_id, row["qr_code"], _to_status(status))
+            self._put(product_id, None, _MISSING)
+        return None
+
+    def _put(self, product_id: str, qr_code: str | None, status):
+        self.statuses[product_id] = status
+        self.statuses.move_to_end(product_id)
+        if qr_code is not None:
+            self.ids_by_qr[qr_code] = product_id
+            self.qr_by_id[product_id] = qr_code
+        while len(self.statuses) > self.max_size:
+            old_id, _status = self.statuses.popitem(last=False)
+            self._remove(old_id)
+        return None if status is _MISSING else status
+
+    def _remove(self, product_id: str) -> None:
+        self.statuses.pop(product_id, None)
+        qr_code = self.qr_by_id.pop(product_id, None)
+        if qr_code is not None and self.ids_by_qr.get(qr_code) == product_id:
+            del self.ids_by_qr[qr_code]
+
+
+def _to_status(value) -> Statuses | None:
+    # колонка status - TEXT, значения enum в ней хранятся строками
+    try:
+        return Statuses(int(value))
+    except (TypeError, ValueError):
+        return None
+
+
+status_cache = StatusCache()
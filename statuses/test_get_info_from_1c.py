@@ -0,0 +1,43 @@
+import sqlite3
+import sys
+import types
+
+import pytest
+
+from statuses import get_info_from_1c
+from statuses.product_id import hash_from_barcode
+
+
+class Response:
+    status_code = 200
+
+    def __init__(self, data):
+        self.data = data
+
+    def json(self):
+        return self.data
+
+
+@pytest.fixture
+def requests_get(monkeypatch):
+    # get_qr_info_and_insert импортирует requests при вызове
+    module = types.ModuleType("requests")
+    monkeypatch.setitem(sys.modules, "requests", module)
+    return module
+
+
+def test_code_and_product_inserted_together(database, requests_get):
+    requests_get.get = lambda url, timeout: Response({"qr_code": "qr-1", "name": "товар"})
+    assert get_info_from_1c.get_qr_info_and_insert("http://1c") == {"qr_code": "qr-1", "name": "товар"}
+
+    product = database.fetch_one("SELECT id, status FROM products WHERE qr_code = ?", ("qr-1",))
+    assert product == {"id": hash_from_barcode("qr-1"), "status": "1"}
+    assert database.fetch_one("SELECT payload FROM qr_data WHERE qr_code = ?", ("qr-1",))
+
+
+def test_failed_product_insert_rolls_back_code(database, requests_get):
+    requests_get.get = lambda url, timeout: Response({"qr_code": "qr-1"})
+    database.execute("CREATE TRIGGER fail BEFORE INSERT ON products BEGIN SELECT RAISE(ABORT, 'fail'); END")
+    with pytest.raises(sqlite3.IntegrityError):
+        get_info_from_1c.get_qr_info_and_insert("http://1c")
+    assert database.fetch_one("SELECT COUNT(*) AS n FROM qr_data")["n"] == 0
@@ -0,0 +1,52 @@
+from statuses.status_cache import StatusCache
+from statuses.types_of_statuses import Statuses
+
+
+def _fill(database):
+    database.execute_many("INSERT INTO products (id, status, qr_code) VALUES (?, ?, ?)",
+                          [("a", "1", "qr-a"), ("b", "3", "qr-b")])
+
+
+def test_warm_and_hits(database):
+    _fill(database)
+    cache = StatusCache()
+    assert cache.warm() == 2
+    assert cache.get("a") is Statuses.expected_production
+    assert cache.get_by_qr("qr-b") is Statuses.expected_buffer
+    assert cache.stats()["status_cache_hits"] == 2
+
+
+def test_miss_does_not_flush_write_behind(database):
+    _fill(database)
+    StatusCache().update_status("a", Statuses.exists_production)
+    assert database._pending
+
+    # другой кеш без этой записи: промах читает базу и видит еще не записанный статус
+    cache = StatusCache()
+    assert cache.get("a") is Statuses.exists_production
+    assert cache.get_by_qr("qr-b") is Statuses.expected_buffer
+    assert database._pending
+    assert cache.stats()["status_cache_misses"] == 2
+
+
+def test_missing_product_cached(database):
+    cache = StatusCache()
+    assert cache.get("nope") is None
+    assert cache.get("nope") is None
+    assert cache.stats()["status_cache_hits"] == 1
+    assert cache.get_by_qr("qr-nope") is None
+
+
+def test_update_invalidate_and_eviction(database):
+    _fill(database)
+    cache = StatusCache(max_size=1)
+    cache.warm()
+    cache.update_status("a", Statuses.exists_buffer)
+    assert cache.get("a") is Statuses.exists_buffer
+    cache.invalidate(qr_code="qr-a")
+    assert "a" not in cache.statuses
+
+    cache.get("b")
+    cache.get("a")
+    assert list(cache.statuses) == ["a"]
+    assert cache.ids_by_qr == {"qr-a": "a"}